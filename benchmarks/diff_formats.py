@@ -0,0 +1,99 @@
+"""Compare the diff formats of pygitai by token count and render time.
+
+Usage:
+    python benchmarks/diff_formats.py [REPO ...] [--commits N]
+
+The diffs of the last N commits of each repository are used as
+samples. Tokens are counted with tiktoken if it's installed, otherwise
+the estimation of `pygitai.common.llm.OpenAI` is used.
+"""
+import argparse
+import subprocess
+import time
+from pathlib import Path
+
+from pygitai.common.diff_format import DIFF_FORMATS, format_diff
+from pygitai.common.utils import load_template_file
+
+TEMPLATE_PATH = (
+    Path(__file__).parent.parent
+    / "pygitai"
+    / "templates"
+    / "prompts"
+    / "openai"
+    / "commit_title_user.txt"
+)
+
+
+def get_token_counter():
+    try:
+        import tiktoken
+
+        encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # not installed or the encoding can't be downloaded
+        return "chars/4", lambda text: len(text) // 4
+    return "tiktoken cl100k_base", lambda text: len(encoding.encode(text))
+
+
+def get_sample_diffs(repo: Path, commits: int) -> list[str]:
+    hashes = subprocess.run(
+        [
+            "git",
+            "-C",
+            repo.as_posix(),
+            "log",
+            "--no-merges",
+            f"-n{commits}",
+            "--format=%H",
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+        check=True,
+    ).stdout.split()
+    return [
+        subprocess.run(
+            ["git", "-C", repo.as_posix(), "show", "--format=", commit_hash],
+            stdout=subprocess.PIPE,
+            text=True,
+            errors="replace",
+            check=True,
+        ).stdout
+        for commit_hash in hashes
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("repos", nargs="*", type=Path, default=[Path(".")])
+    parser.add_argument("--commits", type=int, default=50)
+    args = parser.parse_args()
+
+    counter_name, count_tokens = get_token_counter()
+    print(f"Token counter: {counter_name}")
+    print(f"{'repo':<30} {'format':<8} {'tokens':>10} {'chars':>12} {'render ms':>10}")
+    for repo in args.repos:
+        diffs = get_sample_diffs(repo, args.commits)
+        for diff_format in DIFF_FORMATS:
+            tokens = chars = 0
+            render_time = 0.0
+            for diff in diffs:
+                start = time.perf_counter()
+                prompt = load_template_file(
+                    template_path=TEMPLATE_PATH,
+                    context={
+                        "diff": format_diff(diff, diff_format=diff_format),
+                        "purpose": "benchmark",
+                    },
+                )
+                render_time += time.perf_counter() - start
+                tokens += count_tokens(prompt)
+                chars += len(prompt)
+            print(
+                f"{repo.resolve().name:<30} {diff_format:<8} {tokens:>10} "
+                f"{chars:>12} {render_time * 1000:>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
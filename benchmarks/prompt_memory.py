@@ -0,0 +1,111 @@
+"""Compare the peak memory of prompt assembly for a large diff.
+
+Usage:
+    python benchmarks/prompt_memory.py [--diff-mb M] [--diff-format F]
+
+A synthetic diff of M MB (default 50) is turned into the JSON body of
+an OpenAI request and the stored session, once with plain strings
+(every step creates a full copy) and once with the streaming helpers
+of `pygitai.common.streaming`. The peak memory of both is measured
+with tracemalloc, not counting the diff itself.
+"""
+import argparse
+import json
+import tracemalloc
+import zlib
+from pathlib import Path
+
+from pygitai.common.diff_format import format_diff, format_diff_chunks
+from pygitai.common.streaming import JSONBody, compress_json
+from pygitai.common.utils import load_template_file, render_template_chunks
+
+TEMPLATE_PATH = (
+    Path(__file__).parent.parent
+    / "pygitai"
+    / "templates"
+    / "prompts"
+    / "openai"
+    / "commit_title_user.txt"
+)
+LINE = "+value_{index} = compute_{index}(alpha, beta, gamma)  # synthetic line\n"
+FILE_SIZE = 256 * 1024
+
+
+def generate_diff(size: int) -> dict[str, str]:
+    diff = {}
+    line_size = len(LINE.format(index=0))
+    for file_index in range(max(1, size // FILE_SIZE)):
+        file_name = f"src/module_{file_index}.py"
+        lines = "".join(
+            LINE.format(index=index) for index in range(FILE_SIZE // line_size)
+        )
+        diff[file_name] = (
+            f"diff --git a/{file_name} b/{file_name}\n"
+            f"--- a/{file_name}\n+++ b/{file_name}\n@@ -0,0 +1 @@\n{lines}"
+        )
+    return diff
+
+
+def assemble_strings(diff: dict[str, str], diff_format: str):
+    content = load_template_file(
+        TEMPLATE_PATH,
+        {"diff": format_diff(diff, diff_format), "purpose": "Benchmark"},
+    )
+    prompt = [{"role": "user", "content": content}]
+    body = json.dumps({"model": "benchmark", "messages": prompt}).encode()
+    full_context = prompt + [{"role": "assistant", "content": "Title"}]
+    session = zlib.compress(json.dumps({"full_context": full_context}).encode())
+    return len(body), len(session)
+
+
+def assemble_streamed(diff: dict[str, str], diff_format: str):
+    content = render_template_chunks(
+        TEMPLATE_PATH,
+        {"diff": format_diff_chunks(diff, diff_format), "purpose": "Benchmark"},
+    )
+    prompt = [{"role": "user", "content": content}]
+    body = JSONBody({"model": "benchmark", "messages": prompt})
+    # the body is consumed piece by piece like by the http client
+    length = len(body)
+    for _ in body:
+        pass
+    full_context = prompt + [{"role": "assistant", "content": "Title"}]
+    session = compress_json({"full_context": full_context})
+    return length, len(session)
+
+
+def measure(func, *args) -> tuple[int, tuple]:
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    result = func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - baseline, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--diff-mb", type=float, default=50.0)
+    parser.add_argument("--diff-format", type=str, default="raw")
+    args = parser.parse_args()
+
+    diff = generate_diff(int(args.diff_mb * 1024 * 1024))
+    diff_size = sum(len(file_diff) for file_diff in diff.values())
+    print(f"Diff: {diff_size / 1024 / 1024:.1f} MB in {len(diff)} files")
+
+    results = {}
+    for name, func in [("strings", assemble_strings), ("streamed", assemble_streamed)]:
+        peak, (body_size, session_size) = measure(func, diff, args.diff_format)
+        results[name] = (body_size, session_size)
+        print(
+            f"{name:<10} peak {peak / 1024 / 1024:8.1f} MB "
+            f"({peak / diff_size:.2f}x diff), body {body_size} bytes, "
+            f"session {session_size} bytes"
+        )
+    if results["strings"][0] != results["streamed"][0]:
+        print("Warning: the request bodies differ in size")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Generate synthetic git repositories for benchmarks.
+
+Usage:
+    python benchmarks/repo_generator.py PATH [--files N] [--staged-mb M]
+        [--binary-files B] [--renames R] [--branches K]
+
+The repository gets an initial commit on `main` with N text files.
+Afterwards M MB of changes, B binary files and R renames are staged
+and K branches pointing to the initial commit are created. The staged
+changes are committed to the branch `review` as well (without moving
+HEAD), so they can be used for branch diffs.
+"""
+import argparse
+import os
+import random
+import subprocess
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+LINE = "value_{index} = compute_{index}(alpha, beta, gamma)  # synthetic line\n"
+
+
+@dataclass
+class RepoSpec:
+    files: int = 200
+    staged_mb: float = 1.0
+    binary_files: int = 5
+    renames: int = 20
+    branches: int = 1000
+    seed: int = 0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def git(repo: Path, *args: str, input: str | None = None):
+    subprocess.run(
+        ["git", "-C", repo.as_posix(), *args],
+        input=input,
+        text=True,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def git_output(repo: Path, *args: str) -> str:
+    return subprocess.run(
+        ["git", "-C", repo.as_posix(), *args],
+        stdout=subprocess.PIPE,
+        text=True,
+        check=True,
+    ).stdout.strip()
+
+
+def file_content(index: int, lines: int) -> str:
+    return "".join(LINE.format(index=index * 1000 + i) for i in range(lines))
+
+
+def generate_repo(path: Path, spec: RepoSpec) -> Path:
+    """Create a repository at `path` according to `spec`"""
+    rng = random.Random(spec.seed)
+    path.mkdir(parents=True, exist_ok=False)
+    git(path, "init", "-q", "-b", "main")
+    git(path, "config", "user.email", "bench@example.com")
+    git(path, "config", "user.name", "pygitai benchmark")
+    git(path, "config", "commit.gpgsign", "false")
+
+    src = path / "src"
+    src.mkdir()
+    for index in range(spec.files):
+        (src / f"module_{index}.py").write_text(file_content(index, 50))
+    git(path, "add", "-A")
+    git(path, "commit", "-q", "-m", "Initial commit")
+
+    # thousands of branches are created with a single update-ref call
+    head = git_output(path, "rev-parse", "HEAD")
+    git(
+        path,
+        "update-ref",
+        "--stdin",
+        input="".join(
+            f"create refs/heads/feature/branch-{i} {head}\n"
+            for i in range(spec.branches)
+        ),
+    )
+
+    # modifications are spread over the files until M MB are reached
+    line_size = len(LINE.format(index=0))
+    lines_total = int(spec.staged_mb * 1024 * 1024 / line_size)
+    modified_files = max(1, min(spec.files - spec.renames, spec.files // 2))
+    lines_per_file = max(1, lines_total // modified_files)
+    for index in range(modified_files):
+        file_path = src / f"module_{index}.py"
+        file_path.write_text(
+            file_content(index, 25) + file_content(index + spec.files, lines_per_file)
+        )
+
+    for index in range(spec.binary_files):
+        (path / f"asset_{index}.bin").write_bytes(rng.randbytes(64 * 1024))
+
+    for index in range(spec.files - spec.renames, spec.files):
+        git(path, "mv", f"src/module_{index}.py", f"src/renamed_{index}.py")
+
+    git(path, "add", "-A")
+
+    # commit the staged changes to a separate branch without touching
+    # HEAD or the index
+    tree = git_output(path, "write-tree")
+    commit = git_output(path, "commit-tree", tree, "-p", head, "-m", "Review")
+    git(path, "update-ref", "refs/heads/review", commit)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", type=Path)
+    for field, default in RepoSpec().to_dict().items():
+        parser.add_argument(
+            f"--{field.replace('_', '-')}", type=type(default), default=default
+        )
+    args = parser.parse_args()
+    spec = RepoSpec(**{field: getattr(args, field) for field in RepoSpec().to_dict()})
+    generate_repo(args.path, spec)
+    index_size = os.path.getsize(args.path / ".git" / "index")
+    print(f"Generated {args.path} ({index_size} bytes index)")
+
+
+if __name__ == "__main__":
+    main()
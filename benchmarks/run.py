@@ -0,0 +1,239 @@
+"""Benchmark suite of pygitai.
+
+Usage:
+    python benchmarks/run.py [--repeat N] [--output FILE] [--compare FILE]
+        [--llm-latency SECONDS] [--files N] [--staged-mb M] ...
+
+A synthetic repository is generated (see `repo_generator.py`) and the
+hot paths of pygitai are timed in it: the git state, branch diffs,
+template rendering, token counting and the `commit` and `pr-review`
+pipelines. The LLM is simulated by `simulated_llm.py`, so no network
+access is needed.
+
+The results are written as JSON to `benchmarks/results/` by default.
+Pass the file of an earlier run with `--compare` to print the change
+of each benchmark.
+"""
+import argparse
+import builtins
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable
+
+from repo_generator import RepoSpec, generate_repo
+
+BENCHMARK_DIR = Path(__file__).parent
+PACKAGE_DIR = BENCHMARK_DIR.parent / "pygitai"
+RESULTS_DIR = BENCHMARK_DIR / "results"
+PROMPT_TEMPLATE_DIR = PACKAGE_DIR / "templates" / "prompts" / "openai"
+
+CONFIG = """[pygitai]
+default_llm_api = Simulated
+default_llm_model = simulated
+default_prompt_template_dir = {prompt_template_dir}
+"""
+
+
+def prepare_repo(repo: Path):
+    """Configure pygitai in the repository to use the simulated LLM.
+
+    This has to happen before pygitai is imported, the config is read
+    on import.
+    """
+    pygitai_dir = repo / ".pygitai"
+    pygitai_dir.mkdir()
+    (pygitai_dir / ".gitignore").write_text("*")
+    (pygitai_dir / "config.ini").write_text(
+        CONFIG.format(prompt_template_dir=PROMPT_TEMPLATE_DIR.resolve())
+    )
+    customization_dir = pygitai_dir / "pygitai_customization"
+    shutil.copytree(PACKAGE_DIR / "assets" / "pygitai_customization", customization_dir)
+    shutil.copy(BENCHMARK_DIR / "simulated_llm.py", customization_dir / "llm")
+
+
+@contextmanager
+def quiet():
+    """Silence the output of git subprocesses"""
+    sys.stdout.flush()
+    saved_stdout = os.dup(1)
+    with open(os.devnull, "w") as devnull:
+        os.dup2(devnull.fileno(), 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved_stdout, 1)
+        os.close(saved_stdout)
+
+
+def measure(func: Callable, repeat: int, teardown: Callable | None = None) -> dict:
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+        if teardown is not None:
+            teardown()
+    return {"min": min(runs), "median": statistics.median(runs), "runs": runs}
+
+
+def get_benchmarks() -> dict[str, tuple[Callable, Callable | None]]:
+    """Get the benchmarks by name. The values are the function to time
+    and an optional teardown which is not timed."""
+    from pygitai import cli
+    from pygitai.common.diff_format import format_diff
+    from pygitai.common.git import Git, GitState, state
+    from pygitai.common.llm.openai import OpenAI
+    from pygitai.common.utils import load_template_file
+
+    diff = Git.get_diff_between_branches("main", "review")
+    context = {"purpose": "Benchmark", "diff": format_diff(diff)}
+    template = PROMPT_TEMPLATE_DIR / "commit_title_user.txt"
+    prompt = [{"role": "user", "content": load_template_file(template, context)}]
+    pairs_file = Path(".pygitai") / "benchmark_pairs.txt"
+    pairs_file.write_text("review main\n")
+
+    def run_command(argv: list[str]):
+        with quiet():
+            cli.run(argv)
+
+    def reset_commit():
+        subprocess.run(["git", "reset", "-q", "--soft", "HEAD~1"], check=True)
+        state.refresh()
+
+    return {
+        "git_state.from_base_commands": (GitState.from_base_commands, None),
+        "git.get_diff_between_branches": (
+            lambda: Git.get_diff_between_branches("main", "review"),
+            None,
+        ),
+        "template.render": (lambda: load_template_file(template, context), None),
+        "llm.token_count": (lambda: OpenAI.get_prompt_token_count(prompt), None),
+        "cmd.commit": (lambda: run_command(["commit"]), reset_commit),
+        "cmd.pr_review": (
+            lambda: run_command(
+                ["pr-review", "--batch", pairs_file.as_posix(), "--output", os.devnull]
+            ),
+            None,
+        ),
+    }
+
+
+def get_git_revision() -> str | None:
+    response = subprocess.run(
+        ["git", "-C", BENCHMARK_DIR.as_posix(), "rev-parse", "HEAD"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    return response.stdout.strip() if response.returncode == 0 else None
+
+
+def run_benchmarks(spec: RepoSpec, repeat: int, only: list[str] | None) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        repo = Path(tmp_dir) / "repo"
+        start = time.perf_counter()
+        generate_repo(repo, spec)
+        print(f"Generated repository in {time.perf_counter() - start:.1f}s")
+        prepare_repo(repo)
+        os.chdir(repo)
+
+        # the user accepts every suggestion of the simulated LLM
+        builtins.input = lambda *args: "y"
+        sys.path.insert(0, BENCHMARK_DIR.parent.as_posix())
+        benchmarks = get_benchmarks()
+
+        results = {}
+        for name, (func, teardown) in benchmarks.items():
+            if only and name not in only:
+                continue
+            results[name] = measure(func, repeat, teardown)
+            print(
+                f"{name:<36} min {results[name]['min'] * 1000:10.2f} ms "
+                f"median {results[name]['median'] * 1000:10.2f} ms"
+            )
+
+    return {
+        "meta": {
+            "revision": get_git_revision(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "llm_latency": float(os.environ.get("PYGITAI_BENCH_LLM_LATENCY", 0)),
+            "spec": spec.to_dict(),
+        },
+        "results": results,
+    }
+
+
+def compare(old: dict, new: dict):
+    if old["meta"]["spec"] != new["meta"]["spec"]:
+        print("Warning: the results were measured with different repositories")
+    print(f"{'benchmark':<36} {'old ms':>10} {'new ms':>10} {'change':>8}")
+    for name, result in new["results"].items():
+        if name not in old["results"]:
+            continue
+        old_median = old["results"][name]["median"]
+        new_median = result["median"]
+        change = (new_median - old_median) / old_median * 100 if old_median else 0
+        print(
+            f"{name:<36} {old_median * 1000:10.2f} {new_median * 1000:10.2f} "
+            f"{change:+7.1f}%"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--output", type=Path, default=None, help="Default: benchmarks/results/"
+    )
+    parser.add_argument("--compare", type=Path, default=None)
+    parser.add_argument(
+        "--only", nargs="*", default=None, help="Names of the benchmarks to run"
+    )
+    parser.add_argument(
+        "--llm-latency",
+        type=float,
+        default=0.0,
+        help="Seconds the simulated LLM needs for a response",
+    )
+    for field, default in RepoSpec().to_dict().items():
+        parser.add_argument(
+            f"--{field.replace('_', '-')}", type=type(default), default=default
+        )
+    args = parser.parse_args()
+
+    spec = RepoSpec(**{field: getattr(args, field) for field in RepoSpec().to_dict()})
+    os.environ["PYGITAI_BENCH_LLM_LATENCY"] = str(args.llm_latency)
+    # keep the output of the commands readable
+    os.environ.setdefault("PYGIT_LOG_LEVEL", "WARNING")
+    os.environ["PYGITAI_NO_DAEMON"] = "1"
+
+    output = args.output
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        output = RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output = output.resolve()
+    compare_file = args.compare.resolve() if args.compare else None
+
+    new = run_benchmarks(spec, args.repeat, args.only)
+    output.write_text(json.dumps(new, indent=2))
+    print(f"Results written to {output}")
+
+    if compare_file is not None:
+        compare(json.loads(compare_file.read_text()), new)
+
+
+if __name__ == "__main__":
+    main()
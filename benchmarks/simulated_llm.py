@@ -0,0 +1,40 @@
+import os
+import time
+
+from pygitai.common.llm.base import LLMBase, ParserBase
+
+# This module is copied into the customization directory of the
+# benchmark repository, it's loaded as custom LLM by pygitai.
+
+
+class SimulatedParser(ParserBase[dict, list, str]):
+    @staticmethod
+    def parse_response(response, prompt=None):
+        return response["content"]
+
+    @staticmethod
+    def parse_prompt(input_data):
+        return [{"role": row.role, "content": row.text} for row in input_data]
+
+
+class Simulated(LLMBase[list, str]):
+    """LLM backend which answers after a fixed latency without any
+    network access. The latency in seconds is set by
+    `PYGITAI_BENCH_LLM_LATENCY`."""
+
+    llm_parser = SimulatedParser
+    # like OpenAI
+    streamed_prompt = True
+
+    @classmethod
+    def get_input_token_count(cls, prompt):
+        return sum(len(row["content"]) for row in prompt) // 4
+
+    @classmethod
+    def exec_prompt(cls, prompt, model):
+        time.sleep(float(os.environ.get("PYGITAI_BENCH_LLM_LATENCY", 0)))
+        response = {"content": f"Simulated response of {model}"}
+        parsed_llm_response = cls.llm_parser.parse_response(response, prompt)
+        return parsed_llm_response, prompt + [
+            {"role": "assistant", "content": parsed_llm_response}
+        ]
@@ -0,0 +1,254 @@
+"""A HTTP cache of LLM results which is shared by a team.
+
+The server is started by `pygitai cache-server`. Clients (see
+`llm.cache`) look up the result of a prompt by its key before the LLM
+is called and store the result afterwards. The values are opaque to
+the server, they are stored as they are sent.
+
+API:
+
+- `GET /v1/entries/<key>`: The value (200) or 404.
+- `PUT /v1/entries/<key>`: Store the body as value (204).
+- `GET /v1/stats`: The number of entries, their size, hits and misses.
+
+If tokens are configured, every request needs an `Authorization:
+Bearer <token>` header with one of them. The entries are stored in a
+sqlite database. If their total size exceeds the maximum size, the
+least recently used entries are evicted.
+"""
+import hmac
+import json
+import re
+import sqlite3
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from pygitai.common import config, get_logger
+
+logger = get_logger(__name__, config.logger.level)
+
+# sha256 hex digests (see `llm.cache.get_key`)
+KEY_PATTERN = re.compile(r"/v1/entries/([0-9a-f]{64})")
+# the number of entries which are deleted at once while evicting
+EVICTION_BATCH_SIZE = 100
+
+
+class CacheStore:
+    """The entries of the cache in a sqlite database. The size of
+    all entries is kept below `max_size` bytes by evicting the least
+    recently used entries.
+
+    Attributes:
+        db_path: The path of the database.
+        max_size: The maximum size of all values in bytes.
+    """
+
+    def __init__(self, db_path: Path, max_size: int):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)"
+        )
+        (self.size,) = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        with self._lock:
+            self._evict()
+            self._connection.commit()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._connection.execute(
+                "UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+            self._connection.commit()
+            return row[0]
+
+    def put(self, key: str, value: bytes):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT size FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            self._connection.execute(
+                """
+                INSERT OR REPLACE INTO entries (key, value, size, accessed_at)
+                VALUES (?, ?, ?, ?)
+                """,
+                (key, value, len(value), time.time()),
+            )
+            self.size += len(value) - (row[0] if row else 0)
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self):
+        """Delete the least recently used entries until the size is
+        below the maximum. The lock must be held."""
+        while self.size > self.max_size:
+            rows = self._connection.execute(
+                "SELECT key, size FROM entries ORDER BY accessed_at LIMIT ?",
+                (EVICTION_BATCH_SIZE,),
+            ).fetchall()
+            if not rows:
+                self.size = 0
+                return
+            evicted = []
+            for key, size in rows:
+                if self.size <= self.max_size:
+                    break
+                evicted.append((key,))
+                self.size -= size
+            self._connection.executemany("DELETE FROM entries WHERE key = ?", evicted)
+            logger.info("Evicted %d entries, %d bytes left", len(evicted), self.size)
+
+    def stats(self) -> dict:
+        with self._lock:
+            (entries,) = self._connection.execute(
+                "SELECT COUNT(*) FROM entries"
+            ).fetchone()
+            return {
+                "entries": entries,
+                "size": self.size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class CacheRequestHandler(BaseHTTPRequestHandler):
+    """Handle the requests of the cache API. The store and the
+    settings are set on the server (see `serve`)."""
+
+    server: "CacheServer"
+    protocol_version = "HTTP/1.1"
+
+    def is_authorized(self) -> bool:
+        if not self.server.tokens:
+            return True
+        authorization = self.headers.get("Authorization", "")
+        token = authorization.removeprefix("Bearer ").strip().encode()
+        # compare every token, no early exit by the first match
+        return any(
+            [hmac.compare_digest(token, expected) for expected in self.server.tokens]
+        )
+
+    def send(self, status: HTTPStatus, body: bytes = b"", content_type: str = ""):
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        if not self.is_authorized():
+            self.send(HTTPStatus.UNAUTHORIZED)
+            return
+        if self.path == "/v1/stats":
+            self.send(
+                HTTPStatus.OK,
+                json.dumps(self.server.store.stats()).encode(),
+                "application/json",
+            )
+            return
+        match = KEY_PATTERN.fullmatch(self.path)
+        if match is None:
+            self.send(HTTPStatus.NOT_FOUND)
+            return
+        value = self.server.store.get(match.group(1))
+        if value is None:
+            self.send(HTTPStatus.NOT_FOUND)
+        else:
+            self.send(HTTPStatus.OK, value, "application/octet-stream")
+
+    def do_PUT(self):
+        if not self.is_authorized():
+            self.send(HTTPStatus.UNAUTHORIZED)
+            return
+        match = KEY_PATTERN.fullmatch(self.path)
+        if match is None:
+            self.send(HTTPStatus.NOT_FOUND)
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > self.server.max_entry_size:
+            # the body isn't read, the connection can't be reused
+            self.close_connection = True
+            self.send(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            return
+        self.server.store.put(match.group(1), self.rfile.read(length))
+        self.send(HTTPStatus.NO_CONTENT)
+
+    def log_message(self, format: str, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+
+class CacheServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        store: CacheStore,
+        tokens: list[str],
+        max_entry_size: int,
+    ):
+        super().__init__(address, CacheRequestHandler)
+        self.store = store
+        self.tokens = [token.encode() for token in tokens]
+        self.max_entry_size = max_entry_size
+
+
+def serve(
+    host: str,
+    port: int,
+    db_path: Path,
+    max_size: int,
+    max_entry_size: int,
+    tokens: list[str],
+):
+    """Serve the cache until the process is interrupted"""
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    store = CacheStore(db_path, max_size=max_size)
+    server = CacheServer(
+        (host, port), store, tokens=tokens, max_entry_size=max_entry_size
+    )
+    logger.info(
+        "Serve LLM cache on http://%s:%d (%s, %d of %d bytes used, %s)",
+        host,
+        server.server_address[1],
+        db_path,
+        store.size,
+        max_size,
+        f"{len(tokens)} token(s)" if tokens else "no authentication",
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,19 +1,51 @@
 import argparse
+import os
+import sys
+from pathlib import Path
 
-from . import cmd
-from .cmd.setup import pygit_setup
+from . import daemon
 
 
-def main():
+def add_multi_repo_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--repos",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Run the command in all of these repositories concurrently",
+    )
+    parser.add_argument(
+        "--recurse-submodules",
+        action="store_true",
+        default=False,
+        help=(
+            "Run the command in all initialized submodules (recursively) "
+            "as well, concurrently"
+        ),
+    )
+
+
+def get_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         description="A small package to optimize some git workflows"
     )
 
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default=os.environ.get("PYGITAI_TRACE"),
+        help=(
+            "Write a Chrome/Perfetto trace of the command to this file. "
+            "Can be set by the env var PYGITAI_TRACE as well."
+        ),
+    )
+
     subparsers = parser.add_subparsers(
         dest="cmd",
         help=(
             "Command to run. Choices: "
-            "[commit, pr-review, setup-branch, setup, customization, ui]"
+            "[commit, pr-review, setup-branch, setup, customization, daemon, "
+            "precompute, deferred, ui, cache-server]"
         ),
     )
 
@@ -39,6 +71,25 @@ def main():
         default=False,
         help="Automatically stage all unstaged files",
     )
+    parser_commit.add_argument(
+        "--defer",
+        nargs="?",
+        const="reword",
+        default=None,
+        choices=["reword", "note"],
+        help=(
+            "Commit right away with a placeholder message. The message is "
+            "generated in the background and applied by rewording the commit "
+            "if it wasn't pushed (default) or as a git note."
+        ),
+    )
+    add_multi_repo_arguments(parser_commit)
+    parser_commit.add_argument(
+        "--max-workers",
+        type=int,
+        default=4,
+        help="Number of repositories which are processed concurrently",
+    )
 
     parser_pr_review = subparsers.add_parser(
         "pr-review",
@@ -49,11 +100,63 @@ def main():
         type=str,
         help="Target branch to compare against",
     )
+    parser_pr_review.add_argument(
+        "--incremental",
+        action="store_true",
+        default=False,
+        help=(
+            "Review only the files which changed since the last review of the "
+            "same branches, carry the earlier findings forward for the others"
+        ),
+    )
+    parser_pr_review.add_argument(
+        "--batch",
+        type=str,
+        default=None,
+        help=(
+            "File with one '<head_ref> <base_ref>' pair per line ('-' for stdin). "
+            "All pairs are reviewed without any user interaction."
+        ),
+    )
+    parser_pr_review.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="JSON lines file for the batch results. Default: stdout",
+    )
+    parser_pr_review.add_argument(
+        "--max-workers",
+        type=int,
+        default=4,
+        help=(
+            "Number of reviews (in batch mode) or repositories which are "
+            "processed concurrently"
+        ),
+    )
+    add_multi_repo_arguments(parser_pr_review)
 
-    subparsers.add_parser(
+    parser_setup_branch = subparsers.add_parser(
         "setup-branch",
         help="Setup a branch and enrich branch info for better ai help",
     )
+    parser_setup_branch.add_argument(
+        "--import-file",
+        type=str,
+        default=None,
+        help="Import purposes and ticket links of many branches (.csv or .json)",
+    )
+    parser_setup_branch.add_argument(
+        "--export-file",
+        type=str,
+        default=None,
+        help="Export purposes and ticket links of all branches (.csv or .json)",
+    )
+    parser_setup_branch.add_argument(
+        "--prune",
+        action="store_true",
+        default=False,
+        help="Remove the info of all branches which don't exist anymore",
+    )
 
     customization = subparsers.add_parser(
         "customization",
@@ -119,7 +222,159 @@ def main():
         ),
     )
 
-    args = parser.parse_args()
+    parser_precompute = subparsers.add_parser(
+        "precompute",
+        help=(
+            "Generate commit messages in advance for the currently staged "
+            "changes. They are used by `commit` as long as the staged "
+            "changes are the same."
+        ),
+    )
+    parser_precompute.add_argument(
+        "--use-commit-body",
+        action="store_true",
+        default=False,
+        help="Precompute the extended commit body as well",
+    )
+    parser_precompute.add_argument(
+        "--watch",
+        action="store_true",
+        default=False,
+        help="Keep running and precompute whenever the staged changes change",
+    )
+    parser_precompute.add_argument(
+        "--debounce",
+        type=float,
+        default=5.0,
+        help="Seconds the staged changes must be stable before precomputing",
+    )
+
+    parser_deferred = subparsers.add_parser(
+        "deferred",
+        help="Manage the commits which were made with `commit --defer`",
+    )
+    parser_deferred.add_argument(
+        "deferred_cmd",
+        choices=["status", "run"],
+        help=(
+            "Deferred command to run. Choices: [status, run]. `run` generates "
+            "the messages of all queued commits, it's started automatically."
+        ),
+    )
+
+    parser_daemon = subparsers.add_parser(
+        "daemon",
+        help=(
+            "Manage a long-lived pygitai process for the current repository. "
+            "Other commands are forwarded to it while it's running."
+        ),
+    )
+    parser_daemon.add_argument(
+        "daemon_cmd",
+        choices=["start", "stop", "status"],
+        help="Daemon command to run. Choices: [start, stop, status]",
+    )
+    parser_daemon.add_argument(
+        "--foreground",
+        action="store_true",
+        default=False,
+        help=(
+            "Don't detach the daemon from the terminal. It ignores Ctrl-C, stop "
+            "it with `pygitai daemon stop`."
+        ),
+    )
+
+    parser_cache_server = subparsers.add_parser(
+        "cache-server",
+        help=(
+            "Serve a cache of LLM results which is shared by a team. Clients use "
+            "it if PYGITAI_CACHE_URL is set."
+        ),
+    )
+    parser_cache_server.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Address to listen on. Default: 127.0.0.1",
+    )
+    parser_cache_server.add_argument(
+        "--port",
+        type=int,
+        default=8765,
+        help="Port to listen on. Default: 8765",
+    )
+    parser_cache_server.add_argument(
+        "--db",
+        type=str,
+        default="~/.cache/pygitai/llm_cache.sqlite3",
+        help="Database of the cache entries",
+    )
+    parser_cache_server.add_argument(
+        "--max-size-mb",
+        type=float,
+        default=512,
+        help="Size of all entries, least recently used ones are evicted",
+    )
+    parser_cache_server.add_argument(
+        "--max-entry-size-mb",
+        type=float,
+        default=8,
+        help="Size of a single entry, larger ones are rejected",
+    )
+    parser_cache_server.add_argument(
+        "--token-file",
+        type=str,
+        default=None,
+        help=(
+            "File with one accepted token per line. Tokens can be set by "
+            "PYGITAI_CACHE_SERVER_TOKENS (comma separated) as well."
+        ),
+    )
+    parser_cache_server.add_argument(
+        "--no-auth",
+        action="store_true",
+        default=False,
+        help="Accept requests without a token",
+    )
+
+    return parser
+
+
+def run(argv: list[str] | None = None):
+    """Run a command in the current process"""
+    # imported here to keep the startup fast if the command is
+    # forwarded to the daemon
+    from . import cmd
+    from .cmd.setup import pygit_setup
+    from .common.tracing import tracer
 
-    pygit_setup()
-    getattr(cmd, args.cmd.replace("-", "_"))(cli_args=args, **vars(args))
+    args = get_parser().parse_args(argv)
+
+    if args.trace:
+        tracer.start(Path(args.trace))
+    try:
+        with tracer.span(f"cmd.{args.cmd}", "cmd"):
+            # the cache server doesn't need a repository
+            if args.cmd != "cache-server":
+                pygit_setup()
+            getattr(cmd, args.cmd.replace("-", "_"))(cli_args=args, **vars(args))
+    finally:
+        tracer.stop()
+
+
+def is_long_running(args: argparse.Namespace) -> bool:
+    """Whether the command keeps running until it is stopped"""
+    if args.cmd == "precompute":
+        return args.watch
+    return args.cmd in ("daemon", "cache-server", "ui")
+
+
+def main():
+    argv = sys.argv[1:]
+    # long-running commands are never forwarded, the daemon runs only
+    # one command at a time and would be blocked by them
+    if not is_long_running(get_parser().parse_args(argv)):
+        returncode = daemon.forward(argv)
+        if returncode is not None:
+            sys.exit(returncode)
+    run(argv)
@@ -1,5 +1,9 @@
+from .cache_server import main as cache_server
 from .commit import main as commit
 from .customization import main as customization
+from .daemon import main as daemon
+from .deferred import main as deferred
+from .precompute import main as precompute
 from .review import main as pr_review
 from .setup import main as setup
 from .setup_branch import main as setup_branch
@@ -10,4 +14,8 @@ __all__ = [
     "setup_branch",
     "customization",
     "setup",
+    "daemon",
+    "precompute",
+    "deferred",
+    "cache_server",
 ]
@@ -0,0 +1,41 @@
+import os
+from argparse import Namespace
+from pathlib import Path
+
+from pygitai import cache_server
+from pygitai.common import config, get_logger
+
+logger = get_logger(__name__, config.logger.level)
+
+MEGABYTE = 1024 * 1024
+
+
+def get_tokens(token_file: str | None) -> list[str]:
+    """Get the accepted tokens from `PYGITAI_CACHE_SERVER_TOKENS`
+    (comma separated) and the token file (one per line)"""
+    tokens = os.getenv("PYGITAI_CACHE_SERVER_TOKENS", "").split(",")
+    if token_file:
+        tokens.extend(Path(token_file).read_text().splitlines())
+    return [token.strip() for token in tokens if token.strip()]
+
+
+def main(
+    cli_args: Namespace,
+    *args,
+    **kwargs,
+):
+    """Cache server command"""
+    tokens = get_tokens(cli_args.token_file)
+    if not tokens and not cli_args.no_auth:
+        raise ValueError(
+            "No tokens configured. Set PYGITAI_CACHE_SERVER_TOKENS, pass "
+            "--token-file or start the server with --no-auth."
+        )
+    cache_server.serve(
+        host=cli_args.host,
+        port=cli_args.port,
+        db_path=Path(cli_args.db).expanduser(),
+        max_size=int(cli_args.max_size_mb * MEGABYTE),
+        max_entry_size=int(cli_args.max_entry_size_mb * MEGABYTE),
+        tokens=tokens,
+    )
@@ -1,23 +1,72 @@
 from argparse import Namespace
 
-from pygitai.common import config, get_logger
+from pygitai.common import config, get_logger, git_state
+from pygitai.common.deferred import defer_commit
 from pygitai.common.jobs.api import (
     AutoStageAll,
+    CommitBody,
     CommitTitle,
     FeedbackOnCommit,
     PreCommitHook,
 )
+from pygitai.common.jobs.inputs import gather_inputs
+
+from .deferred import start_worker
+from .multi_repo import (
+    get_repositories,
+    is_multi_repo,
+    run_in_repositories,
+    write_results,
+)
 
 logger = get_logger(__name__, config.logger.level)
 
 
+def commit(cli_args: Namespace, skip_unchanged: bool = False) -> str | None:
+    """Commit the staged changes of the current repository and return
+    the commit title. With `skip_unchanged` nothing is done if there
+    are no staged changes.
+
+    With `--defer` the changes are committed with a placeholder
+    message right away, the message is generated in the background
+    (see `deferred`).
+    """
+    AutoStageAll().perform(cli_args=cli_args)
+    if skip_unchanged and not git_state.staged_files:
+        return None
+    PreCommitHook().perform(cli_args=cli_args)
+    if cli_args.defer:
+        deferred_commit = defer_commit(
+            git_state.staged_files,
+            use_commit_body=cli_args.use_commit_body,
+            apply_mode=cli_args.defer,
+        )
+        start_worker()
+        return f"Deferred {deferred_commit.commit_hash[:10]}"
+    # the LLM jobs share their inputs, they are gathered concurrently
+    # before the first LLM call
+    with gather_inputs(
+        *FeedbackOnCommit().get_input_prefetches(cli_args),
+        *CommitBody().get_input_prefetches(cli_args),
+        *CommitTitle().get_input_prefetches(cli_args),
+    ):
+        FeedbackOnCommit().perform(cli_args=cli_args)
+        return CommitTitle().perform(cli_args=cli_args)
+
+
 def main(
     cli_args: Namespace,
     *args,
     **kwargs,
 ):
     """Commit command"""
-    AutoStageAll().perform(cli_args=cli_args)
-    PreCommitHook().perform(cli_args=cli_args)
-    FeedbackOnCommit().perform(cli_args=cli_args)
-    CommitTitle().perform(cli_args=cli_args)
+    if not is_multi_repo(cli_args):
+        commit(cli_args)
+        return
+
+    results = run_in_repositories(
+        get_repositories(cli_args.repos, cli_args.recurse_submodules),
+        lambda: commit(cli_args, skip_unchanged=True),
+        max_workers=cli_args.max_workers,
+    )
+    write_results(results)
@@ -0,0 +1,39 @@
+from argparse import Namespace
+from datetime import datetime
+
+from pygitai import daemon
+from pygitai.common import config, get_logger
+
+logger = get_logger(__name__, config.logger.level)
+
+
+def main(
+    cli_args: Namespace,
+    *args,
+    **kwargs,
+):
+    """Daemon command"""
+    if cli_args.daemon_cmd == "start":
+        logger.info("Start pygitai daemon for %s", config.general.toplevel_directory)
+        daemon.serve(
+            toplevel_directory=config.general.toplevel_directory,
+            idle_timeout=config.daemon.idle_timeout,
+            foreground=cli_args.foreground,
+        )
+    elif cli_args.daemon_cmd == "stop":
+        if daemon.request("stop") is None:
+            logger.info("No pygitai daemon running")
+        else:
+            logger.info("pygitai daemon stopped")
+    elif cli_args.daemon_cmd == "status":
+        status = daemon.request("status")
+        if status is None:
+            logger.info("No pygitai daemon running")
+        else:
+            started_at = datetime.fromtimestamp(status["started_at"])
+            logger.info(
+                "pygitai daemon running (pid %s, started %s, %s commands served)",
+                status["pid"],
+                started_at.isoformat(timespec="seconds"),
+                status["request_count"],
+            )
@@ -0,0 +1,156 @@
+import os
+import subprocess
+import sys
+import time
+from argparse import Namespace
+from datetime import datetime
+from typing import TextIO
+
+from pygitai.common import config, get_logger
+from pygitai.common.db_api import DeferredCommit, DeferredCommitDBAPI
+from pygitai.common.deferred import apply_message, find_commit, get_parent
+from pygitai.common.jobs.api import CommitBody, CommitTitle
+from pygitai.common.jobs.inputs import gather_inputs
+
+logger = get_logger(__name__, config.logger.level)
+
+LOCK_FILE_NAME = "deferred.lock"
+LOG_FILE_NAME = "deferred.log"
+# the worker runs the cli directly, it must not be forwarded to the
+# daemon
+WORKER_CODE = "from pygitai.cli import run; run()"
+
+
+def start_worker():
+    """Start a background process which generates the messages of all
+    queued commits of the current repository"""
+    pygitai_dir = config.general.toplevel_directory / ".pygitai"
+    with open(pygitai_dir / LOG_FILE_NAME, "ab") as log:
+        process = subprocess.Popen(
+            [sys.executable, "-c", WORKER_CODE, "deferred", "run"],
+            cwd=config.general.toplevel_directory,
+            env={**os.environ, "PYGITAI_NO_DAEMON": "1"},
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=log,
+            start_new_session=True,
+        )
+    logger.info("Started worker for deferred commits (pid %s)", process.pid)
+
+
+def generate(deferred_commit: DeferredCommit, commit_hash: str):
+    """Generate the title (and body) of a deferred commit. Both jobs
+    share the diff (see `inputs`)."""
+    base_ref = get_parent(commit_hash)
+    cli_args = Namespace(use_commit_body=deferred_commit.use_commit_body)
+    with gather_inputs():
+        title_job = CommitTitle()
+        title_job.cli_args = cli_args
+        title_job.kwargs = {}
+        deferred_commit.title = title_job.generate(base_ref, commit_hash)
+        if deferred_commit.use_commit_body:
+            body_job = CommitBody()
+            body_job.cli_args = cli_args
+            body_job.kwargs = {}
+            deferred_commit.body = body_job.generate(base_ref, commit_hash)
+
+
+def process(deferred_commit: DeferredCommit):
+    """Generate and apply the message of a deferred commit"""
+    commit_hash = find_commit(deferred_commit)
+    if commit_hash is None:
+        raise ValueError(f"Commit {deferred_commit.commit_hash} doesn't exist anymore")
+    deferred_commit.status = "running"
+    deferred_commit.updated_at = int(time.time())
+    DeferredCommitDBAPI.update(deferred_commit)
+
+    if deferred_commit.title is None:
+        generate(deferred_commit, commit_hash)
+    # HEAD could have been moved while waiting for the LLM
+    commit_hash = find_commit(deferred_commit) or commit_hash
+    apply_message(deferred_commit, commit_hash)
+    deferred_commit.status = "done"
+    deferred_commit.error = None
+
+
+def acquire_lock(lock: TextIO):
+    """Block until the file is locked exclusively. The lock is released
+    when the file is closed."""
+    if sys.platform == "win32":
+        import msvcrt
+
+        while True:
+            try:
+                # LK_LOCK gives up after 10 attempts
+                msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+    else:
+        import fcntl
+
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+
+def run():
+    """Process all queued commits. Only one worker per repository is
+    running at a time, others wait for it."""
+    lock_file = config.general.toplevel_directory / ".pygitai" / LOCK_FILE_NAME
+    with open(lock_file, "w") as lock:
+        acquire_lock(lock)
+        # `running` commits were left behind by a worker which died
+        deferred_commits = DeferredCommitDBAPI.get_all(
+            statuses=["pending", "running", "failed"]
+        )
+        logger.info("Process %d deferred commit(s)", len(deferred_commits))
+        for deferred_commit in deferred_commits:
+            try:
+                process(deferred_commit)
+            except Exception as e:
+                logger.warning(
+                    "Deferred commit %s failed: %s", deferred_commit.token, e
+                )
+                deferred_commit.status = "failed"
+                deferred_commit.error = str(e)
+            else:
+                logger.info(
+                    "Applied message of %s as %s: %s",
+                    deferred_commit.commit_hash,
+                    deferred_commit.applied_as,
+                    deferred_commit.title,
+                )
+            deferred_commit.updated_at = int(time.time())
+            DeferredCommitDBAPI.update(deferred_commit)
+
+
+def status():
+    deferred_commits = DeferredCommitDBAPI.get_all()
+    if not deferred_commits:
+        logger.info("No deferred commits")
+        return
+    for deferred_commit in deferred_commits:
+        created_at = datetime.fromtimestamp(deferred_commit.created_at or 0)
+        applied_as = (
+            f" ({deferred_commit.applied_as})" if deferred_commit.applied_as else ""
+        )
+        sys.stdout.write(
+            f"{deferred_commit.token} {deferred_commit.commit_hash[:10]} "
+            f"{created_at.isoformat(timespec='seconds')} "
+            f"{deferred_commit.status}{applied_as}"
+            f"{': ' + deferred_commit.title if deferred_commit.title else ''}\n"
+        )
+        if deferred_commit.error:
+            sys.stdout.write(f"    {deferred_commit.error}\n")
+    sys.stdout.flush()
+
+
+def main(
+    cli_args: Namespace,
+    *args,
+    **kwargs,
+):
+    """Deferred command"""
+    if cli_args.deferred_cmd == "run":
+        run()
+    elif cli_args.deferred_cmd == "status":
+        status()
@@ -0,0 +1,141 @@
+"""Run a command in many repositories at once.
+
+The repositories are either given explicitly (`--repos`) or are the
+submodules of the current repository (`--recurse-submodules`). Each
+repository is processed by its own thread with its own general config,
+database and git state (see `config.use_repository`). The HTTP session
+and the limits of the LLM requests are shared by all repositories
+(see `llm.session`), the user is asked by one repository at a time.
+"""
+import subprocess
+import sys
+import time
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, TextIO
+
+from pygitai.common import config, get_logger
+from pygitai.common.config import TOPLEVEL_DIRECTORY, use_repository
+from pygitai.common.git import state as git_state
+from pygitai.common.logger import LazyStr
+
+from .setup import pygit_setup
+
+logger = get_logger(__name__, config.logger.level)
+
+
+@dataclass
+class RepositoryResult:
+    """The result of a command in a single repository.
+
+    Attributes:
+        directory: The top level directory of the repository.
+        status: `done`, `skipped` (nothing to do) or `failed`.
+        output: The output of the command (i.e. the commit title) or
+            the error.
+        duration: The duration in seconds.
+    """
+
+    directory: Path
+    status: str
+    output: str | None = None
+    duration: float = 0.0
+
+    @property
+    def name(self) -> str:
+        try:
+            return self.directory.relative_to(TOPLEVEL_DIRECTORY).as_posix()
+        except ValueError:
+            return self.directory.as_posix()
+
+
+def is_multi_repo(cli_args: Namespace) -> bool:
+    return bool(cli_args.repos or cli_args.recurse_submodules)
+
+
+def get_toplevel_directory(path: Path) -> Path:
+    """Get the top level directory of the repository of a path"""
+    cmd = ["git", "rev-parse", "--show-toplevel"]
+    logger.info("cmd %s (in %s)", LazyStr(" ".join, cmd), path)
+    response = subprocess.run(cmd, cwd=path, stdout=subprocess.PIPE, text=True)
+    if response.returncode != 0:
+        raise ValueError(f"{path} is not a git repository")
+    return Path(response.stdout.strip())
+
+
+def get_submodules(directory: Path) -> list[Path]:
+    """Get the top level directories of all initialized submodules of
+    a repository, including nested ones"""
+    cmd = ["git", "submodule", "foreach", "--quiet", "--recursive", "pwd"]
+    logger.info("cmd %s (in %s)", LazyStr(" ".join, cmd), directory)
+    response = subprocess.run(cmd, cwd=directory, stdout=subprocess.PIPE, text=True)
+    return [Path(line) for line in response.stdout.splitlines() if line]
+
+
+def get_repositories(
+    repos: list[str] | None, recurse_submodules: bool = False
+) -> list[Path]:
+    """Get the top level directories of all repositories to process.
+    Without `repos` the current repository is used."""
+    directories = (
+        [get_toplevel_directory(Path(repo).resolve()) for repo in repos]
+        if repos
+        else [TOPLEVEL_DIRECTORY]
+    )
+    if recurse_submodules:
+        directories = [
+            repository
+            for directory in directories
+            for repository in [directory, *get_submodules(directory)]
+        ]
+    # keep the order, a submodule could be passed explicitly as well
+    return list(dict.fromkeys(directories))
+
+
+def run_in_repository(directory: Path, func: Callable[[], str | None]):
+    start = time.perf_counter()
+    try:
+        with use_repository(directory):
+            pygit_setup()
+            output = func()
+    except Exception as e:
+        logger.warning("%s failed: %s", directory, e)
+        result = RepositoryResult(directory, "failed", output=str(e))
+    else:
+        result = RepositoryResult(
+            directory, "done" if output is not None else "skipped", output=output
+        )
+    finally:
+        git_state.forget(directory)
+    result.duration = time.perf_counter() - start
+    return result
+
+
+def run_in_repositories(
+    directories: list[Path], func: Callable[[], str | None], max_workers: int
+) -> list[RepositoryResult]:
+    """Call `func` for every repository concurrently. It returns the
+    output of the command or None if there was nothing to do. The
+    results are in the order of the repositories."""
+    logger.info("Process %d repositories", len(directories))
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [
+            executor.submit(run_in_repository, directory, func)
+            for directory in directories
+        ]
+        return [future.result() for future in futures]
+
+
+def write_results(results: list[RepositoryResult], out: TextIO = sys.stdout):
+    """Write a summary of the results of all repositories"""
+    for result in results:
+        out.write(f"## {result.name}: {result.status} ({result.duration:.1f} s)\n")
+        if result.output:
+            out.write(f"{result.output}\n")
+        out.write("\n")
+    out.flush()
+    failed = [result.name for result in results if result.status == "failed"]
+    if failed:
+        logger.error("Failed in %d repositories: %s", len(failed), ", ".join(failed))
@@ -0,0 +1,71 @@
+import time
+from argparse import Namespace
+
+from pygitai.common import config, get_logger
+from pygitai.common.git import Git
+from pygitai.common.git import state as git_state
+from pygitai.common.jobs.api import CommitBody, CommitTitle, GitLLMJobBase
+from pygitai.common.jobs.inputs import gather_inputs
+
+logger = get_logger(__name__, config.logger.level)
+
+
+def precompute(cli_args: Namespace):
+    """Generate drafts for all precomputable jobs of the commit
+    pipeline for the currently staged changes."""
+    git_state.refresh()
+    if not git_state.staged_files:
+        logger.info("No staged files, nothing to precompute")
+        return
+
+    jobs: list[GitLLMJobBase] = [CommitTitle()]
+    if cli_args.use_commit_body:
+        jobs.append(CommitBody())
+    with gather_inputs():
+        for job in jobs:
+            job.cli_args = cli_args
+            job.kwargs = {}
+            if job.precompute():
+                logger.info("Precomputed draft for %s", job.__class__.__name__)
+
+
+def get_mtime(index_file) -> float | None:
+    try:
+        return index_file.stat().st_mtime
+    except OSError:
+        return None
+
+
+def watch(cli_args: Namespace, poll_interval: float = 1.0):
+    """Watch the git index and precompute drafts as soon as the
+    staged changes were stable for `debounce` seconds."""
+    index_file = Git.get_index_file()
+    debounce = cli_args.debounce
+    logger.info("Watching %s for changes", index_file)
+
+    last_mtime = None
+    changed_at: float | None = time.monotonic()
+    while True:
+        mtime = get_mtime(index_file)
+        if mtime != last_mtime:
+            last_mtime = mtime
+            changed_at = time.monotonic()
+        elif changed_at is not None and time.monotonic() - changed_at >= debounce:
+            changed_at = None
+            try:
+                precompute(cli_args)
+            except Exception as e:
+                logger.warning("Precompute failed: %s", e)
+        time.sleep(poll_interval)
+
+
+def main(
+    cli_args: Namespace,
+    *args,
+    **kwargs,
+):
+    """Precompute command"""
+    if cli_args.watch:
+        watch(cli_args)
+    else:
+        precompute(cli_args)
@@ -1,6 +1,80 @@
+import json
+import sys
 from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TextIO
 
+from pygitai.common import Git, config, get_logger
 from pygitai.common.jobs.api import CodeReview
+from pygitai.common.jobs.inputs import gather_inputs
+
+from .multi_repo import (
+    get_repositories,
+    is_multi_repo,
+    run_in_repositories,
+    write_results,
+)
+
+logger = get_logger(__name__, config.logger.level)
+
+
+def read_ref_pairs(batch_file: TextIO) -> list[tuple[str, str]]:
+    """Read `<head_ref> <base_ref>` pairs, one per line. Empty lines
+    and lines starting with `#` are ignored."""
+    ref_pairs = []
+    for line_number, line in enumerate(batch_file, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        refs = line.split()
+        if len(refs) != 2:
+            raise ValueError(
+                f"Line {line_number}: expected '<head_ref> <base_ref>', got {line!r}"
+            )
+        ref_pairs.append((refs[0], refs[1]))
+    return ref_pairs
+
+
+def review_pair(cli_args: Namespace, head_ref: str, base_ref: str) -> dict:
+    result = {"head": head_ref, "base": base_ref}
+    job = CodeReview()
+    job.cli_args = cli_args
+    job.kwargs = {}
+    try:
+        result["review"] = job.review(head_ref=head_ref, base_ref=base_ref)
+    except Exception as e:
+        logger.warning("Review of %s against %s failed: %s", head_ref, base_ref, e)
+        result["error"] = str(e)
+    return result
+
+
+def batch_review(cli_args: Namespace, ref_pairs: list[tuple[str, str]], out: TextIO):
+    """Review all pairs concurrently and write one JSON line per
+    pair as soon as its review is done."""
+    with ThreadPoolExecutor(max_workers=max(1, cli_args.max_workers)) as executor:
+        futures = [
+            executor.submit(review_pair, cli_args, head_ref, base_ref)
+            for head_ref, base_ref in ref_pairs
+        ]
+        for future in as_completed(futures):
+            out.write(json.dumps(future.result()) + "\n")
+            out.flush()
+
+
+def review_repository(cli_args: Namespace) -> str | None:
+    """Review the current branch (or HEAD if it's detached, i.e. in a
+    submodule) of the current repository against the target branch.
+    Repositories without changes are skipped."""
+    head_ref = Git.get_current_branch() or "HEAD"
+    base_commit = Git.resolve_commit(cli_args.target_branch)
+    if base_commit is None:
+        raise ValueError(f"{cli_args.target_branch} does not exist")
+    if Git.resolve_commit(head_ref) == base_commit:
+        return None
+    job = CodeReview()
+    job.cli_args = cli_args
+    job.kwargs = {}
+    return job.review(head_ref=head_ref, base_ref=cli_args.target_branch)
 
 
 def main(
@@ -8,4 +82,32 @@ def main(
     *args,
     **kwargs,
 ):
-    CodeReview().perform(cli_args)
+    if is_multi_repo(cli_args):
+        if not cli_args.target_branch:
+            raise ValueError("--target-branch is required for many repositories")
+        results = run_in_repositories(
+            get_repositories(cli_args.repos, cli_args.recurse_submodules),
+            lambda: review_repository(cli_args),
+            max_workers=cli_args.max_workers,
+        )
+        write_results(results)
+        return
+
+    if not cli_args.batch:
+        job = CodeReview()
+        with gather_inputs(*job.get_input_prefetches(cli_args)):
+            job.perform(cli_args)
+        return
+
+    if cli_args.batch == "-":
+        ref_pairs = read_ref_pairs(sys.stdin)
+    else:
+        with open(cli_args.batch) as batch_file:
+            ref_pairs = read_ref_pairs(batch_file)
+    logger.info("Review %d ref pair(s)", len(ref_pairs))
+
+    if cli_args.output:
+        with open(cli_args.output, "w") as out:
+            batch_review(cli_args, ref_pairs, out)
+    else:
+        batch_review(cli_args, ref_pairs, sys.stdout)
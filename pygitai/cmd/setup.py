@@ -1,7 +1,7 @@
 import shutil
 
 from pygitai.common.config import BASE_DIR, config
-from pygitai.common.db_api import BranchInfoDBAPI
+from pygitai.common.db_api import BranchInfoDBAPI, get_connection
 from pygitai.common.git import Git
 
 
@@ -29,8 +29,10 @@ def pygit_setup():
         )
         shutil.copytree(pygitai_customizations_assets_dir, pygitai_customizations_dir)
 
-    if not config.general.db_name.exists():
-        BranchInfoDBAPI.create_table_if_not_exists()
+    # create the database or apply pending migrations
+    get_connection(config.general.db_name)
+    # the purpose of the current branch is used by most of the jobs
+    BranchInfoDBAPI.prefetch(Git.get_current_branch())
 
 
 def main(
@@ -1,13 +1,93 @@
+import csv
+import json
+from argparse import Namespace
+from dataclasses import asdict, fields
 from datetime import datetime
+from pathlib import Path
 
 from pygitai.common import config, get_logger
-from pygitai.common.db_api import BranchInfoDBAPI, DoesNotExist
+from pygitai.common.db_api import BranchInfo, BranchInfoDBAPI, DoesNotExist
 from pygitai.common.git import Git
 
 logger = get_logger(__name__, config.logger.level)
 
+BRANCH_INFO_FIELDS = [field.name for field in fields(BranchInfo)]
 
-def main(*args, **kwargs):
+
+def read_branch_infos(file_path: Path) -> list[BranchInfo]:
+    """Read branches from a CSV or JSON file. Only `branch_name` is
+    required, `created_at` defaults to now."""
+    with file_path.open(newline="") as f:
+        if file_path.suffix == ".json":
+            rows = json.load(f)
+        else:
+            rows = list(csv.DictReader(f))
+
+    now = int(datetime.now().timestamp())
+    branch_infos = []
+    for row in rows:
+        if not row.get("branch_name"):
+            raise ValueError(f"Missing branch_name in {row}")
+        branch_infos.append(
+            BranchInfo(
+                branch_name=row["branch_name"],
+                purpose=row.get("purpose") or "",
+                ticket_link=row.get("ticket_link") or "",
+                created_at=int(float(row.get("created_at") or now)),
+            )
+        )
+    return branch_infos
+
+
+def write_branch_infos(file_path: Path, branch_infos: list[BranchInfo]):
+    """Write branches to a CSV or JSON file"""
+    with file_path.open("w", newline="") as f:
+        if file_path.suffix == ".json":
+            json.dump(
+                [asdict(branch_info) for branch_info in branch_infos], f, indent=2
+            )
+        else:
+            writer = csv.DictWriter(f, fieldnames=BRANCH_INFO_FIELDS)
+            writer.writeheader()
+            writer.writerows(asdict(branch_info) for branch_info in branch_infos)
+
+
+def import_branches(file_path: Path):
+    branch_infos = read_branch_infos(file_path)
+    BranchInfoDBAPI.bulk_upsert(branch_infos)
+    logger.info("Imported %d branch(es) from %s", len(branch_infos), file_path)
+
+
+def export_branches(file_path: Path):
+    branch_infos = BranchInfoDBAPI.all()
+    write_branch_infos(file_path, branch_infos)
+    logger.info("Exported %d branch(es) to %s", len(branch_infos), file_path)
+
+
+def prune_branches():
+    branches = Git.get_branches()
+    if not branches:
+        # most likely git failed, never delete everything in this case
+        logger.warning("No local branches found, nothing is pruned")
+        return
+    deleted = BranchInfoDBAPI.prune(branches)
+    logger.info("Pruned %d branch(es) which don't exist anymore", deleted)
+
+
+def main(cli_args: Namespace, *args, **kwargs):
+    if cli_args.import_file or cli_args.export_file or cli_args.prune:
+        if cli_args.import_file:
+            import_branches(Path(cli_args.import_file))
+        if cli_args.prune:
+            prune_branches()
+        if cli_args.export_file:
+            export_branches(Path(cli_args.export_file))
+        return
+
+    setup_current_branch()
+
+
+def setup_current_branch():
     current_branch = Git.get_current_branch()
 
     # check if there is a configuration already
@@ -17,7 +97,7 @@ def main(*args, **kwargs):
         result = None
 
     if result:
-        logger.warning(f"Branch {current_branch} already has a configuration")
+        logger.warning("Branch %s already has a configuration", current_branch)
 
     purpose_input_text = (
         "[Optional] Enter the purpose of the branch "
@@ -26,7 +106,7 @@ def main(*args, **kwargs):
     if result:
         purpose_input_text = (
             "[Optional] Enter the purpose of the branch "
-            f"(current purpose is {result[2]}): "
+            f"(current purpose is {result.purpose}): "
         )
     else:
         purpose_input_text = (
@@ -35,12 +115,12 @@ def main(*args, **kwargs):
         )
     purpose = input(purpose_input_text)
     if result:
-        purpose = purpose or result[2]
+        purpose = purpose or result.purpose
 
     if result:
         ticket_link_input_text = (
             "[Optional] Enter the ticket link "
-            f"(current ticket link is {result[3]}): "
+            f"(current ticket link is {result.ticket_link}): "
         )
     else:
         ticket_link_input_text = (
@@ -49,17 +129,12 @@ def main(*args, **kwargs):
         )
     ticket_link = input(ticket_link_input_text)
     if result:
-        ticket_link = ticket_link or result[3]
+        ticket_link = ticket_link or result.ticket_link
 
     if result:
-        ts = result[4]
+        logger.info("Updating row for %s", current_branch)
     else:
-        ts = datetime.now().timestamp()
-
-    if result:
-        logger.info(f"Updating row fpr {current_branch}")
-        BranchInfoDBAPI.update(current_branch, purpose, ticket_link)
-
-    else:
-        logger.info(f"Inserting row for {current_branch}")
-        BranchInfoDBAPI.insert(current_branch, purpose, ticket_link, ts)
+        logger.info("Inserting row for %s", current_branch)
+    BranchInfoDBAPI.upsert(
+        current_branch, purpose, ticket_link, int(datetime.now().timestamp())
+    )
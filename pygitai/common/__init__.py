@@ -1,28 +1,15 @@
-import sys
-
-from . import llm
 from .config import config
 from .git import Git, PreCommitHook
 from .git import state as git_state
 from .logger import get_logger
+from .plugins import llm_registry
 
-customization_defined = False
-try:
-    # load custom project scope
-    sys.path.append((config.general.toplevel_directory / ".pygitai").as_posix())
-    import pygitai_customization  # noqa
-
-    customization_defined = True
-except ModuleNotFoundError:
-    pass
 
-try:
-    LLM = getattr(llm, config.general.llm)
-except AttributeError:
-    if customization_defined:
-        LLM = getattr(pygitai_customization.llm, config.general.llm)
-    else:
-        raise
+def __getattr__(name: str):
+    # the default LLM is imported lazily on first access
+    if name == "LLM":
+        return llm_registry.load(config.general.llm)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 __all__ = [
@@ -0,0 +1,335 @@
+"""Attach the enclosing scopes of each hunk to a diff.
+
+Instead of many context lines around each hunk, only the signatures
+and docstrings of the functions and classes which enclose a hunk are
+added. The pre- and post-images of the changed files are read from
+the git object store and parsed by a language which matches the file
+extension. Parse results are cached by blob ID, so unchanged files
+are never parsed twice.
+
+Further languages can be added by subclassing `Language` and calling
+`register_language`.
+"""
+import ast
+import re
+from dataclasses import asdict, dataclass
+from itertools import islice
+from pathlib import PurePosixPath
+from typing import Iterable
+
+from .config import config
+from .db_api import ParsedBlobDBAPI
+from .diff_format import split_diff
+from .git import Git
+from .logger import get_logger
+from .tracing import traced
+
+logger = get_logger(__name__, config.logger.level)
+
+HUNK_HEADER_PATTERN = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+# files above this size are not parsed
+MAX_BLOB_SIZE = 1024 * 1024
+
+
+@dataclass
+class Scope:
+    """A function or class of a source file.
+
+    Attributes:
+        kind: The kind of the scope (i.e. function or class).
+        name: The name of the function or class.
+        signature: The source of the signature, including the
+            indentation.
+        docstring: The first paragraph of the docstring.
+        indent: The indentation of the signature.
+        start: The first line of the scope (1-based).
+        end: The last line of the scope (1-based, inclusive).
+    """
+
+    kind: str
+    name: str
+    signature: str
+    docstring: str | None
+    indent: int
+    start: int
+    end: int
+
+    def render(self) -> str:
+        if not self.docstring:
+            return self.signature
+        indent = " " * (self.indent + 4)
+        return f'{self.signature}\n{indent}"""{self.docstring}"""'
+
+
+class Language:
+    """Base class of the languages which can be parsed into scopes.
+
+    Attributes:
+        name: The name of the language.
+        version: Increase the version if the result of `parse`
+            changes, cached results of older versions are ignored.
+        extensions: The file extensions of the language.
+    """
+
+    name: str
+    version: int = 1
+    extensions: tuple[str, ...] = ()
+
+    @property
+    def cache_key(self) -> str:
+        return f"{self.name}:{self.version}"
+
+    def parse(self, source: str) -> list[Scope]:
+        """Get all scopes of a source file ordered by their start"""
+        raise NotImplementedError
+
+    def get_references(self, source: str) -> dict[str, int]:
+        """Get the names which are referenced by a source file and the
+        line of their first reference (see `symbol_index`)"""
+        return {}
+
+
+class Python(Language):
+    name = "python"
+    version = 2
+    extensions = (".py", ".pyi")
+    # multi-line signatures are cut after this number of lines
+    max_signature_lines = 10
+
+    def parse(self, source: str) -> list[Scope]:
+        try:
+            tree = ast.parse(source)
+        except (SyntaxError, ValueError):
+            return []
+        lines = source.splitlines()
+        scopes = []
+        for node in ast.walk(tree):
+            if not isinstance(
+                node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+            ):
+                continue
+            # the signature ends before the first statement of the body
+            signature_start = node.lineno - 1
+            signature_end = max(node.lineno, node.body[0].lineno - 1)
+            signature_end = min(
+                signature_end, node.lineno + self.max_signature_lines - 1
+            )
+            docstring = ast.get_docstring(node)
+            if docstring:
+                docstring = " ".join(docstring.split("\n\n")[0].split())
+            scopes.append(
+                Scope(
+                    kind="class" if isinstance(node, ast.ClassDef) else "function",
+                    name=node.name,
+                    signature="\n".join(lines[signature_start:signature_end]),
+                    docstring=docstring or None,
+                    indent=node.col_offset,
+                    start=node.lineno,
+                    end=node.end_lineno or node.lineno,
+                )
+            )
+        return sorted(scopes, key=lambda scope: scope.start)
+
+    def get_references(self, source: str) -> dict[str, int]:
+        try:
+            tree = ast.parse(source)
+        except (SyntaxError, ValueError):
+            return {}
+        references: dict[str, int] = {}
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+                name = node.id
+            elif isinstance(node, ast.Attribute):
+                name = node.attr
+            else:
+                continue
+            if name not in references or node.lineno < references[name]:
+                references[name] = node.lineno
+        return references
+
+
+languages: dict[str, Language] = {}
+
+
+def register_language(language: Language):
+    """Use a language for all files with its extensions"""
+    for extension in language.extensions:
+        languages[extension] = language
+
+
+register_language(Python())
+
+
+def get_language(file_name: str) -> Language | None:
+    return languages.get(PurePosixPath(file_name).suffix)
+
+
+class ScopeCache:
+    """Parse results by language and blob ID. Results are kept in
+    memory and in the pygitai database."""
+
+    def __init__(self):
+        self._scopes: dict[tuple[str, str], list[Scope]] = {}
+
+    @traced("code_context.get_scopes", "git")
+    def get_scopes(self, blob_languages: dict[str, Language]) -> dict[str, list[Scope]]:
+        """Get the scopes of many blobs. Only the blobs which were
+        never parsed before are read from git.
+
+        Arguments:
+            blob_languages (dict[str, Language]): The language of each
+                blob by its ID.
+        """
+        scopes = {}
+        missing: dict[Language, list[str]] = {}
+        for blob_id, language in blob_languages.items():
+            key = (language.cache_key, blob_id)
+            if key in self._scopes:
+                scopes[blob_id] = self._scopes[key]
+            else:
+                missing.setdefault(language, []).append(blob_id)
+
+        for language, blob_ids in missing.items():
+            cached = ParsedBlobDBAPI.get_many(language.cache_key, blob_ids)
+            to_parse = [blob_id for blob_id in blob_ids if blob_id not in cached]
+            logger.debug(
+                "Parse %d of %d %s blob(s)", len(to_parse), len(blob_ids), language.name
+            )
+            parsed: dict[str, list[dict]] = {}
+            for blob_id, content in Git.read_blobs(to_parse).items():
+                if len(content) > MAX_BLOB_SIZE or b"\0" in content:
+                    parsed[blob_id] = []
+                    continue
+                source = content.decode(errors="replace")
+                parsed[blob_id] = [asdict(scope) for scope in language.parse(source)]
+            if parsed:
+                ParsedBlobDBAPI.insert_many(language.cache_key, parsed)
+            for blob_id, data in {**cached, **parsed}.items():
+                self._scopes[(language.cache_key, blob_id)] = [
+                    Scope(**scope) for scope in data
+                ]
+                scopes[blob_id] = self._scopes[(language.cache_key, blob_id)]
+        return scopes
+
+
+scope_cache = ScopeCache()
+
+
+def get_enclosing_scopes(scopes: list[Scope], line: int) -> list[Scope]:
+    """Get the scopes which start before `line` and contain it, the
+    outermost scope first."""
+    return [scope for scope in scopes if scope.start < line <= scope.end]
+
+
+def get_changed_lines(
+    hunk_lines: Iterable[str], old_start: int, new_start: int
+) -> tuple[list[int], list[int]]:
+    """Get the line numbers of the removed lines of a hunk in the
+    pre-image and of the added lines in the post-image."""
+    old_line, new_line = old_start, new_start
+    removed: list[int] = []
+    added: list[int] = []
+    for line in hunk_lines:
+        if line.startswith("@@"):
+            break
+        if line.startswith("+"):
+            added.append(new_line)
+            new_line += 1
+        elif line.startswith("-"):
+            removed.append(old_line)
+            old_line += 1
+        elif not line.startswith("\\"):
+            old_line += 1
+            new_line += 1
+    return removed, added
+
+
+def get_hunk_scopes(
+    removed: list[int],
+    added: list[int],
+    old_scopes: list[Scope],
+    new_scopes: list[Scope],
+) -> list[str]:
+    """Get the rendered scopes which enclose any changed line of a
+    hunk. Removed lines are looked up in the pre-image, added lines in
+    the post-image. Each scope is rendered once, in order of the
+    changed lines, the outermost scope first."""
+    enclosing = [get_enclosing_scopes(old_scopes, line) for line in removed]
+    enclosing += [get_enclosing_scopes(new_scopes, line) for line in added]
+    rendered: dict[str, None] = {}
+    for scopes in enclosing:
+        for scope in scopes:
+            rendered.setdefault(scope.render())
+    return list(rendered)
+
+
+def add_file_context(
+    file_diff: str, old_scopes: list[Scope], new_scopes: list[Scope]
+) -> str:
+    """Insert the enclosing scopes of all changed lines in front of
+    each hunk of a file diff. The scopes are only repeated if the
+    previous hunk had other scopes.
+    """
+    if not old_scopes and not new_scopes:
+        return file_diff
+    lines = file_diff.splitlines(keepends=True)
+    result = []
+    previous: list[str] = []
+    for index, line in enumerate(lines):
+        match = HUNK_HEADER_PATTERN.match(line)
+        if match:
+            removed, added = get_changed_lines(
+                islice(lines, index + 1, None),
+                int(match.group(1)),
+                int(match.group(3)),
+            )
+            enclosing = get_hunk_scopes(removed, added, old_scopes, new_scopes)
+            if enclosing and enclosing != previous:
+                result.append("Enclosing scope:\n")
+                result.extend(f"{scope}\n" for scope in enclosing)
+            previous = enclosing
+        result.append(line)
+    return "".join(result)
+
+
+@traced("code_context.add_scope_context", "git")
+def add_scope_context(
+    diff: dict[str, str] | str,
+    blobs: dict[str, tuple[str | None, str | None]],
+) -> dict[str, str]:
+    """Add the enclosing scopes to each hunk of a diff.
+
+    Arguments:
+        diff (dict[str, str] | str): Either a diff per file or a
+            unified diff of many files.
+        blobs (dict[str, tuple[str | None, str | None]]): The blob
+            IDs of the pre- and post-image by file name (see
+            `Git.get_diff_blobs`).
+    """
+    if isinstance(diff, str):
+        diff = split_diff(diff)
+
+    file_blobs = {}
+    for file_name in diff:
+        language = get_language(file_name)
+        if language is not None:
+            file_blobs[file_name] = blobs.get(file_name, (None, None))
+
+    scopes = scope_cache.get_scopes(
+        {
+            blob_id: get_language(file_name)
+            for file_name, blob_ids in file_blobs.items()
+            for blob_id in blob_ids
+            if blob_id is not None
+        }
+    )
+    result = {}
+    for file_name, file_diff in diff.items():
+        if file_name not in file_blobs:
+            result[file_name] = file_diff
+            continue
+        old_blob, new_blob = file_blobs[file_name]
+        result[file_name] = add_file_context(
+            file_diff, scopes.get(old_blob, []), scopes.get(new_blob, [])
+        )
+    return result
@@ -1,7 +1,9 @@
 import configparser
 import os
 import subprocess
-from dataclasses import dataclass
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
 from pathlib import Path
 
 BASE_DIR = Path(__file__).parent.parent
@@ -11,36 +13,88 @@ TOPLEVEL_DIRECTORY = Path(
     subprocess.run(
         ["git", "rev-parse", "--show-toplevel"],
         stdout=subprocess.PIPE,
+        # i.e. the cache server runs outside of any repository
+        stderr=subprocess.DEVNULL,
         text=True,
     ).stdout.strip()
 )
 
 
-def read_config_file() -> configparser.ConfigParser:
+# the repository which is processed by the current thread in the
+# multi-repository mode (see `use_repository`). None means the
+# repository of the working directory.
+current_repository: ContextVar["GeneralConfig | None"] = ContextVar(
+    "current_repository", default=None
+)
+
+
+def get_config_file_paths(toplevel_directory: Path | None = None) -> list[Path]:
+    """Get all config files in the order they are read"""
+    toplevel_directory = toplevel_directory or config.general.toplevel_directory
+    return [
+        toplevel_directory / "pygitai.ini",
+        toplevel_directory / ".pygitai" / "config.ini",
+    ]
+
+
+def read_config_file(
+    toplevel_directory: Path | None = None,
+) -> configparser.ConfigParser:
     config = configparser.ConfigParser()
-    default_config_file_path = TOPLEVEL_DIRECTORY / "pygitai.ini"
-    config.read(default_config_file_path)
-    config_file_path = TOPLEVEL_DIRECTORY / ".pygitai" / "config.ini"
-    config.read(config_file_path)
+    config.read(get_config_file_paths(toplevel_directory or TOPLEVEL_DIRECTORY))
     return config
 
 
+def reload_config_file():
+    """Re-read the config files into the existing config object.
+
+    The object is updated in place because it's referenced by every
+    module which imported the config.
+    """
+    cfg = config.general.cfg
+    cfg.clear()
+    cfg.read(get_config_file_paths())
+
+
 @dataclass(frozen=True)
 class Git:
-    pre_commit: bool = (TOPLEVEL_DIRECTORY / ".git" / "hooks" / "pre-commit").exists()
+    pre_commit_shard_size: int
+    pre_commit_shard_bytes: int
 
     @classmethod
     def from_env(cls) -> "Git":
-        return cls()
+        return cls(
+            pre_commit_shard_size=int(os.getenv("PYGITAI_PRE_COMMIT_SHARD_SIZE", 500)),
+            pre_commit_shard_bytes=int(
+                os.getenv("PYGITAI_PRE_COMMIT_SHARD_BYTES", 64 * 1024)
+            ),
+        )
+
+
+def parse_log_levels(value: str) -> dict[str, str]:
+    """Parse `<logger name>=<level>` pairs separated by commas"""
+    levels = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
 
 
 @dataclass(frozen=True)
 class Logger:
     level: str
+    levels: dict[str, str]
+    json_file: Path | None
 
     @classmethod
     def from_env(cls) -> "Logger":
-        return cls(level=os.environ.get("PYGIT_LOG_LEVEL", "INFO"))
+        json_file = os.environ.get("PYGITAI_LOG_JSON_FILE")
+        return cls(
+            level=os.environ.get("PYGIT_LOG_LEVEL", "INFO"),
+            levels=parse_log_levels(os.environ.get("PYGITAI_LOG_LEVELS", "")),
+            json_file=Path(json_file) if json_file else None,
+        )
 
 
 @dataclass(frozen=True)
@@ -69,6 +123,17 @@ class HuggingFaceConfig:
         )
 
 
+@dataclass(frozen=True)
+class DaemonConfig:
+    idle_timeout: float
+
+    @classmethod
+    def from_env(cls) -> "DaemonConfig":
+        return cls(
+            idle_timeout=float(os.getenv("PYGITAI_DAEMON_IDLE_TIMEOUT", 30 * 60)),
+        )
+
+
 @dataclass(frozen=True)
 class GeneralConfig:
     llm: str
@@ -76,8 +141,11 @@ class GeneralConfig:
     base_dir: Path = BASE_DIR
     template_dir: Path = BASE_DIR / "templates"
     db_name: Path = TOPLEVEL_DIRECTORY / ".pygitai" / "pygitaidb.sqlite3"
-    cfg: configparser.ConfigParser = read_config_file()
-    toplevel_directory = TOPLEVEL_DIRECTORY
+    template_cache_dir: Path = TOPLEVEL_DIRECTORY / ".pygitai" / "template_cache"
+    cfg: configparser.ConfigParser = field(
+        default_factory=read_config_file, compare=False
+    )
+    toplevel_directory: Path = TOPLEVEL_DIRECTORY
 
     @classmethod
     def from_env(cls) -> "GeneralConfig":
@@ -85,24 +153,104 @@ class GeneralConfig:
             llm=os.environ.get("PYGITAI_LLM", "OpenAI"),
         )
 
+    @classmethod
+    def for_repository(cls, toplevel_directory: Path) -> "GeneralConfig":
+        """Get the general config of another repository, i.e. of a
+        submodule"""
+        return cls(
+            llm=config.default_general.llm,
+            db_name=toplevel_directory / ".pygitai" / "pygitaidb.sqlite3",
+            cfg=read_config_file(toplevel_directory),
+            toplevel_directory=toplevel_directory,
+        )
+
+
+@dataclass(frozen=True)
+class LLMLimits:
+    """Limits of the LLM requests of this process. They are shared by
+    all jobs, i.e. by the jobs of all repositories in the
+    multi-repository mode."""
+
+    max_concurrent_requests: int
+    max_requests_per_minute: int | None
+
+    @classmethod
+    def from_env(cls) -> "LLMLimits":
+        max_requests_per_minute = os.getenv("PYGITAI_LLM_MAX_REQUESTS_PER_MINUTE")
+        return cls(
+            max_concurrent_requests=int(
+                os.getenv("PYGITAI_LLM_MAX_CONCURRENT_REQUESTS", 8)
+            ),
+            max_requests_per_minute=(
+                int(max_requests_per_minute) if max_requests_per_minute else None
+            ),
+        )
+
+
+@dataclass(frozen=True)
+class LLMCacheConfig:
+    """The shared cache of LLM results (see `pygitai cache-server`).
+    The cache is disabled without an url."""
+
+    url: str | None
+    token: str | None
+    timeout: float
+    # seconds without any request to the cache after it was unreachable
+    retry_after: float
+
+    @classmethod
+    def from_env(cls) -> "LLMCacheConfig":
+        return cls(
+            url=os.getenv("PYGITAI_CACHE_URL"),
+            token=os.getenv("PYGITAI_CACHE_TOKEN"),
+            timeout=float(os.getenv("PYGITAI_CACHE_TIMEOUT", 2)),
+            retry_after=float(os.getenv("PYGITAI_CACHE_RETRY_AFTER", 60)),
+        )
+
 
 @dataclass(frozen=True)
 class Config:
-    general: GeneralConfig
+    default_general: GeneralConfig
     git: Git
     openai: OpenAIConfig
     hugging_face: HuggingFaceConfig
     logger: Logger
+    daemon: DaemonConfig
+    llm_limits: LLMLimits
+    llm_cache: LLMCacheConfig
+
+    @property
+    def general(self) -> GeneralConfig:
+        """The general config of the repository which is processed by
+        the current thread"""
+        return current_repository.get() or self.default_general
 
     @classmethod
     def from_env(cls) -> "Config":
         return cls(
-            general=GeneralConfig.from_env(),
+            default_general=GeneralConfig.from_env(),
             git=Git.from_env(),
             openai=OpenAIConfig.from_env(),
             hugging_face=HuggingFaceConfig.from_env(),
             logger=Logger.from_env(),
+            daemon=DaemonConfig.from_env(),
+            llm_limits=LLMLimits.from_env(),
+            llm_cache=LLMCacheConfig.from_env(),
         )
 
 
 config = Config.from_env()
+
+
+@contextmanager
+def use_repository(toplevel_directory: Path):
+    """Process another repository in the current thread. The general
+    config (config files, database, ...) and all git commands refer to
+    this repository within the context. Threads which are started
+    within the context must copy it (see `contextvars.copy_context`).
+    """
+    token = current_repository.set(GeneralConfig.for_repository(toplevel_directory))
+    try:
+        yield config.general
+    finally:
+        current_repository.reset(token)
@@ -1,7 +1,246 @@
+import json
 import sqlite3
-from dataclasses import dataclass
+import threading
+import zlib
+from dataclasses import dataclass, field
+from pathlib import Path
 
 from .config import config
+from .streaming import compress_json
+
+# seconds to wait for a lock held by another pygitai process
+BUSY_TIMEOUT = 30
+
+# Every migration is a list of statements. The index of a migration
+# (starting by 1) is its schema version, which is stored in the
+# `user_version` of the database. Never change an existing migration,
+# add a new one instead.
+MIGRATIONS: list[list[str]] = [
+    [
+        """
+        CREATE TABLE IF NOT EXISTS branches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            branch_name TEXT,
+            purpose TEXT,
+            ticket_link TEXT,
+            created_at INTEGER
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS commit_drafts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            job_name TEXT NOT NULL,
+            tree_hash TEXT NOT NULL,
+            response TEXT,
+            full_context TEXT,
+            created_at INTEGER,
+            UNIQUE (job_name, tree_hash)
+        )
+        """,
+    ],
+    [
+        # keep the latest row of duplicated branches
+        """
+        DELETE FROM branches
+        WHERE id NOT IN (SELECT MAX(id) FROM branches GROUP BY branch_name)
+        """,
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS branches_branch_name
+        ON branches (branch_name)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS commit_drafts_created_at
+        ON commit_drafts (created_at)
+        """,
+    ],
+    [
+        """
+        CREATE TABLE IF NOT EXISTS llm_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            job_name TEXT NOT NULL,
+            session_key TEXT NOT NULL,
+            data BLOB,
+            updated_at INTEGER,
+            UNIQUE (job_name, session_key)
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS llm_sessions_session_key
+        ON llm_sessions (session_key)
+        """,
+    ],
+    [
+        """
+        CREATE TABLE IF NOT EXISTS parsed_blobs (
+            language TEXT NOT NULL,
+            blob_id TEXT NOT NULL,
+            data BLOB,
+            PRIMARY KEY (language, blob_id)
+        )
+        """,
+    ],
+    [
+        """
+        CREATE TABLE IF NOT EXISTS symbol_files (
+            file_name TEXT PRIMARY KEY NOT NULL,
+            blob_id TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS symbols (
+            id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            file_name TEXT NOT NULL,
+            name TEXT NOT NULL,
+            kind TEXT,
+            line INTEGER,
+            end_line INTEGER,
+            signature TEXT,
+            docstring TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS symbols_name ON symbols (name)",
+        "CREATE INDEX IF NOT EXISTS symbols_file_name ON symbols (file_name)",
+        """
+        CREATE TABLE IF NOT EXISTS symbol_references (
+            file_name TEXT NOT NULL,
+            name TEXT NOT NULL,
+            line INTEGER
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS symbol_references_name
+        ON symbol_references (name)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS symbol_references_file_name
+        ON symbol_references (file_name)
+        """,
+    ],
+    [
+        """
+        CREATE TABLE IF NOT EXISTS history_commits (
+            commit_hash TEXT PRIMARY KEY NOT NULL,
+            title TEXT,
+            body TEXT,
+            file_names TEXT,
+            length INTEGER
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS history_terms (
+            term TEXT NOT NULL,
+            commit_hash TEXT NOT NULL,
+            frequency INTEGER,
+            PRIMARY KEY (term, commit_hash)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS history_index_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_commit TEXT
+        )
+        """,
+    ],
+    [
+        """
+        CREATE TABLE IF NOT EXISTS deferred_commits (
+            token TEXT PRIMARY KEY NOT NULL,
+            commit_hash TEXT NOT NULL,
+            branch_name TEXT,
+            use_commit_body INTEGER NOT NULL,
+            apply_mode TEXT NOT NULL,
+            status TEXT NOT NULL,
+            title TEXT,
+            body TEXT,
+            applied_as TEXT,
+            error TEXT,
+            created_at INTEGER,
+            updated_at INTEGER
+        )
+        """,
+    ],
+    [
+        """
+        CREATE TABLE IF NOT EXISTS reviews (
+            head_ref TEXT NOT NULL,
+            base_ref TEXT NOT NULL,
+            head_commit TEXT NOT NULL,
+            updated_at INTEGER,
+            PRIMARY KEY (head_ref, base_ref)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS review_files (
+            head_ref TEXT NOT NULL,
+            base_ref TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            diff_hash TEXT NOT NULL,
+            findings TEXT NOT NULL,
+            head_commit TEXT NOT NULL,
+            PRIMARY KEY (head_ref, base_ref, file_name)
+        )
+        """,
+    ],
+    [
+        "ALTER TABLE commit_drafts ADD COLUMN route TEXT",
+    ],
+]
+
+_local = threading.local()
+_migrated: set[Path] = set()
+_migrate_lock = threading.Lock()
+# marks values which aren't cached
+_MISSING = object()
+
+
+def migrate(connection: sqlite3.Connection):
+    """Apply all migrations which weren't applied to the database yet.
+
+    Each migration runs in its own transaction. The write lock is
+    acquired before the schema version is read, so concurrent
+    processes never apply a migration twice.
+    """
+    for version, statements in enumerate(MIGRATIONS, start=1):
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            (current_version,) = connection.execute("PRAGMA user_version").fetchone()
+            if current_version >= version:
+                connection.rollback()
+                continue
+            for statement in statements:
+                connection.execute(statement)
+            connection.execute(f"PRAGMA user_version = {version}")
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+
+
+def get_connection(db_name: Path | None = None) -> sqlite3.Connection:
+    """Get the connection to the pygitai database.
+
+    Connections are kept open and reused per thread. The database is
+    used in WAL mode with a busy timeout, so concurrent pygitai
+    processes can read while another one is writing. Pending
+    migrations are applied once per process.
+
+    The connection can be used as context manager to commit or
+    rollback a transaction.
+    """
+    db_name = db_name or config.general.db_name
+    connections = _local.__dict__.setdefault("connections", {})
+    connection = connections.get(db_name)
+    if connection is None:
+        connection = sqlite3.connect(db_name, timeout=BUSY_TIMEOUT)
+        connection.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT * 1000}")
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        with _migrate_lock:
+            if db_name not in _migrated:
+                migrate(connection)
+                _migrated.add(db_name)
+        connections[db_name] = connection
+    return connection
 
 
 @dataclass
@@ -17,39 +256,82 @@ class DoesNotExist(Exception):
 
 
 class BranchInfoDBAPI:
+    # branches which were fetched in advance (see `prefetch`) by
+    # database and branch name. None means the branch is known to not
+    # exist.
+    _cache: dict[tuple[Path, str], BranchInfo | None] = {}
+
     @classmethod
-    def create_table_if_not_exists(cls):
-        with sqlite3.connect(config.general.db_name) as connection:
+    def _cache_key(cls, branch_name: str) -> tuple[Path, str]:
+        return config.general.db_name, branch_name
+
+    @classmethod
+    def _clear_cache(cls):
+        """Forget the cached branches of the current database. The
+        branches of other repositories are kept."""
+        db_name = config.general.db_name
+        for cache_key in [key for key in list(cls._cache) if key[0] == db_name]:
+            cls._cache.pop(cache_key, None)
+
+    @classmethod
+    def insert(cls, branch_name: str, purpose: str, ticket_link: str, created_at: int):
+        cls._cache.pop(cls._cache_key(branch_name), None)
+        with get_connection() as connection:
             cursor = connection.cursor()
             cursor.execute(
                 """
-                CREATE TABLE IF NOT EXISTS branches (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-                    branch_name TEXT,
-                    purpose TEXT,
-                    ticket_link TEXT,
-                    created_at INTEGER
-                )
-            """
+                INSERT INTO branches (branch_name, purpose, ticket_link, created_at)
+                VALUES (?, ?, ?, ?)
+            """,
+                (branch_name, purpose, ticket_link, created_at),
             )
             connection.commit()
 
     @classmethod
-    def insert(cls, branch_name: str, purpose: str, ticket_link: str, created_at: int):
-        with sqlite3.connect(config.general.db_name) as connection:
+    def upsert(cls, branch_name: str, purpose: str, ticket_link: str, created_at: int):
+        """Insert a branch or update purpose and ticket link of an
+        existing one. The creation time of existing rows is kept."""
+        cls.bulk_upsert(
+            [
+                BranchInfo(
+                    branch_name=branch_name,
+                    purpose=purpose,
+                    ticket_link=ticket_link,
+                    created_at=created_at,
+                )
+            ]
+        )
+
+    @classmethod
+    def bulk_upsert(cls, branch_infos: list[BranchInfo]):
+        """Upsert many branches in a single transaction"""
+        cls._clear_cache()
+        with get_connection() as connection:
             cursor = connection.cursor()
-            cursor.execute(
+            cursor.executemany(
                 """
                 INSERT INTO branches (branch_name, purpose, ticket_link, created_at)
                 VALUES (?, ?, ?, ?)
+                ON CONFLICT (branch_name) DO UPDATE SET
+                    purpose = excluded.purpose,
+                    ticket_link = excluded.ticket_link
             """,
-                (branch_name, purpose, ticket_link, created_at),
+                [
+                    (
+                        branch_info.branch_name,
+                        branch_info.purpose,
+                        branch_info.ticket_link,
+                        branch_info.created_at,
+                    )
+                    for branch_info in branch_infos
+                ],
             )
             connection.commit()
 
     @classmethod
     def update(cls, branch_name: str, purpose: str, ticket_link: str):
-        with sqlite3.connect(config.general.db_name) as connection:
+        cls._cache.pop(cls._cache_key(branch_name), None)
+        with get_connection() as connection:
             cursor = connection.cursor()
             cursor.execute(
                 """
@@ -63,13 +345,82 @@ class BranchInfoDBAPI:
             )
             connection.commit()
 
+    @classmethod
+    def prune(cls, existing_branch_names: list[str]) -> int:
+        """Delete all branches which are not in `existing_branch_names`
+        in a single transaction.
+
+        Returns:
+            The number of deleted branches.
+        """
+        cls._clear_cache()
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                CREATE TEMP TABLE IF NOT EXISTS existing_branches (
+                    branch_name TEXT PRIMARY KEY
+                )
+            """
+            )
+            cursor.execute("DELETE FROM existing_branches")
+            cursor.executemany(
+                "INSERT OR IGNORE INTO existing_branches (branch_name) VALUES (?)",
+                [(branch_name,) for branch_name in existing_branch_names],
+            )
+            cursor.execute(
+                """
+                DELETE FROM branches
+                WHERE branch_name NOT IN (SELECT branch_name FROM existing_branches)
+            """
+            )
+            deleted = cursor.rowcount
+            cursor.execute("DELETE FROM existing_branches")
+            connection.commit()
+            return deleted
+
+    @classmethod
+    def all(cls) -> list[BranchInfo]:
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                SELECT branch_name, purpose, ticket_link, created_at
+                FROM branches
+                ORDER BY branch_name
+            """
+            )
+            return [BranchInfo(*row) for row in cursor.fetchall()]
+
+    @classmethod
+    def prefetch(cls, branch_name: str):
+        """Fetch a branch in advance. Following `get` calls for this
+        branch are served without a query."""
+        cls._clear_cache()
+        try:
+            cls._cache[cls._cache_key(branch_name)] = cls.fetch(branch_name)
+        except DoesNotExist:
+            cls._cache[cls._cache_key(branch_name)] = None
+
     @classmethod
     def get(cls, branch_name: str) -> BranchInfo:
-        with sqlite3.connect(config.general.db_name) as connection:
+        # a single lookup, other threads could change the cache
+        branch_info = cls._cache.get(cls._cache_key(branch_name), _MISSING)
+        if isinstance(branch_info, BranchInfo):
+            return branch_info
+        if branch_info is None:
+            raise DoesNotExist(f"Branch {branch_name} does not exist")
+        return cls.fetch(branch_name)
+
+    @classmethod
+    def fetch(cls, branch_name: str) -> BranchInfo:
+        with get_connection() as connection:
             cursor = connection.cursor()
             cursor.execute(
                 """
-                SELECT * FROM branches WHERE branch_name = ?
+                SELECT id, branch_name, purpose, ticket_link, created_at
+                FROM branches
+                WHERE branch_name = ?
             """,
                 (branch_name,),
             )
@@ -82,3 +433,733 @@ class BranchInfoDBAPI:
                 ticket_link=result[3],
                 created_at=result[4],
             )
+
+
+@dataclass
+class CommitDraft:
+    job_name: str
+    tree_hash: str
+    response: str
+    full_context: str
+    created_at: int
+    route: str | None = None
+
+
+class CommitDraftDBAPI:
+    """Drafts of LLM jobs which were generated in advance for a
+    specific state of the git index."""
+
+    @classmethod
+    def insert(
+        cls,
+        job_name: str,
+        tree_hash: str,
+        response: str,
+        full_context: str,
+        created_at: int,
+        route: str | None = None,
+    ):
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                INSERT OR REPLACE INTO commit_drafts (
+                    job_name, tree_hash, response, full_context, created_at, route
+                )
+                VALUES (?, ?, ?, ?, ?, ?)
+            """,
+                (job_name, tree_hash, response, full_context, created_at, route),
+            )
+            connection.commit()
+
+    @classmethod
+    def get(cls, job_name: str, tree_hash: str) -> CommitDraft:
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                SELECT job_name, tree_hash, response, full_context, created_at, route
+                FROM commit_drafts
+                WHERE job_name = ? AND tree_hash = ?
+            """,
+                (job_name, tree_hash),
+            )
+            result = cursor.fetchone()
+            if not result:
+                raise DoesNotExist(
+                    f"Commit draft for {job_name} and tree {tree_hash} does not exist"
+                )
+            return CommitDraft(*result)
+
+    @classmethod
+    def delete_older_than(cls, created_at: int):
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                DELETE FROM commit_drafts WHERE created_at < ?
+            """,
+                (created_at,),
+            )
+            connection.commit()
+
+
+@dataclass
+class LLMSession:
+    """The conversation of a LLM job with the user.
+
+    Attributes:
+        job_name: The name of the job.
+        session_key: The key of the input the job works on (i.e. the
+            hash of the staged files).
+        steps: Every response of the LLM in order. Each step is a
+            dict with the keys `response` and `feedback`. The feedback
+            is None as long as the user didn't answer.
+        full_context: The full context of the latest response.
+        accepted: The response which was accepted by the user.
+        route: The route the latest response was generated by (see
+            `routing`). None for the LLM and model of the job.
+    """
+
+    job_name: str
+    session_key: str
+    steps: list[dict] = field(default_factory=list)
+    full_context: list | str | None = None
+    accepted: str | None = None
+    route: str | None = None
+
+
+class LLMSessionDBAPI:
+    """LLM sessions are stored compressed since the full context
+    contains the complete prompt including the diff."""
+
+    @classmethod
+    def save(cls, session: LLMSession, updated_at: int):
+        # the full context may contain `Chunks`, it's encoded and
+        # compressed piece by piece
+        data = compress_json(
+            {
+                "steps": session.steps,
+                "full_context": session.full_context,
+                "accepted": session.accepted,
+                "route": session.route,
+            }
+        )
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                INSERT INTO llm_sessions (job_name, session_key, data, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (job_name, session_key) DO UPDATE SET
+                    data = excluded.data,
+                    updated_at = excluded.updated_at
+            """,
+                (session.job_name, session.session_key, data, updated_at),
+            )
+            connection.commit()
+
+    @classmethod
+    def get(cls, job_name: str, session_key: str) -> LLMSession:
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                SELECT data FROM llm_sessions
+                WHERE job_name = ? AND session_key = ?
+            """,
+                (job_name, session_key),
+            )
+            result = cursor.fetchone()
+            if not result:
+                raise DoesNotExist(
+                    f"LLM session for {job_name} and {session_key} does not exist"
+                )
+            data = json.loads(zlib.decompress(result[0]))
+            return LLMSession(job_name=job_name, session_key=session_key, **data)
+
+    @classmethod
+    def delete_by_session_key(cls, session_key: str):
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                DELETE FROM llm_sessions WHERE session_key = ?
+            """,
+                (session_key,),
+            )
+            connection.commit()
+
+    @classmethod
+    def delete_older_than(cls, updated_at: int):
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                DELETE FROM llm_sessions WHERE updated_at < ?
+            """,
+                (updated_at,),
+            )
+            connection.commit()
+
+
+class ParsedBlobDBAPI:
+    """Parse results of git blobs by language (see `code_context`).
+    Blobs are immutable, so the results never have to be updated."""
+
+    # sqlite allows up to 999 variables per statement in old versions
+    chunk_size = 500
+
+    @classmethod
+    def get_many(cls, language: str, blob_ids: list[str]) -> dict[str, list]:
+        results = {}
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            for start in range(0, len(blob_ids), cls.chunk_size):
+                end = start + cls.chunk_size
+                chunk = blob_ids[start:end]
+                placeholders = ", ".join("?" * len(chunk))
+                cursor.execute(
+                    f"""
+                    SELECT blob_id, data FROM parsed_blobs
+                    WHERE language = ? AND blob_id IN ({placeholders})
+                """,
+                    (language, *chunk),
+                )
+                for blob_id, data in cursor.fetchall():
+                    results[blob_id] = json.loads(zlib.decompress(data))
+        return results
+
+    @classmethod
+    def insert_many(cls, language: str, parsed_blobs: dict[str, list]):
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.executemany(
+                """
+                INSERT OR IGNORE INTO parsed_blobs (language, blob_id, data)
+                VALUES (?, ?, ?)
+            """,
+                [
+                    (language, blob_id, zlib.compress(json.dumps(data).encode()))
+                    for blob_id, data in parsed_blobs.items()
+                ],
+            )
+            connection.commit()
+
+
+@dataclass
+class Symbol:
+    """The definition of a function or class in the symbol index.
+
+    Attributes:
+        file_name: The file which defines the symbol.
+        name: The name of the symbol.
+        kind: The kind of the symbol (i.e. function or class).
+        line: The first line of the definition.
+        end_line: The last line of the definition.
+        signature: The source of the signature.
+        docstring: The first paragraph of the docstring.
+    """
+
+    file_name: str
+    name: str
+    kind: str
+    line: int
+    end_line: int
+    signature: str
+    docstring: str | None = None
+
+
+class SymbolIndexDBAPI:
+    """Definitions and references of the files in the index. The
+    symbols of a file are replaced whenever its blob changes."""
+
+    chunk_size = 500
+
+    @classmethod
+    def get_file_blobs(cls) -> dict[str, str]:
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT file_name, blob_id FROM symbol_files")
+            return dict(cursor.fetchall())
+
+    @classmethod
+    def replace_files(
+        cls,
+        file_blobs: dict[str, str | None],
+        symbols: list[Symbol],
+        references: list[tuple[str, str, int]],
+    ):
+        """Replace the symbols of many files in a single transaction.
+
+        Arguments:
+            file_blobs (dict[str, str | None]): The new blob ID of each
+                file. Files with None are removed from the index.
+            symbols (list[Symbol]): The definitions of the files.
+            references (list[tuple[str, str, int]]): The references of
+                the files as (file name, name, line).
+        """
+        file_names = [(file_name,) for file_name in file_blobs]
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            for table in ("symbol_files", "symbols", "symbol_references"):
+                cursor.executemany(
+                    f"DELETE FROM {table} WHERE file_name = ?", file_names
+                )
+            cursor.executemany(
+                "INSERT INTO symbol_files (file_name, blob_id) VALUES (?, ?)",
+                [
+                    (file_name, blob_id)
+                    for file_name, blob_id in file_blobs.items()
+                    if blob_id is not None
+                ],
+            )
+            cursor.executemany(
+                """
+                INSERT INTO symbols (
+                    file_name, name, kind, line, end_line, signature, docstring
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+                [
+                    (
+                        symbol.file_name,
+                        symbol.name,
+                        symbol.kind,
+                        symbol.line,
+                        symbol.end_line,
+                        symbol.signature,
+                        symbol.docstring,
+                    )
+                    for symbol in symbols
+                ],
+            )
+            cursor.executemany(
+                """
+                INSERT INTO symbol_references (file_name, name, line)
+                VALUES (?, ?, ?)
+            """,
+                references,
+            )
+            connection.commit()
+
+    @classmethod
+    def find_definitions(cls, names: list[str]) -> list[Symbol]:
+        symbols: list[Symbol] = []
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            for start in range(0, len(names), cls.chunk_size):
+                end = start + cls.chunk_size
+                chunk = names[start:end]
+                placeholders = ", ".join("?" * len(chunk))
+                cursor.execute(
+                    f"""
+                    SELECT file_name, name, kind, line, end_line, signature, docstring
+                    FROM symbols WHERE name IN ({placeholders})
+                """,
+                    chunk,
+                )
+                symbols.extend(Symbol(*row) for row in cursor.fetchall())
+        return symbols
+
+    @classmethod
+    def find_definitions_at(cls, file_name: str, lines: list[int]) -> list[Symbol]:
+        """Find the definitions of a file which contain any of the
+        given lines"""
+        if not lines:
+            return []
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                SELECT file_name, name, kind, line, end_line, signature, docstring
+                FROM symbols WHERE file_name = ?
+            """,
+                (file_name,),
+            )
+            return [
+                symbol
+                for symbol in (Symbol(*row) for row in cursor.fetchall())
+                if any(symbol.line <= line <= symbol.end_line for line in lines)
+            ]
+
+    @classmethod
+    def find_references(cls, name: str, limit: int = 10) -> list[tuple[str, int]]:
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                SELECT file_name, line FROM symbol_references
+                WHERE name = ? ORDER BY file_name LIMIT ?
+            """,
+                (name, limit),
+            )
+            return cursor.fetchall()
+
+
+@dataclass
+class HistoryCommit:
+    """A commit of the history index.
+
+    Attributes:
+        commit_hash: The hash of the commit.
+        title: The first line of the commit message.
+        body: The rest of the commit message.
+        file_names: The files which were changed by the commit.
+    """
+
+    commit_hash: str
+    title: str
+    body: str = ""
+    file_names: list[str] = field(default_factory=list)
+
+
+class HistoryIndexDBAPI:
+    """Inverted index of the commit history (see `history_index`)"""
+
+    chunk_size = 500
+
+    @classmethod
+    def get_last_commit(cls) -> str | None:
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT last_commit FROM history_index_state")
+            result = cursor.fetchone()
+            return result[0] if result else None
+
+    @classmethod
+    def insert_commits(
+        cls,
+        commits: list[tuple[HistoryCommit, dict[str, int]]],
+        last_commit: str,
+    ):
+        """Add commits and their term frequencies to the index.
+        Commits which are indexed already are skipped."""
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            for commit, terms in commits:
+                cursor.execute(
+                    """
+                    INSERT OR IGNORE INTO history_commits (
+                        commit_hash, title, body, file_names, length
+                    )
+                    VALUES (?, ?, ?, ?, ?)
+                """,
+                    (
+                        commit.commit_hash,
+                        commit.title,
+                        commit.body,
+                        json.dumps(commit.file_names),
+                        sum(terms.values()),
+                    ),
+                )
+                if not cursor.rowcount:
+                    continue
+                cursor.executemany(
+                    """
+                    INSERT INTO history_terms (term, commit_hash, frequency)
+                    VALUES (?, ?, ?)
+                """,
+                    [
+                        (term, commit.commit_hash, frequency)
+                        for term, frequency in terms.items()
+                    ],
+                )
+            cursor.execute(
+                """
+                INSERT INTO history_index_state (id, last_commit) VALUES (1, ?)
+                ON CONFLICT (id) DO UPDATE SET last_commit = excluded.last_commit
+            """,
+                (last_commit,),
+            )
+            connection.commit()
+
+    @classmethod
+    def get_stats(cls) -> tuple[int, float]:
+        """Get the number of indexed commits and their average length"""
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT COUNT(*), AVG(length) FROM history_commits")
+            count, average_length = cursor.fetchone()
+            return count, average_length or 0.0
+
+    @classmethod
+    def get_postings(cls, terms: list[str]) -> list[tuple[str, str, int, int]]:
+        """Get (term, commit hash, frequency, commit length) of all
+        commits which contain any of the terms"""
+        postings = []
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            for start in range(0, len(terms), cls.chunk_size):
+                end = start + cls.chunk_size
+                chunk = terms[start:end]
+                placeholders = ", ".join("?" * len(chunk))
+                cursor.execute(
+                    f"""
+                    SELECT t.term, t.commit_hash, t.frequency, c.length
+                    FROM history_terms t
+                    JOIN history_commits c ON c.commit_hash = t.commit_hash
+                    WHERE t.term IN ({placeholders})
+                """,
+                    chunk,
+                )
+                postings.extend(cursor.fetchall())
+        return postings
+
+    @classmethod
+    def get_commits(cls, commit_hashes: list[str]) -> dict[str, HistoryCommit]:
+        if not commit_hashes:
+            return {}
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            placeholders = ", ".join("?" * len(commit_hashes))
+            cursor.execute(
+                f"""
+                SELECT commit_hash, title, body, file_names FROM history_commits
+                WHERE commit_hash IN ({placeholders})
+            """,
+                commit_hashes,
+            )
+            return {
+                commit_hash: HistoryCommit(
+                    commit_hash=commit_hash,
+                    title=title,
+                    body=body,
+                    file_names=json.loads(file_names),
+                )
+                for commit_hash, title, body, file_names in cursor.fetchall()
+            }
+
+
+@dataclass
+class DeferredCommit:
+    """A commit which was made with a placeholder message. The message
+    is generated later by a background worker (see `deferred`).
+
+    Attributes:
+        token: The key of the commit. It's part of the placeholder
+            message, so the commit can be found after a rebase.
+        commit_hash: The hash of the commit when it was made.
+        branch_name: The branch the commit was made on.
+        use_commit_body: If True, a commit body is generated as well.
+        apply_mode: How the message should be applied (`reword` or
+            `note`).
+        status: `pending`, `running`, `done` or `failed`.
+        title: The generated title.
+        body: The generated body.
+        applied_as: How the message was applied (`reword` or `note`).
+        error: The error of the last failed attempt.
+    """
+
+    token: str
+    commit_hash: str
+    branch_name: str | None
+    use_commit_body: bool
+    apply_mode: str
+    status: str
+    title: str | None = None
+    body: str | None = None
+    applied_as: str | None = None
+    error: str | None = None
+    created_at: int | None = None
+    updated_at: int | None = None
+
+
+class DeferredCommitDBAPI:
+    """The queue of commits whose messages weren't generated yet"""
+
+    columns = (
+        "token, commit_hash, branch_name, use_commit_body, apply_mode, status, "
+        "title, body, applied_as, error, created_at, updated_at"
+    )
+
+    @classmethod
+    def insert(cls, deferred_commit: DeferredCommit):
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                f"""
+                INSERT INTO deferred_commits ({cls.columns})
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+                (
+                    deferred_commit.token,
+                    deferred_commit.commit_hash,
+                    deferred_commit.branch_name,
+                    int(deferred_commit.use_commit_body),
+                    deferred_commit.apply_mode,
+                    deferred_commit.status,
+                    deferred_commit.title,
+                    deferred_commit.body,
+                    deferred_commit.applied_as,
+                    deferred_commit.error,
+                    deferred_commit.created_at,
+                    deferred_commit.updated_at,
+                ),
+            )
+            connection.commit()
+
+    @classmethod
+    def get_all(cls, statuses: list[str] | None = None) -> list[DeferredCommit]:
+        """Get the deferred commits with one of the statuses (all by
+        default), oldest first"""
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            query = f"SELECT {cls.columns} FROM deferred_commits"
+            parameters: list[str] = []
+            if statuses:
+                query += f" WHERE status IN ({', '.join('?' * len(statuses))})"
+                parameters = statuses
+            cursor.execute(f"{query} ORDER BY created_at, rowid", parameters)
+            return [cls.from_row(row) for row in cursor.fetchall()]
+
+    @staticmethod
+    def from_row(row: tuple) -> DeferredCommit:
+        values = list(row)
+        # use_commit_body is stored as integer
+        values[3] = bool(values[3])
+        return DeferredCommit(*values)
+
+    @classmethod
+    def update(cls, deferred_commit: DeferredCommit):
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                UPDATE deferred_commits
+                SET
+                    commit_hash = ?,
+                    status = ?,
+                    title = ?,
+                    body = ?,
+                    applied_as = ?,
+                    error = ?,
+                    updated_at = ?
+                WHERE token = ?
+            """,
+                (
+                    deferred_commit.commit_hash,
+                    deferred_commit.status,
+                    deferred_commit.title,
+                    deferred_commit.body,
+                    deferred_commit.applied_as,
+                    deferred_commit.error,
+                    deferred_commit.updated_at,
+                    deferred_commit.token,
+                ),
+            )
+            connection.commit()
+
+
+@dataclass
+class ReviewedFile:
+    """The findings of a single file of a code review.
+
+    Attributes:
+        file_name: The path of the file.
+        diff_hash: The hash of the diff of the file which was reviewed.
+        findings: The review of the diff.
+        head_commit: The head commit the file was reviewed at.
+    """
+
+    file_name: str
+    diff_hash: str
+    findings: str
+    head_commit: str
+
+
+@dataclass
+class Review:
+    """The last code review of a head ref against a base ref (see
+    `CodeReview.review_incremental`).
+
+    Attributes:
+        head_ref: The reviewed branch or hash.
+        base_ref: The branch or hash it was compared against.
+        head_commit: The commit of `head_ref` at the last review.
+        files: The findings by file name.
+    """
+
+    head_ref: str
+    base_ref: str
+    head_commit: str
+    files: dict[str, ReviewedFile] = field(default_factory=dict)
+    updated_at: int | None = None
+
+
+class ReviewDBAPI:
+    """The findings of past code reviews by file, so unchanged files
+    don't have to be reviewed again."""
+
+    @classmethod
+    def get(cls, head_ref: str, base_ref: str) -> Review:
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                SELECT head_commit, updated_at
+                FROM reviews
+                WHERE head_ref = ? AND base_ref = ?
+            """,
+                (head_ref, base_ref),
+            )
+            result = cursor.fetchone()
+            if not result:
+                raise DoesNotExist(
+                    f"Review of {head_ref} against {base_ref} does not exist"
+                )
+            head_commit, updated_at = result
+            cursor.execute(
+                """
+                SELECT file_name, diff_hash, findings, head_commit
+                FROM review_files
+                WHERE head_ref = ? AND base_ref = ?
+            """,
+                (head_ref, base_ref),
+            )
+            return Review(
+                head_ref=head_ref,
+                base_ref=base_ref,
+                head_commit=head_commit,
+                files={row[0]: ReviewedFile(*row) for row in cursor.fetchall()},
+                updated_at=updated_at,
+            )
+
+    @classmethod
+    def save(cls, review: Review):
+        """Replace the review and all of its files in a single
+        transaction"""
+        key = (review.head_ref, review.base_ref)
+        with get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                """
+                INSERT OR REPLACE INTO reviews (
+                    head_ref, base_ref, head_commit, updated_at
+                )
+                VALUES (?, ?, ?, ?)
+            """,
+                (*key, review.head_commit, review.updated_at),
+            )
+            cursor.execute(
+                "DELETE FROM review_files WHERE head_ref = ? AND base_ref = ?", key
+            )
+            cursor.executemany(
+                """
+                INSERT INTO review_files (
+                    head_ref, base_ref, file_name, diff_hash, findings, head_commit
+                )
+                VALUES (?, ?, ?, ?, ?, ?)
+            """,
+                [
+                    (
+                        *key,
+                        reviewed_file.file_name,
+                        reviewed_file.diff_hash,
+                        reviewed_file.findings,
+                        reviewed_file.head_commit,
+                    )
+                    for reviewed_file in review.files.values()
+                ],
+            )
+            connection.commit()
@@ -0,0 +1,172 @@
+"""Commits whose messages are generated later.
+
+`pygitai commit --defer` commits the staged changes right away with a
+placeholder message and queues the commit in the pygitai database. A
+background worker (`pygitai deferred run`) generates the message and
+applies it either
+
+- by rewording the commit, if neither the commit nor any commit on
+  top of it was pushed. The commits are rewritten without touching
+  the index or the working tree, only HEAD is moved.
+- or as a git note, if the commit can't be reworded.
+
+The placeholder contains a trailer with the token of the queue entry,
+so the commit is found again after it was rebased.
+"""
+import secrets
+import subprocess
+import time
+
+from .config import config
+from .db_api import DeferredCommit, DeferredCommitDBAPI
+from .git import Git
+from .logger import get_logger
+
+logger = get_logger(__name__, config.logger.level)
+
+TRAILER = "Pygitai-Deferred"
+# the number of files which are listed in the placeholder at most
+MAX_PLACEHOLDER_FILES = 10
+# the parent of root commits
+EMPTY_TREE = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+
+
+def get_placeholder(token: str, file_names: list[str]) -> tuple[str, str]:
+    """Get the title and body of the placeholder message"""
+    title = f"[pygitai] Pending commit message for {len(file_names)} file(s)"
+    lines = [f"- {file_name}" for file_name in file_names[:MAX_PLACEHOLDER_FILES]]
+    if len(file_names) > MAX_PLACEHOLDER_FILES:
+        lines.append(f"- ... and {len(file_names) - MAX_PLACEHOLDER_FILES} more")
+    body = "\n".join(["Files:", *lines, "", f"{TRAILER}: {token}"])
+    return title, body
+
+
+def is_placeholder(message: str) -> bool:
+    return f"\n{TRAILER}: " in message
+
+
+def defer_commit(
+    file_names: list[str], use_commit_body: bool, apply_mode: str
+) -> DeferredCommit:
+    """Commit the staged changes with a placeholder message and queue
+    the generation of the real message"""
+    token = secrets.token_hex(8)
+    title, body = get_placeholder(token, file_names)
+    Git.exec_commit(title, body=body)
+    now = int(time.time())
+    deferred_commit = DeferredCommit(
+        token=token,
+        commit_hash=Git.resolve_commit("HEAD") or "",
+        branch_name=Git.get_current_branch() or None,
+        use_commit_body=use_commit_body,
+        apply_mode=apply_mode,
+        status="pending",
+        created_at=now,
+        updated_at=now,
+    )
+    DeferredCommitDBAPI.insert(deferred_commit)
+    return deferred_commit
+
+
+def find_commit(deferred_commit: DeferredCommit) -> str | None:
+    """Get the current hash of a deferred commit. The commit is
+    searched by its placeholder in the history of HEAD first, it
+    could have been rebased."""
+    return Git.find_commit(
+        f"{TRAILER}: {deferred_commit.token}", ["HEAD"]
+    ) or Git.resolve_commit(deferred_commit.commit_hash)
+
+
+def get_parent(commit_hash: str) -> str:
+    return Git.resolve_commit(f"{commit_hash}^") or EMPTY_TREE
+
+
+def rewrite_commit(
+    commit: str, message: str | None = None, parents: dict[str, str] | None = None
+) -> str:
+    """Change the message and/or the parents of a raw commit object.
+    Signatures are removed, they don't match anymore."""
+    headers, _, old_message = commit.partition("\n\n")
+    lines = []
+    in_signature = False
+    for line in headers.split("\n"):
+        if in_signature and line.startswith(" "):
+            continue
+        in_signature = line.startswith("gpgsig")
+        if in_signature:
+            continue
+        if parents and line.startswith("parent "):
+            parent = line.removeprefix("parent ")
+            line = f"parent {parents.get(parent, parent)}"
+        lines.append(line)
+    return "\n".join(lines) + "\n\n" + (old_message if message is None else message)
+
+
+def get_reword_blocker(commit_hash: str) -> str | None:
+    """Get the reason why a commit can't be reworded safely. None if
+    it can be reworded. Any git error blocks the reword."""
+    try:
+        if Git.is_operation_in_progress():
+            return "a rebase, merge or cherry-pick is in progress"
+        if not Git.is_ancestor(commit_hash, "HEAD"):
+            return "the commit is not part of HEAD"
+        remote_refs = Git.get_remote_refs_containing(commit_hash)
+        if remote_refs:
+            return f"the commit was pushed to {', '.join(remote_refs)}"
+        if any(
+            len(parents) != 1
+            for _, parents in Git.get_rev_list([f"{commit_hash}..HEAD"])
+        ):
+            return "a merge commit follows the commit"
+    except subprocess.CalledProcessError as e:
+        return f"git failed: {e}"
+    return None
+
+
+def reword(commit_hash: str, message: str) -> str | None:
+    """Change the message of a commit of HEAD which wasn't pushed.
+    The commits on top of it are rewritten with the same trees, so
+    the index and the working tree stay as they are.
+
+    Returns:
+        The hash of the reworded commit. None if the commit can't be
+        reworded safely or if HEAD was moved meanwhile.
+    """
+    blocker = get_reword_blocker(commit_hash)
+    if blocker is not None:
+        logger.info("Can't reword %s: %s", commit_hash, blocker)
+        return None
+
+    head = Git.resolve_commit("HEAD")
+    replaced = {
+        commit_hash: Git.write_commit(
+            rewrite_commit(Git.read_commit(commit_hash), message=message)
+        )
+    }
+    for descendant, _ in Git.get_rev_list([f"{commit_hash}..HEAD"]):
+        replaced[descendant] = Git.write_commit(
+            rewrite_commit(Git.read_commit(descendant), parents=replaced)
+        )
+    if not Git.update_ref(
+        "HEAD", replaced[head], head, f"pygitai: reword deferred commit {commit_hash}"
+    ):
+        return None
+    return replaced[commit_hash]
+
+
+def apply_message(deferred_commit: DeferredCommit, commit_hash: str):
+    """Apply the generated message of a deferred commit. `applied_as`
+    and `commit_hash` are updated."""
+    message = deferred_commit.title or ""
+    if deferred_commit.body:
+        message = f"{message}\n\n{deferred_commit.body}"
+    message = f"{message.strip()}\n"
+    if deferred_commit.apply_mode == "reword":
+        reworded_hash = reword(commit_hash, message)
+        if reworded_hash is not None:
+            deferred_commit.applied_as = "reword"
+            deferred_commit.commit_hash = reworded_hash
+            return
+    Git.add_note(commit_hash, message)
+    deferred_commit.applied_as = "note"
+    deferred_commit.commit_hash = commit_hash
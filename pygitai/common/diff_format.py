@@ -0,0 +1,109 @@
+import json
+import re
+from typing import Callable, Iterator
+
+from .streaming import Chunks
+
+DIFF_HEADER_PATTERN = re.compile(r"^diff --git a/(.*) b/(.*)$", re.MULTILINE)
+# lines of a git diff header which are redundant if the file name is
+# already given by the compact header
+REDUNDANT_HEADER_PREFIXES = ("diff --git ", "index ", "--- ", "+++ ")
+
+
+def split_diff(diff: str) -> dict[str, str]:
+    """Split a unified diff of many files into a diff per file"""
+    matches = list(DIFF_HEADER_PATTERN.finditer(diff))
+    if not matches:
+        return {"": diff} if diff else {}
+    files = {}
+    for match, next_match in zip(matches, matches[1:] + [None]):
+        start = match.start()
+        end = next_match.start() if next_match else len(diff)
+        files[match.group(2)] = diff[start:end]
+    return files
+
+
+def iter_raw(diff: dict[str, str]) -> Iterator[str]:
+    """The plain unified diff as git prints it"""
+    yield from diff.values()
+
+
+def compact_file_diff(file_diff: str) -> str:
+    lines = file_diff.splitlines(keepends=True)
+    for i, line in enumerate(lines):
+        if line.startswith("@@"):
+            break
+    else:
+        i = len(lines)
+    header = [
+        line for line in lines[:i] if not line.startswith(REDUNDANT_HEADER_PREFIXES)
+    ]
+    return "".join(header + lines[i:])
+
+
+def iter_compact(diff: dict[str, str]) -> Iterator[str]:
+    """A unified diff with a single short header per file. The git
+    header lines which just repeat the file name are dropped."""
+    for file_name, file_diff in diff.items():
+        yield f"### {file_name}\n"
+        yield compact_file_diff(file_diff)
+
+
+def iter_json(diff: dict[str, str]) -> Iterator[str]:
+    """A JSON object which maps file names to their diffs"""
+    yield "{"
+    for index, (file_name, file_diff) in enumerate(diff.items()):
+        yield f"{', ' if index else ''}{json.dumps(file_name)}: "
+        yield json.dumps(file_diff)
+    yield "}"
+
+
+def format_raw(diff: dict[str, str]) -> str:
+    return "".join(iter_raw(diff))
+
+
+def format_compact(diff: dict[str, str]) -> str:
+    return "".join(iter_compact(diff))
+
+
+def format_json(diff: dict[str, str]) -> str:
+    return "".join(iter_json(diff))
+
+
+# the formats yield the serialized diff in chunks, the chunks of the
+# raw format are the original strings of the diff
+DIFF_FORMATS: dict[str, Callable[[dict[str, str]], Iterator[str]]] = {
+    "raw": iter_raw,
+    "compact": iter_compact,
+    "json": iter_json,
+}
+DEFAULT_DIFF_FORMAT = "compact"
+
+
+def format_diff(
+    diff: dict[str, str] | str, diff_format: str = DEFAULT_DIFF_FORMAT
+) -> str:
+    """Serialize a diff for a prompt template.
+
+    Arguments:
+        diff (dict[str, str] | str): Either a diff per file or a
+            unified diff of many files.
+        diff_format (str): The format to use. Allowed values: raw,
+            compact, json
+    """
+    return str(format_diff_chunks(diff, diff_format))
+
+
+def format_diff_chunks(
+    diff: dict[str, str] | str, diff_format: str = DEFAULT_DIFF_FORMAT
+) -> Chunks:
+    """Like `format_diff`, but the result isn't joined into a single
+    string (see `streaming`)."""
+    if diff_format not in DIFF_FORMATS:
+        raise ValueError(
+            f"Unknown diff format {diff_format}. "
+            f"Allowed values: {', '.join(DIFF_FORMATS)}"
+        )
+    if isinstance(diff, str):
+        diff = split_diff(diff)
+    return Chunks(DIFF_FORMATS[diff_format](diff))
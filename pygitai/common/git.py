@@ -1,14 +1,24 @@
 import fnmatch
+import hashlib
 import subprocess
+import threading
 from dataclasses import dataclass
 from pathlib import Path
 
-from .config import config
-from .logger import get_logger
+from .config import config, current_repository
+from .logger import LazyStr, get_logger
+from .tracing import traced
 
 logger = get_logger(__name__, config.logger.level)
 
 
+def get_cwd() -> Path | None:
+    """Get the directory git commands are executed in. None means the
+    working directory of the process (see `config.use_repository`)."""
+    repository = current_repository.get()
+    return repository.toplevel_directory if repository else None
+
+
 def get_ignored_file_patterns() -> list[str]:
     top_level_directory = Git.get_toplevel_directory()
     pygitai_ignore_file = top_level_directory / ".pygitaiignore"
@@ -26,53 +36,178 @@ def file_name_matches_patterns(file_name: str, patterns: list[str]) -> bool:
     return False
 
 
+def shard_file_names(
+    file_names: list[str],
+    max_files: int,
+    max_bytes: int,
+) -> list[list[str]]:
+    """Split file names into shards which are bounded by the number
+    of files and by the size of the resulting command line arguments.
+    """
+    shards: list[list[str]] = []
+    shard: list[str] = []
+    shard_bytes = 0
+    for file_name in file_names:
+        file_name_bytes = len(file_name.encode()) + 1
+        if shard and (
+            len(shard) >= max_files or shard_bytes + file_name_bytes > max_bytes
+        ):
+            shards.append(shard)
+            shard, shard_bytes = [], 0
+        shard.append(file_name)
+        shard_bytes += file_name_bytes
+    if shard:
+        shards.append(shard)
+    return shards
+
+
+def get_file_signatures(file_names: list[str]) -> dict[str, tuple[int, int] | None]:
+    """Get a cheap signature (mtime, size) for each file. Deleted
+    files have no signature.
+    """
+    toplevel_directory = config.general.toplevel_directory
+    signatures: dict[str, tuple[int, int] | None] = {}
+    for file_name in file_names:
+        try:
+            stat = (toplevel_directory / file_name).stat()
+        except OSError:
+            signatures[file_name] = None
+        else:
+            signatures[file_name] = (stat.st_mtime_ns, stat.st_size)
+    return signatures
+
+
+class PreCommitHookFailed(subprocess.CalledProcessError):
+    """One or more pre-commit shards failed
+
+    Attributes:
+        failed_shards: The file names of every shard which failed.
+    """
+
+    def __init__(self, failed_shards: list[list[str]], returncode: int):
+        super().__init__(returncode, ["pre-commit", "run", "--files"])
+        self.failed_shards = failed_shards
+
+    def __str__(self):
+        file_count = sum(len(shard) for shard in self.failed_shards)
+        return (
+            f"pre-commit failed for {len(self.failed_shards)} shard(s) "
+            f"with {file_count} file(s)"
+        )
+
+
 class PreCommitHook:
     @classmethod
-    def run(cls, file_names: list[str], allow_retry: bool = True, *args, **kwargs):
+    @traced("pre_commit.run_shard", "git")
+    def run_shard(cls, file_names: list[str]) -> subprocess.CompletedProcess:
+        """Run pre-commit for a single shard of files. The output of the
+        hooks goes straight to the terminal."""
         cmd = ["pre-commit", "run", "--files"] + file_names
-        logger.info(f'cmd {" ".join(cmd)}')
-        pre_commit_response = subprocess.run(cmd)
-        try:
-            pre_commit_response.check_returncode()
-        except subprocess.CalledProcessError:
-            if allow_retry:
-                Git.exec_stage_files(file_names)
-                cls.run(file_names, allow_retry=False)
-            else:
-                raise
+        logger.info("cmd pre-commit run --files <%d files>", len(file_names))
+        logger.debug("cmd %s", cmd)
+        return subprocess.run(cmd, cwd=get_cwd())
+
+    @classmethod
+    def run_shards(cls, shards: list[list[str]]) -> list[list[str]]:
+        """Run pre-commit for all shards one after another and return
+        the shards which failed.
+
+        The shards are never run concurrently: pre-commit stashes the
+        unstaged changes of the worktree and restores them afterwards,
+        and fixing hooks rewrite files. Concurrent runs in the same
+        worktree would race on both.
+        """
+        failed_shards: list[list[str]] = []
+        for shard in shards:
+            response = cls.run_shard(shard)
+            if response.returncode != 0:
+                failed_shards.append(shard)
+        return failed_shards
+
+    @classmethod
+    @traced("pre_commit.run", "git")
+    def run(cls, file_names: list[str], allow_retry: bool = True, *args, **kwargs):
+        """Run pre-commit for the given files.
+
+        The files are split into shards which are small enough to
+        avoid hitting the argument size limit of the OS. The shards
+        are executed one after another. If a shard fails, the files which
+        were modified by the hooks are staged again and only the
+        failed shards are retried once.
+        """
+        if not file_names:
+            return
+
+        shards = shard_file_names(
+            file_names,
+            max_files=config.git.pre_commit_shard_size,
+            max_bytes=config.git.pre_commit_shard_bytes,
+        )
+        signatures = get_file_signatures(file_names)
+        failed_shards = cls.run_shards(shards)
+        if not failed_shards:
+            return
+        if not allow_retry:
+            raise PreCommitHookFailed(failed_shards, returncode=1)
+
+        failed_file_names = [fp for shard in failed_shards for fp in shard]
+        new_signatures = get_file_signatures(failed_file_names)
+        modified_file_names = [
+            fp
+            for fp in failed_file_names
+            if new_signatures[fp] is not None and new_signatures[fp] != signatures[fp]
+        ]
+        if modified_file_names:
+            logger.info(
+                "Re-stage %d file(s) modified by hooks", len(modified_file_names)
+            )
+            Git.exec_stage_files(modified_file_names)
+
+        failed_shards = cls.run_shards(failed_shards)
+        if failed_shards:
+            raise PreCommitHookFailed(failed_shards, returncode=1)
 
 
 class Git:
     @classmethod
+    @traced("git.get_staged_files", "git")
     def get_staged_files(cls) -> list[str]:
         """Get all staged files"""
         cmd = ["git", "diff", "--name-only", "--cached"]
-        logger.info(f'cmd {" ".join(cmd)}')
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
         diff = subprocess.run(
             cmd,
+            cwd=get_cwd(),
             stdout=subprocess.PIPE,
             text=True,
         )
-        logger.info(diff.stdout)
+        logger.debug("Staged files: %s", diff.stdout)
         return diff.stdout.split("\n")
 
     @classmethod
-    def get_diff(cls, file_name: str | None = None):
+    @traced("git.get_diff", "git")
+    def get_diff(
+        cls, file_name: str | None = None, number_of_context_lines: int | None = None
+    ):
         """Get the diff of all staged git files"""
         cmd = ["git", "diff", "--cached"]
+        if number_of_context_lines is not None:
+            cmd.append(f"-U{number_of_context_lines}")
         if file_name:
             cmd.append(file_name)
 
-        logger.info(f'cmd {" ".join(cmd)}')
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
 
         diff = subprocess.run(
             cmd,
+            cwd=get_cwd(),
             stdout=subprocess.PIPE,
             text=True,
         )
         return diff.stdout
 
     @classmethod
+    @traced("git.get_diff_between_branches", "git")
     def get_diff_between_branches(
         cls, branch_1: str, branch_2: str, number_of_context_lines: int = 10
     ):
@@ -87,54 +222,423 @@ class Git:
         cmd.extend(["--", "."])
         cmd.extend(excludes)
 
-        logger.info(f'cmd {" ".join(cmd)}')
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
         diff = subprocess.run(
             cmd,
+            cwd=get_cwd(),
             stdout=subprocess.PIPE,
             text=True,
         )
         return diff.stdout
 
     @classmethod
+    @traced("git.get_diff_blobs", "git")
+    def get_diff_blobs(
+        cls, branch_1: str | None = None, branch_2: str | None = None
+    ) -> dict[str, tuple[str | None, str | None]]:
+        """Get the blob IDs of the pre- and post-image of each changed
+        file by its (new) name. The ID is None if the file doesn't
+        exist on one side. Without branches the staged changes are
+        used."""
+        cmd = ["git", "diff", "--raw", "-z", "--no-abbrev"]
+        if branch_1 and branch_2:
+            cmd.extend([branch_1, branch_2])
+        else:
+            cmd.append("--cached")
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
+        response = subprocess.run(
+            cmd,
+            cwd=get_cwd(),
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        # records are `:<modes> <old> <new> <status>\0<path>\0` and
+        # renames or copies have a second path
+        fields = response.stdout.split("\0")
+        blobs = {}
+        index = 0
+        while index < len(fields) - 1:
+            _, _, old_blob, new_blob, status = fields[index].split(" ", 4)
+            path_count = 2 if status[:1] in ("R", "C") else 1
+            file_name = fields[index + path_count]
+            blobs[file_name] = (
+                None if set(old_blob) == {"0"} else old_blob,
+                None if set(new_blob) == {"0"} else new_blob,
+            )
+            index += path_count + 1
+        return blobs
+
+    @classmethod
+    @traced("git.get_index_blobs", "git")
+    def get_index_blobs(cls) -> dict[str, str]:
+        """Get the blob IDs of all files in the index by file name"""
+        cmd = ["git", "ls-files", "--stage", "-z"]
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
+        response = subprocess.run(
+            cmd,
+            cwd=get_cwd(),
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        blobs = {}
+        # records are `<mode> <blob> <stage>\t<path>\0`
+        for record in response.stdout.split("\0"):
+            if not record:
+                continue
+            info, _, file_name = record.partition("\t")
+            mode, blob_id, _ = info.split(" ")
+            # skip submodules
+            if mode != "160000":
+                blobs[file_name] = blob_id
+        return blobs
+
+    @classmethod
+    @traced("git.read_blobs", "git")
+    def read_blobs(cls, blob_ids: list[str]) -> dict[str, bytes]:
+        """Read many blobs from the object store with a single git
+        process. Missing blobs are skipped."""
+        if not blob_ids:
+            return {}
+        cmd = ["git", "cat-file", "--batch"]
+        logger.info("cmd %s <%d blobs>", LazyStr(" ".join, cmd), len(blob_ids))
+        response = subprocess.run(
+            cmd,
+            cwd=get_cwd(),
+            input="".join(f"{blob_id}\n" for blob_id in blob_ids).encode(),
+            stdout=subprocess.PIPE,
+        )
+        output = response.stdout
+        blobs = {}
+        position = 0
+        while position < len(output):
+            header_end = output.index(b"\n", position)
+            header = output[position:header_end].decode().split()
+            position = header_end + 1
+            if len(header) != 3:
+                # `<id> missing`
+                continue
+            blob_id, _, size = header
+            end = position + int(size)
+            blobs[blob_id] = output[position:end]
+            # the content is followed by a newline
+            position = end + 1
+        return blobs
+
+    @classmethod
+    @traced("git.get_log", "git")
+    def get_log(
+        cls, revisions: list[str], max_count: int | None = None
+    ) -> list[tuple[str, str, list[str]]]:
+        """Get the hash, message and changed files of the commits of
+        the given revisions (i.e. `["HEAD", "^<hash>"]`), newest
+        first. Merge commits are skipped."""
+        cmd = ["git", "log", "--no-merges", "--name-only", "--format=%x1e%H%x1f%B%x1f"]
+        if max_count:
+            cmd.append(f"-n{max_count}")
+        cmd.extend(revisions)
+        cmd.append("--")
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
+        response = subprocess.run(
+            cmd,
+            cwd=get_cwd(),
+            stdout=subprocess.PIPE,
+            text=True,
+            errors="replace",
+        )
+        commits = []
+        for record in response.stdout.split("\x1e")[1:]:
+            commit_hash, message, file_names = record.split("\x1f", 2)
+            commits.append(
+                (
+                    commit_hash,
+                    message.strip(),
+                    [file_name for file_name in file_names.splitlines() if file_name],
+                )
+            )
+        return commits
+
+    @classmethod
+    @traced("git.resolve_commit", "git")
+    def resolve_commit(cls, ref: str) -> str | None:
+        """Get the hash of a commit. None if it doesn't exist."""
+        cmd = ["git", "rev-parse", "--verify", "--quiet", f"{ref}^{{commit}}"]
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
+        response = subprocess.run(
+            cmd,
+            cwd=get_cwd(),
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        return response.stdout.strip() if response.returncode == 0 else None
+
+    @classmethod
+    @traced("git.find_commit", "git")
+    def find_commit(cls, message: str, revisions: list[str]) -> str | None:
+        """Get the hash of the newest commit of the revisions whose
+        message contains the text. None if there is no such commit."""
+        cmd = ["git", "log", "-n1", "--format=%H", "--fixed-strings"]
+        cmd.append(f"--grep={message}")
+        cmd.extend(revisions)
+        cmd.append("--")
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
+        response = subprocess.run(
+            cmd,
+            cwd=get_cwd(),
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        return response.stdout.strip() or None
+
+    @classmethod
+    @traced("git.get_rev_list", "git")
+    def get_rev_list(cls, revisions: list[str]) -> list[tuple[str, list[str]]]:
+        """Get the hash and the parents of the commits of the
+        revisions (i.e. `["<hash>..HEAD"]`), oldest first. Raises
+        CalledProcessError if git fails."""
+        cmd = ["git", "rev-list", "--reverse", "--parents"] + revisions + ["--"]
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
+        response = subprocess.run(
+            cmd,
+            cwd=get_cwd(),
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        response.check_returncode()
+        commits = []
+        for line in response.stdout.splitlines():
+            commit_hash, *parents = line.split()
+            commits.append((commit_hash, parents))
+        return commits
+
+    @classmethod
+    @traced("git.is_ancestor", "git")
+    def is_ancestor(cls, ancestor: str, descendant: str) -> bool:
+        cmd = ["git", "merge-base", "--is-ancestor", ancestor, descendant]
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
+        return subprocess.run(cmd, cwd=get_cwd()).returncode == 0
+
+    @classmethod
+    @traced("git.get_remote_refs_containing", "git")
+    def get_remote_refs_containing(cls, commit_hash: str) -> list[str]:
+        """Get all remote-tracking refs which contain the commit, i.e.
+        to which it was pushed. Raises CalledProcessError if git
+        fails."""
+        cmd = ["git", "for-each-ref", "--format=%(refname:short)"]
+        cmd.extend([f"--contains={commit_hash}", "refs/remotes"])
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
+        response = subprocess.run(
+            cmd,
+            cwd=get_cwd(),
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        response.check_returncode()
+        return [ref for ref in response.stdout.splitlines() if ref]
+
+    @classmethod
+    @traced("git.is_operation_in_progress", "git")
+    def is_operation_in_progress(cls) -> bool:
+        """Check if a rebase, merge, cherry-pick or revert is in
+        progress. Raises CalledProcessError if git fails."""
+        names = ["rebase-merge", "rebase-apply", "MERGE_HEAD"]
+        names.extend(["CHERRY_PICK_HEAD", "REVERT_HEAD"])
+        cmd = ["git", "rev-parse"]
+        for name in names:
+            cmd.extend(["--git-path", name])
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
+        response = subprocess.run(
+            cmd,
+            cwd=get_cwd(),
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        response.check_returncode()
+        paths = response.stdout.splitlines()
+        if len(paths) != len(names):
+            raise subprocess.CalledProcessError(1, cmd, response.stdout)
+        # the paths are relative to the working directory of git
+        cwd = get_cwd() or Path.cwd()
+        return any((cwd / path).exists() for path in paths)
+
+    @classmethod
+    @traced("git.read_commit", "git")
+    def read_commit(cls, commit_hash: str) -> str:
+        """Get the raw commit object (headers and message)"""
+        cmd = ["git", "cat-file", "commit", commit_hash]
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
+        response = subprocess.run(
+            cmd,
+            cwd=get_cwd(),
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        response.check_returncode()
+        return response.stdout
+
+    @classmethod
+    @traced("git.write_commit", "git")
+    def write_commit(cls, content: str) -> str:
+        """Write a raw commit object and get its hash. Nothing refers
+        to the commit yet."""
+        cmd = ["git", "hash-object", "-t", "commit", "-w", "--stdin"]
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
+        response = subprocess.run(
+            cmd,
+            cwd=get_cwd(),
+            input=content,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        response.check_returncode()
+        return response.stdout.strip()
+
+    @classmethod
+    @traced("git.update_ref", "git")
+    def update_ref(cls, ref: str, new_value: str, old_value: str, message: str) -> bool:
+        """Point a ref to another commit if it still points to
+        `old_value`. Returns False if the ref was changed meanwhile."""
+        cmd = ["git", "update-ref", "-m", message, ref, new_value, old_value]
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
+        return subprocess.run(cmd, cwd=get_cwd()).returncode == 0
+
+    @classmethod
+    @traced("git.add_note", "git")
+    def add_note(cls, commit_hash: str, message: str):
+        """Attach a note to a commit, an existing note is replaced"""
+        cmd = ["git", "notes", "add", "--force", "-m", message, commit_hash]
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
+        subprocess.run(cmd, cwd=get_cwd()).check_returncode()
+
+    @classmethod
+    @traced("git.get_current_branch", "git")
     def get_current_branch(cls) -> str:
         """Get the current branch"""
         cmd = ["git", "branch", "--show-current"]
-        logger.info(f'cmd {" ".join(cmd)}')
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
         branch = subprocess.run(
             cmd,
+            cwd=get_cwd(),
             stdout=subprocess.PIPE,
             text=True,
         )
         return branch.stdout.strip()
 
     @classmethod
+    @traced("git.get_index_hash", "git")
+    def get_index_hash(cls) -> str | None:
+        """Get a hash of the staged entries (mode, blob and path of
+        every file). The index is only read, it's never locked.
+
+        Returns:
+            None if the index can't be read or has unmerged entries.
+        """
+        cmd = ["git", "ls-files", "--stage", "-z"]
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
+        response = subprocess.run(
+            cmd,
+            cwd=get_cwd(),
+            stdout=subprocess.PIPE,
+        )
+        if response.returncode != 0:
+            return None
+        digest = hashlib.sha1()
+        for entry in response.stdout.split(b"\0"):
+            if not entry:
+                continue
+            # <mode> <blob> <stage>\t<path>
+            if entry.split(b"\t", 1)[0].split(b" ")[2] != b"0":
+                return None
+            digest.update(entry + b"\0")
+        return digest.hexdigest()
+
+    @classmethod
+    @traced("git.get_index_file", "git")
+    def get_index_file(cls) -> Path:
+        """Get the path of the index file of the git repo"""
+        cmd = ["git", "rev-parse", "--path-format=absolute", "--git-path", "index"]
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
+        index_file = subprocess.run(
+            cmd,
+            cwd=get_cwd(),
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        return Path(index_file.stdout.strip())
+
+    @classmethod
+    @traced("git.has_hook", "git")
+    def has_hook(cls, name: str) -> bool:
+        """Check if a hook (i.e. `pre-commit`) is installed. Works for
+        submodules and worktrees as well, where `.git` is a file.
+        False if the path of the hook can't be determined."""
+        cmd = ["git", "rev-parse", "--git-path", f"hooks/{name}"]
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
+        hook_file = subprocess.run(
+            cmd,
+            cwd=get_cwd(),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+        hook_path = hook_file.stdout.strip()
+        if hook_file.returncode != 0 or not hook_path:
+            return False
+        # the path is relative to the working directory of git
+        return ((get_cwd() or Path.cwd()) / hook_path).exists()
+
+    @classmethod
+    @traced("git.get_branches", "git")
+    def get_branches(cls) -> list[str]:
+        """Get the names of all local branches"""
+        cmd = ["git", "for-each-ref", "--format=%(refname:lstrip=2)", "refs/heads"]
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
+        branches = subprocess.run(
+            cmd,
+            cwd=get_cwd(),
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        return [branch for branch in branches.stdout.splitlines() if branch]
+
+    @classmethod
+    @traced("git.get_toplevel_directory", "git")
     def get_toplevel_directory(cls) -> Path:
         """Get the top level directory of the git repo"""
         cmd = ["git", "rev-parse", "--show-toplevel"]
-        logger.info(f'cmd {" ".join(cmd)}')
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
         toplevel_directory = subprocess.run(
             cmd,
+            cwd=get_cwd(),
             stdout=subprocess.PIPE,
             text=True,
         )
         return Path(toplevel_directory.stdout.strip())
 
     @classmethod
+    @traced("git.exec_commit", "git")
     def exec_commit(cls, title: str, body: str | None = None):
-        """Execute the commit command"""
+        """Execute the commit command. Raises CalledProcessError if
+        the commit failed."""
         cmd = ["git", "commit", "-m", f"{title}"]
         if body:
             cmd.extend(["-m", f"{body}"])
-        logger.info(f'cmd {" ".join(cmd)}')
-        subprocess.run(cmd)
+        logger.info("cmd %s", LazyStr(" ".join, cmd))
+        response = subprocess.run(cmd, cwd=get_cwd())
         state.refresh()
+        response.check_returncode()
 
     @classmethod
+    @traced("git.exec_stage_files", "git")
     def exec_stage_files(cls, file_names: list[str]):
         """Stage files"""
-        cmd = ["git", "add"] + file_names
-        logger.info(f'cmd {" ".join(cmd)}')
-        subprocess.run(cmd)
+        for shard in shard_file_names(
+            file_names,
+            max_files=config.git.pre_commit_shard_size,
+            max_bytes=config.git.pre_commit_shard_bytes,
+        ):
+            cmd = ["git", "add"] + shard
+            logger.info("cmd git add <%d files>", len(shard))
+            subprocess.run(cmd, cwd=get_cwd())
         state.refresh()
 
 
@@ -144,6 +648,7 @@ class GitState:
     diff: dict[str, str]
 
     @classmethod
+    @traced("git_state.from_base_commands", "git")
     def from_base_commands(cls) -> "GitState":
         ignored_file_patterns = get_ignored_file_patterns()
         staged_files = [
@@ -157,6 +662,7 @@ class GitState:
             diff={file_name: Git.get_diff(file_name) for file_name in staged_files},
         )
 
+    @traced("git_state.refresh", "git")
     def refresh(self):
         ignored_file_patterns = get_ignored_file_patterns()
         self.staged_files = [
@@ -169,4 +675,35 @@ class GitState:
         }
 
 
-state = GitState.from_base_commands()
+class RepositoryStates:
+    """The git state of each repository. Attributes are looked up on
+    the state of the repository which is processed by the current
+    thread, so it can be used like a `GitState`."""
+
+    def __init__(self):
+        # the states are read on first use, commands which don't work
+        # on the staged changes (or without any repository, like the
+        # cache server) never read them
+        self._states: dict[Path | None, GitState] = {}
+        self._lock = threading.Lock()
+
+    def get(self) -> GitState:
+        directory = get_cwd()
+        git_state = self._states.get(directory)
+        if git_state is None:
+            git_state = GitState.from_base_commands()
+            with self._lock:
+                git_state = self._states.setdefault(directory, git_state)
+        return git_state
+
+    def forget(self, directory: Path):
+        """Drop the state of a repository which isn't processed
+        anymore"""
+        with self._lock:
+            self._states.pop(directory, None)
+
+    def __getattr__(self, name: str):
+        return getattr(self.get(), name)
+
+
+state = RepositoryStates()
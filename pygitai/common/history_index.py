@@ -0,0 +1,127 @@
+"""BM25 index over the commit history of the repository.
+
+Each commit is indexed by the terms of its message and of the paths
+it changed. The index is stored in the pygitai database and updated
+incrementally: only the commits which were added since the last
+indexed commit are read from `git log`.
+
+The index is used to find past commits which are similar to the
+staged changes. Their messages are passed to the commit message
+templates as examples of the style of the repository.
+"""
+import heapq
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from .config import config
+from .db_api import HistoryCommit, HistoryIndexDBAPI
+from .deferred import is_placeholder
+from .git import Git
+from .logger import get_logger
+from .tracing import traced
+
+logger = get_logger(__name__, config.logger.level)
+
+TERM_PATTERN = re.compile(r"[a-z0-9]+")
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# the number of commits which are indexed at most on the first run
+MAX_INITIAL_COMMITS = 10000
+
+
+def get_terms(text: str) -> list[str]:
+    return [term for term in TERM_PATTERN.findall(text.lower()) if len(term) > 1]
+
+
+def get_commit_terms(commit: HistoryCommit) -> Counter[str]:
+    terms = Counter(get_terms(f"{commit.title}\n{commit.body}"))
+    for file_name in commit.file_names:
+        terms.update(get_terms(file_name))
+    return terms
+
+
+class HistoryIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @traced("history_index.update", "git")
+    def update(self):
+        """Index all commits of HEAD which were added since the last
+        update"""
+        with self._lock:
+            head = Git.resolve_commit("HEAD")
+            last_commit = HistoryIndexDBAPI.get_last_commit()
+            if head is None or head == last_commit:
+                return
+
+            start = time.perf_counter()
+            if last_commit and Git.resolve_commit(last_commit):
+                log = Git.get_log(["HEAD", f"^{last_commit}"])
+            else:
+                # first run or the last commit was removed (i.e. by a
+                # rebase), already indexed commits are skipped
+                log = Git.get_log(["HEAD"], max_count=MAX_INITIAL_COMMITS)
+
+            commits = []
+            for commit_hash, message, file_names in log:
+                if is_placeholder(message):
+                    # not an example of the style of the repository
+                    continue
+                title, _, body = message.partition("\n")
+                commit = HistoryCommit(
+                    commit_hash=commit_hash,
+                    title=title.strip(),
+                    body=body.strip(),
+                    file_names=file_names,
+                )
+                commits.append((commit, get_commit_terms(commit)))
+            HistoryIndexDBAPI.insert_commits(commits, last_commit=head)
+            logger.info(
+                "Indexed %d commit(s) in %.1f ms",
+                len(commits),
+                (time.perf_counter() - start) * 1000,
+            )
+
+    @traced("history_index.search", "git")
+    def search(self, query: str, limit: int = 3) -> list[HistoryCommit]:
+        """Get the commits which are most similar to the query"""
+        self.update()
+        start = time.perf_counter()
+        query_terms = Counter(get_terms(query))
+        if not query_terms:
+            return []
+
+        commit_count, average_length = HistoryIndexDBAPI.get_stats()
+        postings = HistoryIndexDBAPI.get_postings(list(query_terms))
+        document_frequencies = Counter(term for term, _, _, _ in postings)
+        scores: defaultdict[str, float] = defaultdict(float)
+        for term, commit_hash, frequency, length in postings:
+            idf = math.log(
+                1
+                + (commit_count - document_frequencies[term] + 0.5)
+                / (document_frequencies[term] + 0.5)
+            )
+            normalized_length = length / average_length if average_length else 1
+            scores[commit_hash] += (
+                query_terms[term]
+                * idf
+                * frequency
+                * (K1 + 1)
+                / (frequency + K1 * (1 - B + B * normalized_length))
+            )
+
+        commit_hashes = heapq.nlargest(limit, scores, key=scores.__getitem__)
+        commits = HistoryIndexDBAPI.get_commits(commit_hashes)
+        logger.info(
+            "History search took %.1f ms (%d posting(s))",
+            (time.perf_counter() - start) * 1000,
+            len(postings),
+        )
+        return [commits[commit_hash] for commit_hash in commit_hashes]
+
+
+history_index = HistoryIndex()
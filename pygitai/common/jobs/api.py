@@ -1,14 +1,84 @@
+import hashlib
 import json
+import sys
+from argparse import Namespace
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Callable
 
+from pygitai.common.code_context import add_scope_context
 from pygitai.common.config import config
-from pygitai.common.db_api import BranchInfoDBAPI, DoesNotExist
+from pygitai.common.db_api import (
+    BranchInfoDBAPI,
+    CommitDraftDBAPI,
+    DoesNotExist,
+    HistoryCommit,
+    LLMSessionDBAPI,
+    Review,
+    ReviewDBAPI,
+    ReviewedFile,
+)
+from pygitai.common.diff_format import (
+    DEFAULT_DIFF_FORMAT,
+    format_diff_chunks,
+    split_diff,
+)
 from pygitai.common.git import Git
 from pygitai.common.git import PreCommitHook as GitPreCommitHook
 from pygitai.common.git import state as git_state
+from pygitai.common.history_index import get_terms, history_index
+from pygitai.common.logger import get_logger
+from pygitai.common.streaming import Chunks, dumps
+from pygitai.common.symbol_index import get_changes, get_symbol_context
 
 from .base_job import BaseJob
+from .inputs import get_input
 from .llm_job import LLMJobBase
 
+logger = get_logger(__name__, config.logger.level)
+
+# the number of context lines git uses by default
+DEFAULT_CONTEXT_LINES = 3
+
+
+def get_diff_hash(file_diff: str) -> str:
+    return hashlib.sha1(file_diff.encode()).hexdigest()
+
+
+def format_review_report(
+    review: Review,
+    file_names: list[str],
+    reviewed: int,
+    errors: dict[str, Exception],
+) -> str:
+    """Get the merged report of an incremental review. Files which
+    were reviewed before the current head commit are marked.
+
+    Arguments:
+        review (Review): The review with the findings of all files
+        file_names (list[str]): The files of the diff in order
+        reviewed (int): The number of files reviewed by this run
+        errors (dict[str, Exception]): The errors of the failed files
+    """
+    lines = [
+        f"Review of {review.head_ref} ({review.head_commit[:10]}) against "
+        f"{review.base_ref}: {reviewed} file(s) reviewed, "
+        f"{len(review.files) - reviewed} carried forward, {len(errors)} failed",
+        "",
+    ]
+    for file_name in file_names:
+        reviewed_file = review.files.get(file_name)
+        if reviewed_file is None:
+            lines += [f"### {file_name} (review failed: {errors[file_name]})", ""]
+            continue
+        carried = (
+            f" (unchanged since {reviewed_file.head_commit[:10]})"
+            if reviewed_file.head_commit != review.head_commit
+            else ""
+        )
+        lines += [f"### {file_name}{carried}", reviewed_file.findings.strip(), ""]
+    return "\n".join(lines).strip()
+
 
 class AutoStageAll(BaseJob):
     """Auto stage all not staged files
@@ -32,32 +102,319 @@ class PreCommitHook(BaseJob):
     No Environment variables has to be set for this to work.
     This job autoamtically detects if pre-commit hooks are used.
 
+    Large sets of staged files are split into shards which are run
+    one after another. The shards can be tuned by the environment
+    variables `PYGITAI_PRE_COMMIT_SHARD_SIZE` (files per shard) and
+    `PYGITAI_PRE_COMMIT_SHARD_BYTES` (argument bytes per shard).
+
     This is not a LLM job.
     It's a Git Job.
     """
 
     def exec_command(self, *args, **kwargs):
-        if config.git.pre_commit:
+        if Git.has_hook("pre-commit"):
             GitPreCommitHook.run(git_state.staged_files)
 
 
 class GitLLMJobBase(LLMJobBase):
-    def get_diff(self):
-        return git_state.diff
+    """Base class for LLM jobs which are working on git diffs.
+
+    The diff is passed to the user templates in the format which is
+    configured by `diff_format` (job section) or `default_diff_format`
+    in the config. Allowed values are `compact` (default, a unified
+    diff with one short header per file), `raw` (the plain unified
+    diff) and `json` (an object of file names and their diffs).
+
+    The context around each hunk is configured by `diff_context` (job
+    section) or `default_diff_context`. By default (`ast`), the
+    signatures and docstrings of the enclosing functions and classes
+    are attached to each hunk of supported languages (see
+    `code_context`). A number uses that many plain context lines
+    instead.
+
+    Attributes:
+        precomputable (bool): If True, the first response of this job
+            can be generated in advance for the currently staged
+            changes (see `pygitai precompute`). The draft is stored
+            by the hash of the staged files and used instead of the
+            first LLM call as long as the staged changes are the same.
+        symbol_context (bool): If True, the definitions which are
+            called by the diff and the references of the changed
+            definitions are passed to the templates as `definitions`
+            (see `symbol_index`). The token budget is configured by
+            `symbol_context_tokens` or `default_symbol_context_tokens`
+            in the config, 0 disables it.
+        few_shot_examples (int): The number of similar past commits
+            which are passed to the templates as `examples` (see
+            `history_index`). Can be configured by `few_shot_examples`
+            or `default_few_shot_examples`, 0 disables it.
+    """
 
-    def perform_base(self, *args, **kwargs) -> str:
-        try:
-            branch_info = BranchInfoDBAPI.get(Git.get_current_branch())
-            purpose = branch_info.purpose
-        except DoesNotExist:
-            purpose = None
-        context_user = {
-            "diff": json.dumps(self.get_diff()),
+    precomputable: bool = False
+    symbol_context: bool = False
+    symbol_context_tokens: int = 1000
+    few_shot_examples: int = 0
+    # the most frequent terms of the changed lines which are used to
+    # search similar commits
+    query_diff_terms = 20
+    precompute_max_age = timedelta(days=7)
+    llm_session_max_age = timedelta(days=7)
+
+    def get_input_prefetches(self, cli_args: Namespace) -> list[Callable]:
+        """Get the functions which gather the inputs of this job in
+        advance (see `inputs.gather_inputs`). Empty if the job is
+        disabled."""
+        if not self.is_enabled(cli_args):
+            return []
+        self.cli_args = cli_args
+        self.kwargs = {}
+        return [
+            lambda: self.get_purpose(self.get_current_branch()),
+            self.get_diff,
+            self.get_llm_session_key,
+            self.load_templates,
+        ]
+
+    def get_current_branch(self) -> str:
+        return get_input("branch", Git.get_current_branch)
+
+    def get_diff(self) -> dict[str, str] | str:
+        """Get the plain diff of the staged changes or of the diff
+        refs (see `get_diff_refs`)"""
+        base_ref, head_ref = self.get_diff_refs()
+        context_lines = self.get_diff_context_lines()
+
+        def get_plain_diff() -> dict[str, str] | str:
+            if base_ref is not None and head_ref is not None:
+                return self.get_diff_between_branches(base_ref, head_ref)
+            if context_lines is None or context_lines == DEFAULT_CONTEXT_LINES:
+                return git_state.diff
+            diff = split_diff(Git.get_diff(number_of_context_lines=context_lines))
+            return {
+                file_name: diff[file_name]
+                for file_name in git_state.staged_files
+                if file_name in diff
+            }
+
+        return get_input(("diff", base_ref, head_ref, context_lines), get_plain_diff)
+
+    def get_diff_between_branches(self, base_ref: str, head_ref: str) -> str:
+        """Get the plain diff between two refs"""
+        context_lines = self.get_diff_context_lines()
+        return Git.get_diff_between_branches(
+            branch_1=base_ref,
+            branch_2=head_ref,
+            number_of_context_lines=(
+                DEFAULT_CONTEXT_LINES if context_lines is None else context_lines
+            ),
+        )
+
+    def get_diff_refs(self) -> tuple[str | None, str | None]:
+        """Get the base and head ref of the diff. None for the staged
+        changes."""
+        return getattr(self, "_diff_refs", (None, None))
+
+    def get_diff_context_lines(self) -> int | None:
+        """Get the number of plain context lines around each hunk.
+        None if the enclosing scopes are attached instead."""
+        diff_context = self.get_job_config("diff_context")
+        if not diff_context or diff_context == "ast":
+            return None
+        return int(diff_context)
+
+    def get_symbol_context_tokens(self) -> int:
+        """Get the token budget of the definitions and references
+        which are attached to the diff. 0 if disabled."""
+        if not self.symbol_context:
+            return 0
+        tokens = self.get_job_config("symbol_context_tokens")
+        return int(tokens) if tokens else self.symbol_context_tokens
+
+    def get_diff_context(
+        self,
+        diff: dict[str, str] | str,
+        base_ref: str | None = None,
+        head_ref: str | None = None,
+    ) -> dict:
+        """Get the template arguments of a plain diff: the formatted
+        diff and the related definitions (if enabled). Jobs with the
+        same settings share them (see `inputs`)."""
+        if isinstance(diff, str):
+            diff = split_diff(diff)
+        max_tokens = self.get_symbol_context_tokens()
+        context_lines = self.get_diff_context_lines()
+        diff_format = self.get_diff_format()
+
+        def get_context() -> dict:
+            context = {}
+            if max_tokens:
+                context["definitions"] = get_symbol_context(
+                    diff, max_tokens, head_ref=head_ref
+                )
+            scoped_diff = diff
+            if context_lines is None and diff:
+                scoped_diff = add_scope_context(
+                    diff, Git.get_diff_blobs(base_ref, head_ref)
+                )
+            context["diff"] = self.format_diff(scoped_diff)
+            return context
+
+        key = (
+            "diff_context",
+            base_ref,
+            head_ref,
+            tuple(diff.items()),
+            max_tokens,
+            context_lines,
+            diff_format,
+            # jobs could format the diff on their own
+            type(self).format_diff,
+        )
+        # the templates get their own copy, the values are shared
+        return dict(get_input(key, get_context))
+
+    def get_llm_session_key(self) -> str | None:
+        """The conversation is persisted by the hash of the staged
+        files. None if the index can't be read (i.e. while merging),
+        the conversation isn't persisted then."""
+        if getattr(self, "_index_hash", None) is None:
+            self._index_hash = get_input("index_hash", Git.get_index_hash)
+        return self._index_hash
+
+    def get_diff_format(self) -> str:
+        """Get the format which is used to pass the diff to the
+        templates. Allowed values: raw, compact, json
+        """
+        return self.get_job_config("diff_format") or DEFAULT_DIFF_FORMAT
+
+    def format_diff(self, diff: dict[str, str] | str) -> Chunks:
+        return format_diff_chunks(diff, diff_format=self.get_diff_format())
+
+    def get_purpose(self, branch_name: str) -> str | None:
+        def get_branch_purpose() -> str | None:
+            try:
+                return BranchInfoDBAPI.get(branch_name).purpose
+            except DoesNotExist:
+                return None
+
+        return get_input(("purpose", branch_name), get_branch_purpose)
+
+    def get_few_shot_examples(self) -> int:
+        """Get the number of similar past commits which are passed to
+        the templates as examples. 0 if disabled."""
+        examples = self.get_job_config("few_shot_examples")
+        return int(examples) if examples else self.few_shot_examples
+
+    def get_examples(
+        self, diff: dict[str, str] | str, purpose: str | None
+    ) -> list[HistoryCommit]:
+        """Get the past commits which are most similar to the diff by
+        their messages and changed paths (see `history_index`)"""
+        limit = self.get_few_shot_examples()
+        if not limit:
+            return []
+        if isinstance(diff, str):
+            diff = split_diff(diff)
+        words: Counter[str] = Counter()
+        for file_diff in diff.values():
+            changed_lines, _ = get_changes(file_diff)
+            for line in changed_lines:
+                words.update(get_terms(line))
+        query = " ".join(
+            [
+                *diff,
+                purpose or "",
+                *(word for word, _ in words.most_common(self.query_diff_terms)),
+            ]
+        )
+        return history_index.search(query, limit=limit)
+
+    def get_changed_files(self) -> list[str] | None:
+        return getattr(self, "_changed_files", None)
+
+    def get_context_user(self) -> dict:
+        purpose = self.get_purpose(self.get_current_branch())
+        diff = self.get_diff()
+        if isinstance(diff, str):
+            diff = split_diff(diff)
+        self._changed_files = list(diff)
+        context = {
+            **self.get_diff_context(diff, *self.get_diff_refs()),
             "purpose": purpose or "No purpose provided",
         }
+        examples = self.get_examples(diff, purpose)
+        if examples:
+            context["examples"] = examples
+        return context
+
+    def get_precomputed_response(self) -> tuple | None:
+        """Get the draft which was generated in advance for the
+        currently staged changes."""
+        if not self.precomputable:
+            return None
+        index_hash = self.get_llm_session_key()
+        if index_hash is None:
+            return None
+        try:
+            draft = CommitDraftDBAPI.get(self.__class__.__name__, index_hash)
+        except DoesNotExist:
+            return None
+        logger.info("Use precomputed draft for %s", self.__class__.__name__)
+        self.restore_route(draft.route)
+        return draft.response, json.loads(draft.full_context)
+
+    def precompute(self) -> bool:
+        """Generate a draft for the currently staged changes and store
+        it by the hash of the staged files.
+
+        Returns:
+            True if a new draft was stored.
+        """
+        tree_hash = Git.get_index_hash()
+        if tree_hash is None:
+            return False
+        try:
+            CommitDraftDBAPI.get(self.__class__.__name__, tree_hash)
+            return False
+        except DoesNotExist:
+            pass
+
+        response, full_context = self.get_llm_response(
+            context_user=self.get_context_user(),
+        )
+        if Git.get_index_hash() != tree_hash:
+            # the staged changes were modified while waiting for the
+            # LLM, so the draft doesn't match anymore
+            return False
+
+        now = datetime.now()
+        CommitDraftDBAPI.insert(
+            job_name=self.__class__.__name__,
+            tree_hash=tree_hash,
+            response=response,
+            full_context=dumps(full_context),
+            created_at=int(now.timestamp()),
+            route=self.get_route_name(),
+        )
+        CommitDraftDBAPI.delete_older_than(
+            int((now - self.precompute_max_age).timestamp())
+        )
+        return True
+
+    def generate(self, base_ref: str, head_ref: str) -> str:
+        """Generate the response for the changes between two refs
+        without any user interaction, i.e. for a commit which was made
+        with a placeholder message (see `deferred`)."""
+        self._diff_refs = (base_ref, head_ref)
+        response, _ = self.get_llm_response(context_user=self.get_context_user())
+        return response
+
+    def perform_base(self, *args, **kwargs) -> str:
+        initial_response = self.get_precomputed_response()
         return self.process_user_feedback_llm_loop(
             context=self.context,
-            context_user=context_user,
+            context_user=self.get_context_user() if initial_response is None else None,
+            initial_response=initial_response,
         )
 
     def exec_command(self, *args, **kwargs):
@@ -83,6 +440,8 @@ class CommitBody(GitLLMJobBase):
             to this template:
                 - diff: The diff of the current staged files
                 - purpose: The purpose of the current branch
+                - examples: Similar past commits of the repository
+                    (with title, body and file_names)
 
         commit_body_revision.txt: If the LLM response is rejected by
             the user, this template is used to get a revision of the
@@ -93,6 +452,8 @@ class CommitBody(GitLLMJobBase):
     """
 
     cli_configurable_name = "use_commit_body"
+    precomputable = True
+    few_shot_examples = 3
 
     def exec_command(self, *args, **kwargs):
         return self.perform_base()
@@ -117,6 +478,8 @@ class CommitTitle(GitLLMJobBase):
             template:
                 - diff: The diff of the current staged files
                 - purpose: The purpose of the current branch
+                - examples: Similar past commits of the repository
+                    (with title, body and file_names)
 
         commit_title_revision.txt: If the LLM response is rejected by
             the user, this template is used to get a revision of the
@@ -126,10 +489,20 @@ class CommitTitle(GitLLMJobBase):
                 - feedback: The feedback from the user
     """
 
+    precomputable = True
+    few_shot_examples = 3
+
     def exec_command(self):
         commit_body = CommitBody().perform(self.cli_args, self.kwargs) or None
         commit_title = self.perform_base()
+        session_key = self.get_llm_session_key()
         Git.exec_commit(commit_title, body=commit_body)
+        # the sessions of all jobs for the committed tree are done
+        LLMSessionDBAPI.delete_by_session_key(session_key)
+        LLMSessionDBAPI.delete_older_than(
+            int((datetime.now() - self.llm_session_max_age).timestamp())
+        )
+        return commit_title
 
 
 class FeedbackOnCommit(GitLLMJobBase):
@@ -153,6 +526,8 @@ class FeedbackOnCommit(GitLLMJobBase):
             passed to this template:
                 - diff: The diff of the current staged files
                 - purpose: The purpose of the current branch
+                - definitions: Definitions and references related
+                    to the diff
 
         feedback_on_commit_revision.txt: If the LLM response is
             rejected by the user (i.e. because the user has questions
@@ -164,6 +539,7 @@ class FeedbackOnCommit(GitLLMJobBase):
     """
 
     cli_configurable_name = "include_ai_feedback"
+    symbol_context = True
 
 
 class CodeReview(GitLLMJobBase):
@@ -171,6 +547,13 @@ class CodeReview(GitLLMJobBase):
     any other. The other hash can be specified by the cli argument
     `--target-branch`.
 
+    Many head/base pairs can be reviewed at once without any user
+    interaction by using the cli argument `--batch` (see `review`).
+
+    With the cli argument `--incremental`, only the files which
+    changed since the last review of the same refs are reviewed (see
+    `review_incremental`).
+
     Template Files:
     ---------------
         code_review_system.txt: This template is used to get
@@ -184,6 +567,8 @@ class CodeReview(GitLLMJobBase):
             passed to this template:
                 - diff: The diff of the current staged files
                 - purpose: The purpose of the current branch
+                - definitions: Definitions and references related
+                    to the diff
 
         code_review_vision.txt: If the LLM response is
             rejected by the user (i.e. because the user has questions
@@ -194,10 +579,145 @@ class CodeReview(GitLLMJobBase):
                 - feedback: The feedback from the user
     """
 
+    symbol_context = True
+
+    def get_llm_session_key(self) -> str | None:
+        """Reviews are not persisted, they don't depend on the staged
+        tree."""
+        return None
+
+    def get_diff_refs(self) -> tuple[str | None, str | None]:
+        return self.cli_args.target_branch, self.get_current_branch()
+
     def get_diff(self):
-        target_branch = self.cli_args.target_branch
-        diff = Git.get_diff_between_branches(
-            branch_1=target_branch,
-            branch_2=Git.get_current_branch(),
+        return self.get_diff_between_branches(*self.get_diff_refs())
+
+    def exec_command(self, *args, **kwargs):
+        if not getattr(self.cli_args, "incremental", False):
+            self.perform_base()
+            return
+        base_ref, head_ref = self.get_diff_refs()
+        sys.stdout.write(
+            self.review_incremental(head_ref=head_ref or "HEAD", base_ref=base_ref)
+            + "\n"
+        )
+        sys.stdout.flush()
+
+    def review(self, head_ref: str, base_ref: str) -> str:
+        """Review `head_ref` against `base_ref` without any user
+        interaction. Nothing is checked out, both refs are compared
+        directly in the object database. With the cli argument
+        `--incremental` only the files which changed since the last
+        review are reviewed (see `review_incremental`).
+
+        Arguments:
+            head_ref (str): The branch or hash to review
+            base_ref (str): The branch or hash to compare against
+
+        Raises:
+            ValueError: If one of the refs doesn't exist or if there
+                is no diff between them.
+        """
+        for ref in (head_ref, base_ref):
+            if Git.resolve_commit(ref) is None:
+                raise ValueError(f"{ref} does not exist")
+        if getattr(self.cli_args, "incremental", False):
+            return self.review_incremental(head_ref=head_ref, base_ref=base_ref)
+        diff = split_diff(
+            self.get_diff_between_branches(base_ref=base_ref, head_ref=head_ref)
+        )
+        if not diff:
+            raise ValueError(f"No diff between {base_ref} and {head_ref}")
+        self._changed_files = list(diff)
+        context_user = {
+            **self.get_diff_context(diff, base_ref, head_ref),
+            "purpose": self.get_purpose(head_ref) or "No purpose provided",
+        }
+        response, _ = self.get_llm_response(context_user=context_user)
+        return response
+
+    def review_incremental(self, head_ref: str, base_ref: str) -> str:
+        """Review only the files whose diffs changed since the last
+        review of `head_ref` against `base_ref`. The findings of all
+        other files are carried forward from the last review.
+
+        Each file is reviewed by its own prompt and all prompts are
+        sent at once (see `get_llm_responses`). The findings are
+        stored by the hash of the diff of each file. Files whose
+        review failed are reviewed again by the next run.
+
+        Arguments:
+            head_ref (str): The branch or hash to review
+            base_ref (str): The branch or hash to compare against
+
+        Returns:
+            The merged report of all changed files
+        """
+        diff = split_diff(
+            self.get_diff_between_branches(base_ref=base_ref, head_ref=head_ref)
+        )
+        if not diff:
+            raise ValueError(f"No diff between {base_ref} and {head_ref}")
+        try:
+            last_review = ReviewDBAPI.get(head_ref, base_ref)
+        except DoesNotExist:
+            last_review = Review(head_ref=head_ref, base_ref=base_ref, head_commit="")
+
+        review = Review(
+            head_ref=head_ref,
+            base_ref=base_ref,
+            head_commit=Git.resolve_commit(head_ref) or head_ref,
+            updated_at=int(datetime.now().timestamp()),
+        )
+        diff_hashes = {
+            file_name: get_diff_hash(file_diff) for file_name, file_diff in diff.items()
+        }
+        changed_files = []
+        for file_name, diff_hash in diff_hashes.items():
+            reviewed_file = last_review.files.get(file_name)
+            if reviewed_file is not None and reviewed_file.diff_hash == diff_hash:
+                review.files[file_name] = reviewed_file
+            else:
+                changed_files.append(file_name)
+        logger.info(
+            "Review %d of %d file(s) of %s against %s",
+            len(changed_files),
+            len(diff),
+            head_ref,
+            base_ref,
+        )
+
+        errors: dict[str, Exception] = {}
+        if changed_files:
+            purpose = self.get_purpose(head_ref) or "No purpose provided"
+            self._changed_files = changed_files
+            results = self.get_llm_responses(
+                [
+                    {
+                        **self.get_diff_context(
+                            {file_name: diff[file_name]}, base_ref, head_ref
+                        ),
+                        "purpose": purpose,
+                    }
+                    for file_name in changed_files
+                ]
+            )
+            for file_name, result in zip(changed_files, results):
+                if result.response is None:
+                    error = result.error or ValueError("No response")
+                    logger.warning("Review of %s failed: %s", file_name, error)
+                    errors[file_name] = error
+                    continue
+                review.files[file_name] = ReviewedFile(
+                    file_name=file_name,
+                    diff_hash=diff_hashes[file_name],
+                    findings=result.response,
+                    head_commit=review.head_commit,
+                )
+        if not review.files:
+            raise ValueError(f"Review failed: {next(iter(errors.values()))}")
+
+        ReviewDBAPI.save(review)
+        return format_review_report(
+            review, list(diff), len(changed_files) - len(errors), errors
         )
-        return diff
@@ -1,6 +1,8 @@
 from abc import ABC, abstractmethod
 from argparse import Namespace
 
+from pygitai.common.tracing import tracer
+
 
 class BaseJob(ABC):
     """Base class for Job.
@@ -34,16 +36,23 @@ class BaseJob(ABC):
         self.cli_args = cli_args
         self.kwargs = kwargs
 
-        if self.cli_configurable_name and self.cli_configurable_name not in cli_args:
+        if not self.is_enabled(cli_args):
             return
+        with tracer.span(f"job.{self.__class__.__name__}", "job"):
+            return self.exec_command(*args, **kwargs)
+
+    def is_enabled(self, cli_args: Namespace) -> bool:
+        """Check if the job is executed with the cli arguments (see
+        `cli_configurable_name`)"""
+        if self.cli_configurable_name and self.cli_configurable_name not in cli_args:
+            return False
         elif self.cli_configurable_name and not getattr(
             cli_args, self.cli_configurable_name
         ):
             # getattr will raise an Error if the attribute is not found
             # that's why there are seperate if statements
-            return
-        else:
-            return self.exec_command(*args, **kwargs)
+            return False
+        return True
 
     @abstractmethod
     def exec_command(self, *args, **kwargs):
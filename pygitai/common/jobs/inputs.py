@@ -0,0 +1,124 @@
+"""Inputs which are shared by all jobs of a command.
+
+The jobs of a pipeline (i.e. `FeedbackOnCommit`, `CommitBody` and
+`CommitTitle`) need the same inputs: the current branch, its purpose,
+the diff and the compiled templates. Within `gather_inputs`, every
+input is computed once and memoized for all jobs. The inputs which are
+known in advance are gathered concurrently as soon as the stage
+starts. The time spent on each input is logged at the end of the
+stage and recorded as span (see `tracing`).
+
+Outside of `gather_inputs`, the inputs are computed on every call.
+"""
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Callable, Hashable, Iterator, TypeVar
+
+from pygitai.common.config import config
+from pygitai.common.logger import LazyStr, get_logger
+from pygitai.common.tracing import tracer
+
+logger = get_logger(__name__, config.logger.level)
+
+T = TypeVar("T")
+
+# the number of inputs which are gathered at once
+MAX_PREFETCH_WORKERS = 8
+
+
+def get_input_name(key: Hashable) -> str:
+    """Get the name of an input. Keys are either names or tuples of a
+    name and the parameters of the input."""
+    return str(key[0]) if isinstance(key, tuple) else str(key)
+
+
+class JobInputs:
+    """The memoized inputs of the jobs of a command.
+
+    Attributes:
+        timings: The time spent on each input in milliseconds by name.
+            The times of an input with different parameters are
+            summed up.
+    """
+
+    def __init__(self):
+        self.timings: dict[str, float] = {}
+        self._futures: dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, func: Callable[[], T]) -> T:
+        """Get an input. It's computed by `func` on first use. If it's
+        computed by another thread at the moment, it's waited for.
+        Errors are memoized as well."""
+        with self._lock:
+            future = self._futures.get(key)
+            compute = future is None
+            if future is None:
+                future = self._futures[key] = Future()
+        if compute:
+            name = get_input_name(key)
+            start = time.perf_counter()
+            try:
+                with tracer.span(f"input.{name}", "input"):
+                    future.set_result(func())
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                duration = (time.perf_counter() - start) * 1000
+                with self._lock:
+                    self.timings[name] = self.timings.get(name, 0.0) + duration
+        return future.result()
+
+    def format_timings(self) -> str:
+        return ", ".join(
+            f"{name} {duration:.1f} ms" for name, duration in self.timings.items()
+        )
+
+
+current_inputs: ContextVar[JobInputs | None] = ContextVar(
+    "current_inputs", default=None
+)
+
+
+def get_input(key: Hashable, func: Callable[[], T]) -> T:
+    """Get an input of the current stage (see `gather_inputs`). Without
+    a stage, it's computed by `func` right away."""
+    inputs = current_inputs.get()
+    if inputs is None:
+        return func()
+    return inputs.get(key, func)
+
+
+def prefetch(func: Callable[[], object]):
+    try:
+        func()
+    except Exception as e:
+        # the error is raised again when a job requests the input
+        logger.debug("Prefetching an input failed: %s", e)
+
+
+@contextmanager
+def gather_inputs(*prefetches: Callable[[], object]) -> Iterator[JobInputs]:
+    """Share the inputs of all jobs within the context.
+
+    Arguments:
+        prefetches: Functions which request inputs by `get_input`
+            (i.e. `GitLLMJobBase.get_input_prefetches`). They are
+            called concurrently right away.
+    """
+    inputs = JobInputs()
+    token = current_inputs.set(inputs)
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, min(len(prefetches), MAX_PREFETCH_WORKERS))
+    )
+    try:
+        for func in prefetches:
+            executor.submit(copy_context().run, prefetch, func)
+        yield inputs
+    finally:
+        current_inputs.reset(token)
+        executor.shutdown(wait=True)
+        logger.info("Job inputs: %s", LazyStr(inputs.format_timings))
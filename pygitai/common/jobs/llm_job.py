@@ -1,13 +1,26 @@
+import threading
+import time
 from pathlib import Path
 from typing import Type
 
-from pygitai.common import llm
-from pygitai.common.config import config
-from pygitai.common.llm.base import LLMBase, PromptLine
+from pygitai.common.config import config, current_repository
+from pygitai.common.db_api import DoesNotExist, LLMSession, LLMSessionDBAPI
+from pygitai.common.llm.base import LLMBase, PromptLine, PromptResult
+from pygitai.common.llm.cache import get_cache_client, with_cache
+from pygitai.common.llm.session import get_rate_limiter
 from pygitai.common.logger import get_logger
-from pygitai.common.utils import camel_to_snake, load_template_file
+from pygitai.common.plugins import llm_registry
+from pygitai.common.routing import Route, estimate_tokens, get_route, select_route
+from pygitai.common.tracing import tracer
+from pygitai.common.utils import (
+    camel_to_snake,
+    load_template_file,
+    render_template_chunks,
+    template_registry,
+)
 
 from .base_job import BaseJob
+from .inputs import get_input
 
 logger = get_logger(__name__, config.logger.level)
 
@@ -20,18 +33,66 @@ class ImproperlyConfigured(Exception):
     """Improperly configured"""
 
 
+# the user is asked by one job at a time, i.e. if many repositories
+# are processed concurrently
+user_input_lock = threading.Lock()
+
+
 def ask_for_user_feedback(prompt_output_context: str, prompt_output: str):
     """Ask the user for feedback"""
-    logger.info(f"Prompt Output for {prompt_output_context}: {prompt_output}")
-    agree = input("Do you agree with the prompt output? [y/n]")
-    if agree.lower() == "y":
-        return "y"
-    elif agree.lower() == "n":
-        recommendation = input("Any recommendation for a better output?")
-        return recommendation
-    else:
-        logger.warn("Wrong input. Please only enter 'y' or 'n'")
-        return ask_for_user_feedback(prompt_output_context, prompt_output)
+    repository = current_repository.get()
+    if repository is not None:
+        prompt_output_context = (
+            f"{prompt_output_context} ({repository.toplevel_directory.name})"
+        )
+    with user_input_lock:
+        logger.info("Prompt Output for %s: %s", prompt_output_context, prompt_output)
+        while True:
+            with tracer.span("user.wait_for_feedback", "user"):
+                agree = input("Do you agree with the prompt output? [y/n]")
+            if agree.lower() == "y":
+                return "y"
+            elif agree.lower() == "n":
+                with tracer.span("user.wait_for_feedback", "user"):
+                    recommendation = input("Any recommendation for a better output?")
+                return recommendation
+            logger.warning("Wrong input. Please only enter 'y' or 'n'")
+
+
+def ask_for_user_choice(
+    prompt_output_context: str, prompt_outputs: list[str]
+) -> tuple[int, str]:
+    """Ask the user to choose one of many prompt outputs.
+
+    Returns:
+        The index of the chosen output and "y", or 0 and the feedback
+        of the user if none of them was chosen.
+    """
+    repository = current_repository.get()
+    if repository is not None:
+        prompt_output_context = (
+            f"{prompt_output_context} ({repository.toplevel_directory.name})"
+        )
+    with user_input_lock:
+        logger.info(
+            "Prompt Output for %s:\n%s",
+            prompt_output_context,
+            "\n".join(
+                f"[{number}] {prompt_output}"
+                for number, prompt_output in enumerate(prompt_outputs, start=1)
+            ),
+        )
+        choices = f"1-{len(prompt_outputs)}"
+        while True:
+            with tracer.span("user.wait_for_feedback", "user"):
+                choice = input(f"Which prompt output do you choose? [{choices}/n]")
+            if choice.isdigit() and 1 <= int(choice) <= len(prompt_outputs):
+                return int(choice) - 1, "y"
+            elif choice.lower() == "n":
+                with tracer.span("user.wait_for_feedback", "user"):
+                    recommendation = input("Any recommendation for a better output?")
+                return 0, recommendation
+            logger.warning("Wrong input. Please only enter %s or 'n'", choices)
 
 
 class LLMJobBase(BaseJob):
@@ -49,11 +110,20 @@ class LLMJobBase(BaseJob):
             file that should be used. If it's none the default
             template file or the specified template file will be
             used.
+        candidates (int): The number of alternative responses which
+            are requested at once for the user to choose from. Can be
+            configured by `candidates` or `default_candidates` in the
+            config.
     """
 
     llm: Type[LLMBase] | None = None
     llm_model: str | None = None
     template_file: Path | str | None = None
+    candidates: int = 1
+
+    # resolved template files by (repository, template dir, template
+    # file name)
+    _template_file_cache: dict[tuple[Path, str, str], Path] = {}
 
     @property
     def context(self):
@@ -83,15 +153,21 @@ class LLMJobBase(BaseJob):
             context_user (dict | None): Additional context which will
                 be passed to the template file for the user
         """
-        content_system = load_template_file(
+        llm_klass = self.get_llm_klass()
+        # large contexts (i.e. diffs) aren't copied into the prompt if
+        # the LLM supports it
+        render = (
+            render_template_chunks if llm_klass.streamed_prompt else load_template_file
+        )
+        content_system = render(
             template_path=self.get_template_file(type_="system"),
             context=context_system or {},
         )
-        content_user = load_template_file(
+        content_user = render(
             template_path=self.get_template_file(type_="user"),
             context=context_user or {},
         )
-        prompt = self.get_llm_klass().llm_parser.parse_prompt(
+        prompt = llm_klass.llm_parser.parse_prompt(
             input_data=(
                 PromptLine(role="system", text=content_system),
                 PromptLine(role="user", text=content_user),
@@ -103,7 +179,7 @@ class LLMJobBase(BaseJob):
         self,
         context_system: dict | None = None,
         context_user: dict | None = None,
-        prompt_override: list = None,
+        prompt_override: list | None = None,
     ):
         """Get the response from the LLM.
 
@@ -124,20 +200,128 @@ class LLMJobBase(BaseJob):
                 the prompt will be generated by the
                 `get_llm_initial_message` method.
         """
-        prompt = prompt_override or self.get_llm_initial_message(
+        prompt = self.get_prompt(context_system, context_user, prompt_override)
+        llm_klass = self.get_llm_klass()
+        model = self.get_llm_model()
+        # the limits are shared by all jobs of the process
+        with get_rate_limiter(), tracer.span(
+            "llm.exec_prompt", "llm", llm=llm_klass.__name__, model=model
+        ):
+            return llm_klass.exec_prompt(prompt=prompt, model=model)
+
+    def get_prompt(
+        self,
+        context_system: dict | None = None,
+        context_user: dict | None = None,
+        prompt_override: list | None = None,
+    ):
+        """Get the prompt of `get_llm_response`. The route is selected
+        by the input of a new prompt, an overridden prompt continues
+        with the selected route."""
+        if prompt_override is not None:
+            return prompt_override
+        self.select_route([context_user or {}])
+        return self.get_llm_initial_message(
             context_system=context_system or {},
             context_user=context_user or {},
         )
-        return self.get_llm_klass().exec_prompt(
-            prompt=prompt,
-            model=self.get_llm_model(),
-        )
+
+    def get_candidates(self) -> int:
+        """Get the number of alternative responses which are requested
+        at once. 1 if disabled."""
+        candidates = self.get_job_config("candidates")
+        return max(1, int(candidates)) if candidates else self.candidates
+
+    def get_llm_response_candidates(
+        self,
+        context_system: dict | None = None,
+        context_user: dict | None = None,
+        prompt_override: list | None = None,
+    ) -> list[tuple]:
+        """Get alternative responses from the LLM for the same prompt
+        (see `LLMBase.exec_prompt_candidates`). The arguments are the
+        same as for `get_llm_response`.
+
+        Returns:
+            The distinct responses and their full contexts. A single
+            one if candidates are disabled.
+        """
+        n = self.get_candidates()
+        if n == 1:
+            return [
+                self.get_llm_response(
+                    context_system=context_system,
+                    context_user=context_user,
+                    prompt_override=prompt_override,
+                )
+            ]
+        prompt = self.get_prompt(context_system, context_user, prompt_override)
+        llm_klass = self.get_llm_klass()
+        model = self.get_llm_model()
+        with tracer.span(
+            "llm.exec_prompt_candidates",
+            "llm",
+            llm=llm_klass.__name__,
+            model=model,
+            n=n,
+        ):
+            results = llm_klass.exec_prompt_candidates(prompt=prompt, model=model, n=n)
+        candidates: dict[str, tuple] = {}
+        for result in results:
+            if result.response is not None:
+                candidates.setdefault(
+                    result.response, (result.response, result.full_context)
+                )
+        if not candidates:
+            raise results[0].error or ValueError("No candidates received")
+        return list(candidates.values())
+
+    def get_llm_responses(
+        self,
+        contexts_user: list[dict],
+        context_system: dict | None = None,
+    ) -> list[PromptResult]:
+        """Get the responses of the LLM for many user contexts at once,
+        i.e. one per file. The LLM sends as few requests as its API
+        allows (see `LLMBase.exec_prompts`).
+
+        Arguments:
+            contexts_user (list[dict]): The context which will be
+                passed to the template file for the user, one per
+                prompt
+            context_system (dict | None): Additional context which
+                will be passed to the template file for the system of
+                every prompt
+
+        Returns:
+            The result of each prompt in order. The result of a failed
+            prompt has an `error` instead of a response.
+        """
+        self.select_route(contexts_user)
+        prompts = [
+            self.get_llm_initial_message(
+                context_system=context_system or {},
+                context_user=context_user,
+            )
+            for context_user in contexts_user
+        ]
+        llm_klass = self.get_llm_klass()
+        model = self.get_llm_model()
+        with tracer.span(
+            "llm.exec_prompts",
+            "llm",
+            llm=llm_klass.__name__,
+            model=model,
+            count=len(prompts),
+        ):
+            return llm_klass.exec_prompts(prompts=prompts, model=model)
 
     def process_user_feedback_llm_loop(
         self,
         context: str,
         context_user: dict | None = None,
         context_system: dict | None = None,
+        initial_response: tuple | None = None,
     ):
         """Process user llm interaction in an infinite loop.
 
@@ -153,41 +337,174 @@ class LLMJobBase(BaseJob):
                 will be passed to the template file for the system
             context_user (dict | None): Additional context which will
                 be passed to the template file for the user
+            initial_response (tuple | None): A response and its full
+                context which was already generated (i.e. in advance).
+                If it's set, it's used instead of the first LLM call.
+
+        If the job requests many candidates (see `get_candidates`),
+        the user chooses one of them or asks for a revision.
+
+        Every response and feedback is persisted if the job has a
+        session key (see `get_llm_session_key`). If the same input
+        is processed again, the conversation is resumed right after
+        the last completed step.
         """
+        session = self.load_llm_session()
+        if session.accepted is not None:
+            logger.info("Resume %s with the already accepted response", context)
+            return session.accepted
+        if session.steps:
+            # revisions continue the conversation with the same LLM
+            self.restore_route(session.route)
+
         prompt_override = None
+        if session.steps and session.steps[-1]["feedback"] is not None:
+            # the revision was requested but never received
+            prompt_override = self.get_revision_prompt(
+                session.full_context, session.steps[-1]["feedback"]
+            )
+        elif session.steps:
+            logger.info("Resume %s with the last response", context)
+            initial_response = (session.steps[-1]["response"], session.full_context)
+        elif initial_response is not None:
+            self.save_llm_session(session, *initial_response)
+
         user_feedback = None
         while user_feedback != "y":
-            prompt_output, prompt_output_full_context = self.get_llm_response(
-                prompt_override=prompt_override,
-                context_user=context_user or {},
-                context_system=context_system or {},
-            )
-            user_feedback = ask_for_user_feedback(
-                prompt_output_context=context,
-                prompt_output=prompt_output,
-            )
-            if user_feedback != "y":
-                revision_prompt = load_template_file(
-                    template_path=self.get_template_file(type_="revision"),
-                    context={"feedback": user_feedback or "No further info provided"},
+            if initial_response is not None:
+                candidates = [initial_response]
+                initial_response = None
+            else:
+                candidates = self.get_llm_response_candidates(
+                    prompt_override=prompt_override,
+                    context_user=context_user or {},
+                    context_system=context_system or {},
                 )
-                prompt_override = (
-                    prompt_output_full_context
-                    + self.get_llm_klass().llm_parser.parse_prompt(
-                        input_data=(PromptLine(role="system", text=revision_prompt),)
-                    )
+                if len(candidates) == 1:
+                    self.save_llm_session(session, *candidates[0])
+            if len(candidates) == 1:
+                prompt_output, prompt_output_full_context = candidates[0]
+                user_feedback = ask_for_user_feedback(
+                    prompt_output_context=context,
+                    prompt_output=prompt_output,
                 )
+            else:
+                # only the chosen candidate is persisted, a revision
+                # continues the conversation of the first one
+                choice, user_feedback = ask_for_user_choice(
+                    prompt_output_context=context,
+                    prompt_outputs=[response for response, _ in candidates],
+                )
+                prompt_output, prompt_output_full_context = candidates[choice]
+                self.save_llm_session(
+                    session, prompt_output, prompt_output_full_context
+                )
+            if user_feedback != "y":
+                session.steps[-1]["feedback"] = user_feedback
+                self.save_llm_session(session)
+                prompt_override = self.get_revision_prompt(
+                    prompt_output_full_context, user_feedback
+                )
+        session.accepted = prompt_output
+        self.save_llm_session(session)
         return prompt_output
 
+    def get_revision_prompt(self, full_context, user_feedback: str):
+        """Get the prompt to continue the conversation with a revision
+        request of the user."""
+        revision_prompt = load_template_file(
+            template_path=self.get_template_file(type_="revision"),
+            context={"feedback": user_feedback or "No further info provided"},
+        )
+        return full_context + self.get_llm_klass().llm_parser.parse_prompt(
+            input_data=(PromptLine(role="system", text=revision_prompt),)
+        )
+
+    def get_llm_session_key(self) -> str | None:
+        """Get the key of the input this job is working on. The
+        conversation with the LLM is persisted by this key, so an
+        interrupted job can be resumed without repeating LLM calls.
+        If it's None, the conversation is not persisted.
+        """
+        return None
+
+    def load_llm_session(self) -> LLMSession:
+        session_key = self.get_llm_session_key()
+        if session_key is None:
+            return LLMSession(job_name=self.__class__.__name__, session_key="")
+        try:
+            return LLMSessionDBAPI.get(self.__class__.__name__, session_key)
+        except DoesNotExist:
+            return LLMSession(job_name=self.__class__.__name__, session_key=session_key)
+
+    def save_llm_session(
+        self,
+        session: LLMSession,
+        response: str | None = None,
+        full_context=None,
+    ):
+        """Add a response to the session (if given) and persist it"""
+        if response is not None:
+            session.steps.append({"response": response, "feedback": None})
+            session.full_context = full_context
+            session.route = self.get_route_name()
+        if session.session_key:
+            LLMSessionDBAPI.save(session, updated_at=int(time.time()))
+
+    def get_changed_files(self) -> list[str] | None:
+        """Get the files of the input of the job for routing. None if
+        the job doesn't work on files."""
+        return None
+
+    def select_route(self, contexts_user: list[dict]) -> Route | None:
+        """Select the LLM and model by the input (see `routing`). The
+        route is kept for following calls, i.e. for revisions. For
+        many inputs, the largest one decides."""
+        self._route = select_route(
+            self.__class__.__name__,
+            tokens=max(
+                (estimate_tokens(context_user) for context_user in contexts_user),
+                default=0,
+            ),
+            file_names=self.get_changed_files(),
+        )
+        return self._route
+
+    def get_route_name(self) -> str | None:
+        """Get the name of the selected route. None if the LLM and model
+        of the job are used."""
+        route = getattr(self, "_route", None)
+        return route.name if route is not None else None
+
+    def restore_route(self, name: str | None):
+        """Use the route which was selected for a stored response (i.e.
+        a draft or a session), so revisions of the response are sent
+        to the same LLM and model."""
+        self._route = get_route(self.__class__.__name__, name) if name else None
+        if name and self._route is None:
+            logger.warning(
+                "Route %s of %s doesn't exist anymore, use the job's LLM and model",
+                name,
+                self.__class__.__name__,
+            )
+
     def get_llm_klass(self) -> Type[LLMBase]:
         """Get the LLM API that should be used.
 
         This method will use the `llm_api` attribute of the job
-        instance. If it's not set, the default LLM API or the
-        specified LLM API in the config will be used.
+        instance. If it's not set, the LLM API of the selected route,
+        the default LLM API or the specified LLM API in the config
+        will be used. If the shared cache is configured, the LLM is
+        wrapped by it (see `llm.cache`).
         """
-        if self.llm is not None:
-            return self.llm
+        llm_klass = self.llm or self.load_llm_klass()
+        # all LLMs use the shared cache if it's configured
+        return with_cache(llm_klass) if get_cache_client() else llm_klass
+
+    def load_llm_klass(self) -> Type[LLMBase]:
+        route = getattr(self, "_route", None)
+        if route is not None and route.llm_api:
+            return llm_registry.load(route.llm_api)
 
         llm_api_name = None
         cfg_ = config.general.cfg
@@ -201,15 +518,30 @@ class LLMJobBase(BaseJob):
             raise NoJobConfigured(
                 f"No LLM API configured for job {self.__class__.__name__}"
             )
-        return getattr(llm, llm_api_name)
+        return llm_registry.load(llm_api_name)
+
+    def get_job_config(self, key: str) -> str | None:
+        """Get a config value of the job section. If it's not set,
+        the `default_<key>` of the `pygitai` section is used."""
+        cfg_ = config.general.cfg
+        value = None
+        if f"pygitai.jobs.{self.__class__.__name__}" in cfg_:
+            value = cfg_[f"pygitai.jobs.{self.__class__.__name__}"].get(key)
+        if not value and "pygitai" in cfg_:
+            value = cfg_["pygitai"].get(f"default_{key}")
+        return value
 
     def get_llm_model(self) -> str:
         """Get the LLM model that should be used.
 
         This method will use the `llm_model` attribute of the job
-        instance. If it's not set, the default LLM model or the
-        specified LLM model in the config will be used.
+        instance. If it's not set, the model of the selected route,
+        the default LLM model or the specified LLM model in the config
+        will be used.
         """
+        route = getattr(self, "_route", None)
+        if route is not None and route.llm_model:
+            return route.llm_model
         cfg_ = config.general.cfg
         llm_model = None
         if f"pygitai.jobs.{self.__class__.__name__}" in cfg_:
@@ -221,6 +553,16 @@ class LLMJobBase(BaseJob):
                 f"No LLM Model configured for job {self.__class__.__name__}"
             )
 
+    def load_templates(self):
+        """Compile the system and user templates of the job in advance
+        (see `inputs.gather_inputs`)"""
+
+        def load():
+            for type_ in ("system", "user"):
+                template_registry.get_template(self.get_template_file(type_=type_))
+
+        get_input(("templates", self.__class__.__name__), load)
+
     def get_template_file(self, type_: str) -> Path:
         """Get the template file that should be used.
 
@@ -238,7 +580,6 @@ class LLMJobBase(BaseJob):
                 return self.template_file
             return Path(self.template_file)
 
-        template_file_path = None
         template_dir = None
         template_file_name = f"{self.context}_{type_}.txt"
         cfg_ = config.general.cfg
@@ -248,7 +589,7 @@ class LLMJobBase(BaseJob):
                 "prompt_template_dir"
             )
 
-        if not template_file_path:
+        if not template_dir:
             template_dir = cfg_["pygitai"].get("default_prompt_template_dir")
 
         if not template_dir:
@@ -256,6 +597,15 @@ class LLMJobBase(BaseJob):
                 f"No LLM API configured for job {self.__class__.__name__}"
             )
 
+        cache_key = (
+            config.general.toplevel_directory,
+            template_dir,
+            template_file_name,
+        )
+        template_file_path = self._template_file_cache.get(cache_key)
+        if template_file_path is not None:
+            return template_file_path
+
         template_dir_path = config.general.toplevel_directory / Path(template_dir)
         template_file_path = template_dir_path / template_file_name
         if not template_file_path.exists():
@@ -263,6 +613,7 @@ class LLMJobBase(BaseJob):
                 f"No template file configured for job {self.__class__.__name__}"
             )
 
+        self._template_file_cache[cache_key] = template_file_path
         return template_file_path
 
     def exec_command(self, *args, **kwargs):
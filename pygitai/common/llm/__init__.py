@@ -1,16 +1,15 @@
-import sys
-
-from pygitai.common.config import config
+from pygitai.common.plugins import llm_registry
 
 from .base import LLMBase, ParserBase
-from .hugging_face import HuggingFace
-from .openai import OpenAI
 
-try:
-    sys.path.append((config.general.toplevel_directory / ".pygitai").as_posix())
-    from pygitai_customization.llm import *  # noqa
-except ModuleNotFoundError:
-    pass
+
+def __getattr__(name: str):
+    """LLM classes (built-in and custom ones) are imported lazily on
+    first access."""
+    if name.startswith("__"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return llm_registry.load(name)
+
 
 __all__ = [
     "LLMBase",
@@ -1,6 +1,13 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from dataclasses import dataclass
 from typing import Generic, Type, TypeVar
 
+from pygitai.common.streaming import Chunks
+from pygitai.common.tracing import tracer
+
+from .session import get_rate_limiter
+
 T = TypeVar("T")
 U = TypeVar("U")
 V = TypeVar("V")
@@ -13,11 +20,28 @@ class PromptLine:
 
     Attributes:
         role: The role of the line (e.g. "user" or "system")
-        text: The text of the line
+        text: The text of the line. `Chunks` are only passed to LLMs
+            which support streamed prompts.
     """
 
     role: str
-    text: str
+    text: str | Chunks
+
+
+@dataclass
+class PromptResult(Generic[U, V]):
+    """The result of a single prompt of a batch (see
+    `LLMBase.exec_prompts`)
+
+    Attributes:
+        response: The parsed response. None if the prompt failed.
+        full_context: The prompt including the response.
+        error: The error if the prompt failed.
+    """
+
+    response: V | None = None
+    full_context: U | None = None
+    error: Exception | None = None
 
 
 class ParserBase(Generic[T, U, W]):
@@ -40,6 +64,23 @@ class ParserBase(Generic[T, U, W]):
         """
         raise NotImplementedError
 
+    @staticmethod
+    def parse_responses(response: T, prompts: list[U]) -> list[W | Exception]:
+        """Parse the response of a request with many prompts (see
+        `LLMBase.exec_prompts`). Only required if the LLM batches
+        prompts natively.
+
+        Args:
+            response: The response from the language model
+            prompts: The prompts which were sent in the request.
+
+        Returns:
+            The parsed response of each prompt in the order of the
+            prompts. A prompt which failed is represented by the
+            exception.
+        """
+        raise NotImplementedError
+
     @staticmethod
     def parse_prompt(input_data: tuple[PromptLine, ...]) -> U:
         """Parse a generic code object into a specific prompt object
@@ -61,9 +102,17 @@ class LLMBase(Generic[U, V]):
         llm_parser: The parser for the language model. This is used
             to parse the response from the language model and to
             create the prompt for the LLM API.
+        streamed_prompt: If True, the texts of the prompt lines are
+            passed as `Chunks` instead of strings, so large prompts
+            are never joined in memory (see `streaming`).
+        max_concurrent_prompts: The number of prompts of a batch
+            which are executed concurrently by the default
+            `exec_prompts`.
     """
 
     llm_parser: Type[ParserBase]
+    streamed_prompt: bool = False
+    max_concurrent_prompts: int = 4
 
     @classmethod
     def get_input_token_count(cls, prompt: U) -> int:
@@ -79,3 +128,57 @@ class LLMBase(Generic[U, V]):
             model: The model to use for the prompt
         """
         raise NotImplementedError
+
+    @classmethod
+    def exec_prompt_candidates(
+        cls, prompt: U, model: str, n: int
+    ) -> list[PromptResult[U, V]]:
+        """Execute a prompt and return `n` alternative responses, so
+        the user can choose one of them instead of asking for a
+        revision.
+
+        By default, the prompt is executed `n` times concurrently (see
+        `exec_prompts`). LLMs whose API returns many candidates per
+        request override this method to send a single request.
+
+        Args:
+            prompt: The parsed prompt to execute
+            model: The model to use for the prompt
+            n: The number of candidates
+        """
+        return cls.exec_prompts([prompt] * n, model=model)
+
+    @classmethod
+    def exec_prompts(cls, prompts: list[U], model: str) -> list[PromptResult[U, V]]:
+        """Execute many prompts and return their results in order. A
+        failed prompt doesn't affect the others, its result has an
+        `error` instead.
+
+        By default, the prompts are executed concurrently by
+        `exec_prompt`. LLMs whose API accepts many inputs per request
+        override this method to send fewer requests. The limits of the
+        LLM requests of the process are applied here (see
+        `session.get_rate_limiter`).
+
+        Args:
+            prompts: The parsed prompts to execute
+            model: The model to use for the prompts
+        """
+
+        def exec_single_prompt(prompt: U) -> PromptResult[U, V]:
+            try:
+                with get_rate_limiter(), tracer.span("llm.exec_prompt", "llm"):
+                    response, full_context = cls.exec_prompt(prompt=prompt, model=model)
+            except Exception as e:
+                return PromptResult(error=e)
+            return PromptResult(response=response, full_context=full_context)
+
+        if len(prompts) <= 1:
+            return [exec_single_prompt(prompt) for prompt in prompts]
+        max_workers = max(1, min(cls.max_concurrent_prompts, len(prompts)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(copy_context().run, exec_single_prompt, prompt)
+                for prompt in prompts
+            ]
+            return [future.result() for future in futures]
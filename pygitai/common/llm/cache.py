@@ -0,0 +1,218 @@
+"""Client of the shared cache of LLM results (see `cache_server`).
+
+The cache is enabled by `PYGITAI_CACHE_URL` (and `PYGITAI_CACHE_TOKEN`
+if the server requires authentication). Every LLM is wrapped by
+`with_cache` then: the result of a prompt is looked up by the hash of
+the LLM, the model and the prompt before the LLM is called, new
+results are stored afterwards. Candidates (see
+`LLMBase.exec_prompt_candidates`) are never cached, they should
+differ.
+
+If the cache is unreachable, the LLM is called as if there was no
+cache. The cache isn't asked again for `PYGITAI_CACHE_RETRY_AFTER`
+seconds.
+"""
+import hashlib
+import json
+import threading
+import time
+import zlib
+from contextvars import ContextVar
+from functools import cache
+from typing import Type
+
+import requests
+
+from pygitai.common.config import config
+from pygitai.common.logger import get_logger
+from pygitai.common.streaming import compress_json, iter_json
+from pygitai.common.tracing import tracer
+
+from .base import LLMBase, PromptResult
+from .session import get_session
+
+logger = get_logger(__name__, config.logger.level)
+
+# set while the wrapped LLM is called, so results which are looked up
+# by a batch aren't looked up again by each single prompt
+bypass_cache: ContextVar[bool] = ContextVar("bypass_cache", default=False)
+
+
+def get_key(llm_name: str, model: str, prompt) -> str:
+    """Get the key of a prompt. The prompt is hashed piece by piece,
+    it's never encoded as a whole."""
+    digest = hashlib.sha256()
+    for piece in iter_json({"llm": llm_name, "model": model, "prompt": prompt}):
+        digest.update(piece.encode())
+    return digest.hexdigest()
+
+
+class CacheClient:
+    """Look up and store values in the shared cache. Errors of the
+    cache are logged and never raised.
+
+    Attributes:
+        url: The base url of the cache server.
+        token: The authentication token.
+        timeout: The timeout of a single request in seconds.
+        retry_after: Seconds the cache isn't asked after an error.
+    """
+
+    def __init__(self, url: str, token: str | None, timeout: float, retry_after: float):
+        self.url = url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._unavailable_until = 0.0
+        self._lock = threading.Lock()
+
+    def request(self, method: str, key: str, data: bytes | None = None):
+        if time.monotonic() < self._unavailable_until:
+            return None
+        headers = {"Authorization": f"Bearer {self.token}"} if self.token else {}
+        try:
+            with tracer.span("llm.cache", "llm", method=method):
+                response = get_session().request(
+                    method,
+                    f"{self.url}/v1/entries/{key}",
+                    headers=headers,
+                    data=data,
+                    timeout=self.timeout,
+                )
+            if response.status_code in (401, 403):
+                raise requests.HTTPError(f"{response.status_code}, check the token")
+        except requests.RequestException as e:
+            with self._lock:
+                if time.monotonic() >= self._unavailable_until:
+                    logger.warning(
+                        "LLM cache %s not available, continue without it for %d s: %s",
+                        self.url,
+                        self.retry_after,
+                        e,
+                    )
+                self._unavailable_until = time.monotonic() + self.retry_after
+            return None
+        return response
+
+    def get(self, key: str):
+        response = self.request("GET", key)
+        if response is None or response.status_code != 200:
+            return None
+        try:
+            return json.loads(zlib.decompress(response.content))
+        except (zlib.error, ValueError) as e:
+            logger.warning("Invalid LLM cache entry %s: %s", key, e)
+            return None
+
+    def put(self, key: str, value):
+        try:
+            data = compress_json(value)
+        except (TypeError, ValueError) as e:
+            # the response of the LLM can't be encoded as JSON
+            logger.debug("Can't cache %s: %s", key, e)
+            return
+        self.request("PUT", key, data=data)
+
+
+@cache
+def get_cache_client() -> CacheClient | None:
+    """Get the client of the shared cache. None if it's disabled."""
+    if not config.llm_cache.url:
+        return None
+    return CacheClient(
+        url=config.llm_cache.url,
+        token=config.llm_cache.token,
+        timeout=config.llm_cache.timeout,
+        retry_after=config.llm_cache.retry_after,
+    )
+
+
+class CachedLLMMixin(LLMBase):
+    """Look up the results of the wrapped LLM in the shared cache
+    (see `with_cache`)"""
+
+    llm_name: str
+
+    @classmethod
+    def exec_prompt(cls, prompt, model):
+        client = get_cache_client()
+        if client is None or bypass_cache.get():
+            return super().exec_prompt(prompt=prompt, model=model)
+        key = get_key(cls.llm_name, model, prompt)
+        value = client.get(key)
+        if value is not None:
+            logger.info("LLM cache hit for %s (%s)", cls.llm_name, model)
+            return value["response"], value["full_context"]
+        response, full_context = super().exec_prompt(prompt=prompt, model=model)
+        client.put(key, {"response": response, "full_context": full_context})
+        return response, full_context
+
+    @classmethod
+    def exec_prompts(cls, prompts, model):
+        client = get_cache_client()
+        if client is None or bypass_cache.get():
+            return super().exec_prompts(prompts=prompts, model=model)
+        keys = [get_key(cls.llm_name, model, prompt) for prompt in prompts]
+        results: list[PromptResult | None] = []
+        for key in keys:
+            value = client.get(key)
+            results.append(
+                None
+                if value is None
+                else PromptResult(
+                    response=value["response"], full_context=value["full_context"]
+                )
+            )
+        missing = [index for index, result in enumerate(results) if result is None]
+        logger.info(
+            "LLM cache hits for %s (%s): %d of %d",
+            cls.llm_name,
+            model,
+            len(prompts) - len(missing),
+            len(prompts),
+        )
+        if missing:
+            token = bypass_cache.set(True)
+            try:
+                missing_results = super().exec_prompts(
+                    prompts=[prompts[index] for index in missing], model=model
+                )
+            finally:
+                bypass_cache.reset(token)
+            for index, result in zip(missing, missing_results):
+                results[index] = result
+                if result.error is None:
+                    client.put(
+                        keys[index],
+                        {
+                            "response": result.response,
+                            "full_context": result.full_context,
+                        },
+                    )
+        return results
+
+    @classmethod
+    def exec_prompt_candidates(cls, prompt, model, n):
+        token = bypass_cache.set(True)
+        try:
+            return super().exec_prompt_candidates(prompt=prompt, model=model, n=n)
+        finally:
+            bypass_cache.reset(token)
+
+
+# the cached subclass of each LLM (see `with_cache`)
+_cached_klasses: dict[Type[LLMBase], Type[LLMBase]] = {}
+_cached_klasses_lock = threading.Lock()
+
+
+def with_cache(llm_klass: Type[LLMBase]) -> Type[LLMBase]:
+    """Get a subclass of the LLM which uses the shared cache. The
+    subclass is created once per LLM."""
+    with _cached_klasses_lock:
+        if llm_klass not in _cached_klasses:
+            _cached_klasses[llm_klass] = type(
+                llm_klass.__name__,
+                (CachedLLMMixin, llm_klass),
+                {"llm_name": llm_klass.__name__, "__module__": llm_klass.__module__},
+            )
+        return _cached_klasses[llm_klass]
@@ -1,8 +1,10 @@
 import requests
 
 from pygitai.common.config import config
-from pygitai.common.llm.base import LLMBase, ParserBase, PromptLine
-from pygitai.common.logger import get_logger
+from pygitai.common.llm.base import LLMBase, ParserBase, PromptLine, PromptResult
+from pygitai.common.llm.session import get_rate_limiter, get_session
+from pygitai.common.logger import LazyStr, get_logger
+from pygitai.common.tracing import tracer
 
 logger = get_logger(__name__, config.logger.level)
 
@@ -13,35 +15,124 @@ class HuggingFaceParser(ParserBase[requests.Response, str, str]):
         """Parse the response from OpenAI"""
         return " ".join([data["generated_text"] for data in response.json()])
 
+    @staticmethod
+    def parse_candidates(response: requests.Response) -> list[str]:
+        """Parse all generations of a single input with
+        `num_return_sequences` > 1"""
+        return [generation["generated_text"] for generation in response.json()]
+
+    @staticmethod
+    def parse_responses(response, prompts):
+        """Parse the response of many inputs. Each input has a list
+        of generations or a single one."""
+        data = response.json()
+        if not isinstance(data, list) or len(data) != len(prompts):
+            raise ValueError(f"Expected {len(prompts)} results, got {data!r}")
+        results: list[str | Exception] = []
+        for item in data:
+            generations = item if isinstance(item, list) else [item]
+            errors = [
+                generation["error"]
+                for generation in generations
+                if "error" in generation
+            ]
+            if errors:
+                results.append(ValueError(", ".join(map(str, errors))))
+            else:
+                results.append(
+                    " ".join(generation["generated_text"] for generation in generations)
+                )
+        return results
+
     @staticmethod
     def parse_prompt(input_data: tuple[PromptLine, ...]):
         """Parse the input data and return a list of dict"""
-        return "\n\n".join([row.text for row in input_data])
+        return "\n\n".join([str(row.text) for row in input_data])
 
 
 class HuggingFace(LLMBase[str, str]):
     config = config.hugging_face
     llm_parser = HuggingFaceParser
+    # the number of inputs which are sent in a single request
+    max_batch_size = 16
 
     @classmethod
-    def exec_prompt(cls, prompt, model):
-        payload = {
-            "inputs": prompt,
-        }
-        logger.info("Wait for hugging-face response")
-        logger.debug(f"Send Payload to hugging-face: {payload}")
-        response = requests.post(
-            f"https://api-inference.huggingface.co/models/{model}",
-            headers={"Authorization": f"Bearer {cls.config.api_token}"},
-            json=payload,
-        )
+    def post_inputs(cls, inputs, model, **parameters) -> requests.Response:
+        """Send one or many inputs to the inference API. Additional
+        parameters (i.e. `num_return_sequences`) are added to the
+        payload."""
+        payload: dict = {"inputs": inputs}
+        if parameters:
+            payload["parameters"] = parameters
+        logger.debug("Send Payload to hugging-face: %s", payload)
+        with tracer.span("llm.http", "llm"):
+            response = get_session().post(
+                f"https://api-inference.huggingface.co/models/{model}",
+                headers={"Authorization": f"Bearer {cls.config.api_token}"},
+                json=payload,
+            )
         response.raise_for_status()
         logger.info("HuggingFace response received")
-        logger.debug(f"HuggingFace response: {response.json()}")
+        logger.debug("HuggingFace response: %s", LazyStr(response.json))
+        return response
 
+    @classmethod
+    def exec_prompt(cls, prompt, model):
+        logger.info("Wait for hugging-face response")
+        response = cls.post_inputs(prompt, model)
         parsed_llm_response = cls.llm_parser.parse_response(
             prompt=prompt,
             response=response,
         )
         full_context = f"{prompt}\n\n{parsed_llm_response}"
         return parsed_llm_response, full_context
+
+    @classmethod
+    def exec_prompts(cls, prompts, model):
+        """Send the prompts as list of inputs, `max_batch_size` per
+        request"""
+        results = []
+        for start in range(0, len(prompts), cls.max_batch_size):
+            end = start + cls.max_batch_size
+            batch = prompts[start:end]
+            logger.info("Wait for hugging-face response of %d inputs", len(batch))
+            try:
+                with get_rate_limiter(), tracer.span(
+                    "llm.exec_prompts", "llm", batch_size=len(batch)
+                ):
+                    response = cls.post_inputs(batch, model)
+                parsed_llm_responses = cls.llm_parser.parse_responses(
+                    prompts=batch,
+                    response=response,
+                )
+            except Exception as e:
+                parsed_llm_responses = [e] * len(batch)
+            for prompt, parsed_llm_response in zip(batch, parsed_llm_responses):
+                if isinstance(parsed_llm_response, Exception):
+                    results.append(PromptResult(error=parsed_llm_response))
+                else:
+                    results.append(
+                        PromptResult(
+                            response=parsed_llm_response,
+                            full_context=f"{prompt}\n\n{parsed_llm_response}",
+                        )
+                    )
+        return results
+
+    @classmethod
+    def exec_prompt_candidates(cls, prompt, model, n):
+        """Get all candidates by a single request. The generations are
+        sampled, otherwise they would be identical."""
+        logger.info("Wait for %d hugging-face candidates", n)
+        try:
+            with get_rate_limiter(), tracer.span("llm.exec_prompt", "llm", n=n):
+                response = cls.post_inputs(
+                    prompt, model, do_sample=True, num_return_sequences=n
+                )
+            candidates = cls.llm_parser.parse_candidates(response)
+        except Exception as e:
+            return [PromptResult(error=e)]
+        return [
+            PromptResult(response=candidate, full_context=f"{prompt}\n\n{candidate}")
+            for candidate in candidates
+        ]
@@ -1,9 +1,14 @@
+import logging
+
 import requests
 
 from pygitai.common.config import config
-from pygitai.common.logger import get_logger
+from pygitai.common.logger import LazyStr, get_logger
+from pygitai.common.streaming import JSONBody
+from pygitai.common.tracing import traced, tracer
 
-from .base import LLMBase, ParserBase, PromptLine
+from .base import LLMBase, ParserBase, PromptLine, PromptResult
+from .session import get_rate_limiter, get_session
 
 logger = get_logger(__name__, config.logger.level)
 
@@ -14,6 +19,11 @@ class OpenAIParser(ParserBase[requests.Response, list, str]):
         """Parse the response from OpenAI"""
         return response.json()["choices"][0]["message"]["content"]
 
+    @staticmethod
+    def parse_choices(response: requests.Response) -> list[str]:
+        """Parse all choices of a response with `n` > 1"""
+        return [choice["message"]["content"] for choice in response.json()["choices"]]
+
     @staticmethod
     def parse_prompt(input_data: tuple[PromptLine, ...]):
         """Parse the input data and return a list of dict"""
@@ -29,21 +39,30 @@ class OpenAIParser(ParserBase[requests.Response, list, str]):
 class OpenAI(LLMBase[list, str]):
     config = config.openai
     llm_parser = OpenAIParser
+    streamed_prompt = True
+    # the chat completions API takes a single conversation per request,
+    # so batches are sent as concurrent requests over the pooled
+    # connections (see `LLMBase.exec_prompts`)
+    max_concurrent_prompts = 8
 
     @classmethod
+    @traced("llm.token_count", "llm")
     def get_prompt_token_count(cls, prompt):
         """Return the number of tokens in the prompt
         This method is created based on OpenAIs article:
         https://help.openai.com/en/articles/4936856-what-are-tokens-and-how-to-count-them  # noqa
         """
-        prompt_ = " ".join([row["content"] for row in prompt])
-        return len(prompt_) // 4
+        # the same as the length of the joined contents, without
+        # joining them
+        length = sum(len(row["content"]) for row in prompt) + len(prompt) - 1
+        return max(length, 0) // 4
 
     @classmethod
-    def exec_prompt(cls, prompt, model):
-        """Execute a prompt and return the result"""
+    def post_prompt(cls, prompt, model, **parameters) -> requests.Response:
+        """Send a prompt to the chat completions API. Additional
+        parameters (i.e. `n`) are added to the payload."""
         calculated_token_count = cls.get_prompt_token_count(prompt)
-        logger.info(f"Token input count: {calculated_token_count}")
+        logger.info("Token input count: %d", calculated_token_count)
         if calculated_token_count > cls.config.openai_api_token_limit:
             raise ValueError(
                 f"Token count {calculated_token_count} exceeds the limit of "
@@ -52,21 +71,33 @@ class OpenAI(LLMBase[list, str]):
         payload = {
             "model": model,
             "messages": prompt,
+            **parameters,
         }
         logger.info("Wait for openai response")
-        logger.debug(f"Send Payload to OpenAI: {payload}")
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {cls.config.openai_key_secret}",
-            },
-            json=payload,
-        )
+        logger.debug("Send Payload to OpenAI: %s", payload)
+        with tracer.span("llm.http", "llm"):
+            response = get_session().post(
+                "https://api.openai.com/v1/chat/completions",
+                headers={
+                    "Authorization": f"Bearer {cls.config.openai_key_secret}",
+                    "Content-Type": "application/json",
+                },
+                # the body is encoded while it's sent
+                data=JSONBody(payload),
+            )
         response.raise_for_status()
         logger.info("OpenAI response received")
-        logger.info(f"Real Prompt token: {response.json()['usage']['prompt_tokens']}")
-        logger.info(f"Total token: {response.json()['usage']['total_tokens']}")
-        logger.debug(f"OpenAI response: {response.json()}")
+        if logger.isEnabledFor(logging.INFO):
+            usage = response.json()["usage"]
+            logger.info("Real Prompt token: %d", usage["prompt_tokens"])
+            logger.info("Total token: %d", usage["total_tokens"])
+        logger.debug("OpenAI response: %s", LazyStr(response.json))
+        return response
+
+    @classmethod
+    def exec_prompt(cls, prompt, model):
+        """Execute a prompt and return the result"""
+        response = cls.post_prompt(prompt, model)
         parsed_llm_response = cls.llm_parser.parse_response(
             prompt=prompt,
             response=response,
@@ -78,3 +109,21 @@ class OpenAI(LLMBase[list, str]):
             },
         ]
         return parsed_llm_response, full_context
+
+    @classmethod
+    def exec_prompt_candidates(cls, prompt, model, n):
+        """Get all candidates by a single request with the `n`
+        parameter. The prompt tokens are only paid once."""
+        try:
+            with get_rate_limiter(), tracer.span("llm.exec_prompt", "llm", n=n):
+                response = cls.post_prompt(prompt, model, n=n)
+            choices = cls.llm_parser.parse_choices(response)
+        except Exception as e:
+            return [PromptResult(error=e)]
+        return [
+            PromptResult(
+                response=choice,
+                full_context=prompt + [{"role": "assistant", "content": choice}],
+            )
+            for choice in choices
+        ]
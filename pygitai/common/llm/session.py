@@ -0,0 +1,66 @@
+import threading
+import time
+from functools import cache
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from pygitai.common.config import config
+
+
+@cache
+def get_session() -> requests.Session:
+    """Get the HTTP session of this process. Connections are pooled
+    and reused by all LLM requests, i.e. between the jobs of a
+    pipeline, between the commands served by the daemon or between
+    the repositories of the multi-repository mode.
+    """
+    session = requests.Session()
+    # keep a connection per concurrent request
+    adapter = HTTPAdapter(
+        pool_maxsize=max(10, config.llm_limits.max_concurrent_requests)
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class RateLimiter:
+    """Limit the number of concurrent requests and optionally the
+    requests per minute. Requests are started at an even interval
+    instead of in bursts.
+
+    Used as context manager around a single request.
+    """
+
+    def __init__(
+        self, max_concurrent_requests: int, max_requests_per_minute: int | None = None
+    ):
+        self._semaphore = threading.BoundedSemaphore(max(1, max_concurrent_requests))
+        self._interval = 60 / max_requests_per_minute if max_requests_per_minute else 0
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        if self._interval:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_start)
+                self._next_start = start + self._interval
+            if start > now:
+                time.sleep(start - now)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._semaphore.release()
+
+
+@cache
+def get_rate_limiter() -> RateLimiter:
+    """Get the rate limiter which is shared by all LLM requests of
+    this process (see `config.llm_limits`)"""
+    return RateLimiter(
+        max_concurrent_requests=config.llm_limits.max_concurrent_requests,
+        max_requests_per_minute=config.llm_limits.max_requests_per_minute,
+    )
@@ -1,21 +1,85 @@
+import json
 import logging
+from functools import cache
+
+from .config import config
+
+
+class LazyStr:
+    """Log argument which is built only if the record is emitted.
+
+    Example:
+        logger.debug("Payload: %s", LazyStr(json.dumps, payload))
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self) -> str:
+        return str(self.func(*self.args, **self.kwargs))
+
+
+class JSONFormatter(logging.Formatter):
+    """Format a record as a single JSON line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data)
+
+
+@cache
+def get_stream_handler() -> logging.Handler:
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    )
+    return stream_handler
+
+
+@cache
+def get_json_handler() -> logging.Handler | None:
+    """The JSON lines sink is enabled by `PYGITAI_LOG_JSON_FILE`"""
+    if config.logger.json_file is None:
+        return None
+    json_handler = logging.FileHandler(config.logger.json_file, delay=True)
+    json_handler.setFormatter(JSONFormatter())
+    return json_handler
+
+
+def get_log_level(name: str, default: int | str) -> int | str:
+    """Get the level of a logger. Levels of subsystems can be set by
+    `PYGITAI_LOG_LEVELS`, i.e. `pygitai.common.git=DEBUG`. The most
+    specific subsystem wins."""
+    level, matched = default, ""
+    for subsystem, subsystem_level in config.logger.levels.items():
+        if (name == subsystem or name.startswith(f"{subsystem}.")) and len(
+            subsystem
+        ) > len(matched):
+            level, matched = subsystem_level, subsystem
+    return level
 
 
 def get_logger(
     name: str,
     log_level: int | str = logging.INFO,
 ) -> logging.Logger:
+    """Get a configured logger. Calling this function more than once
+    for the same name doesn't add further handlers."""
     logger = logging.getLogger(name)
-    logger.setLevel(log_level)
-
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    )
-
-    stream_handler = logging.StreamHandler()
-    stream_handler.setLevel(log_level)
-    stream_handler.setFormatter(formatter)
+    logger.setLevel(get_log_level(name, log_level))
 
-    logger.addHandler(stream_handler)
+    handlers = [get_stream_handler(), get_json_handler()]
+    for handler in handlers:
+        if handler is not None and handler not in logger.handlers:
+            logger.addHandler(handler)
 
     return logger
@@ -0,0 +1,198 @@
+import ast
+import importlib
+import json
+import sys
+from importlib.metadata import entry_points
+from pathlib import Path
+
+from .config import config
+from .logger import get_logger
+
+logger = get_logger(__name__, config.logger.level)
+
+CUSTOMIZATION_PACKAGE = "pygitai_customization"
+
+
+class PluginNotFound(AttributeError):
+    """No plugin with the given name was found"""
+
+
+def get_customization_root() -> Path:
+    # plugins are imported once per process, so the customizations of
+    # the repository the process was started in are used for all
+    # repositories in the multi-repository mode
+    return config.default_general.toplevel_directory / ".pygitai"
+
+
+def add_customization_root_to_path():
+    customization_root = get_customization_root().as_posix()
+    if customization_root not in sys.path:
+        sys.path.append(customization_root)
+
+
+def get_defined_classes(file_path: Path, module: str) -> dict[str, str]:
+    """Get the public classes of a python file without importing it.
+
+    Classes which are imported relatively (i.e. in an `__init__.py`)
+    are mapped to the module they are defined in.
+    """
+    try:
+        tree = ast.parse(file_path.read_bytes(), filename=file_path.as_posix())
+    except (OSError, SyntaxError) as e:
+        logger.warning("Can't read plugins of %s: %s", file_path, e)
+        return {}
+
+    package = module if file_path.name == "__init__.py" else module.rpartition(".")[0]
+    classes = {}
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef):
+            classes[node.name] = module
+        elif isinstance(node, ast.ImportFrom) and node.level == 1 and node.module:
+            for alias in node.names:
+                classes[alias.asname or alias.name] = f"{package}.{node.module}"
+    return {name: module for name, module in classes.items() if name[0] != "_"}
+
+
+class PluginRegistry:
+    """Registry of classes which can be extended by plugins (i.e. LLM
+    classes).
+
+    A plugin is looked up by its name in the following order:
+
+    1. The customization directory of the project
+        (`.pygitai/pygitai_customization/<group>`).
+    2. The built-in classes of pygitai.
+    3. The entry points of installed packages
+        (`pygitai.<group>`).
+
+    Only the module of the requested plugin is imported. The classes
+    of the customization directory are found by parsing the source
+    files. The result is cached in a manifest in the `.pygitai`
+    directory and rebuilt when the directory or one of its files
+    changes.
+
+    Attributes:
+        group: The name of the plugin group (i.e. llm).
+        builtins: The built-in classes by name. The values are the
+            modules which define the classes.
+    """
+
+    manifest_file_name = "plugin_manifest.json"
+
+    def __init__(self, group: str, builtins: dict[str, str]):
+        self.group = group
+        self.builtins = builtins
+        self._manifest: dict[str, str] | None = None
+        self._manifest_key: list | None = None
+        self._loaded: dict[str, type] = {}
+
+    @property
+    def customization_dir(self) -> Path:
+        return get_customization_root() / CUSTOMIZATION_PACKAGE / self.group
+
+    @property
+    def entry_point_group(self) -> str:
+        return f"pygitai.{self.group}"
+
+    def get_manifest_key(self) -> list | None:
+        """The key of the manifest are the mtimes of the customization
+        directory and its python files. Nothing is read for this."""
+        try:
+            key: list = [self.customization_dir.stat().st_mtime_ns]
+            for file_path in sorted(self.customization_dir.glob("*.py")):
+                key.append([file_path.name, file_path.stat().st_mtime_ns])
+        except OSError:
+            return None
+        return key
+
+    def build_manifest(self) -> dict[str, str]:
+        manifest = {}
+        module_base = f"{CUSTOMIZATION_PACKAGE}.{self.group}"
+        for file_path in sorted(self.customization_dir.glob("*.py")):
+            if file_path.name == "__init__.py":
+                continue
+            manifest.update(
+                get_defined_classes(file_path, f"{module_base}.{file_path.stem}")
+            )
+        # explicit exports of the package take precedence
+        manifest.update(
+            get_defined_classes(self.customization_dir / "__init__.py", module_base)
+        )
+        return manifest
+
+    def get_manifest(self) -> dict[str, str]:
+        """Get the custom plugins by name. The values are the modules
+        which define the plugins."""
+        key = self.get_manifest_key()
+        if key is None:
+            return {}
+        if self._manifest is not None and self._manifest_key == key:
+            return self._manifest
+
+        manifest_file = get_customization_root() / self.manifest_file_name
+        try:
+            manifests = json.loads(manifest_file.read_text())
+        except (OSError, ValueError):
+            manifests = {}
+        cached = manifests.get(self.group)
+        if cached and cached["key"] == key:
+            manifest = cached["plugins"]
+        else:
+            manifest = self.build_manifest()
+            manifests[self.group] = {"key": key, "plugins": manifest}
+            try:
+                manifest_file.write_text(json.dumps(manifests))
+            except OSError:
+                pass
+            # modules might have changed, don't serve outdated classes
+            self._loaded.clear()
+            module_base = f"{CUSTOMIZATION_PACKAGE}.{self.group}"
+            for module in list(sys.modules):
+                if module == module_base or module.startswith(f"{module_base}."):
+                    del sys.modules[module]
+
+        self._manifest, self._manifest_key = manifest, key
+        return manifest
+
+    def load_entry_point(self, name: str) -> type | None:
+        for entry_point in entry_points(group=self.entry_point_group):
+            if entry_point.name == name:
+                return entry_point.load()
+        return None
+
+    def load(self, name: str) -> type:
+        """Import and return a plugin by its name"""
+        manifest = self.get_manifest()
+        if name in self._loaded:
+            return self._loaded[name]
+
+        if name in manifest:
+            add_customization_root_to_path()
+            klass = getattr(importlib.import_module(manifest[name]), name)
+        elif name in self.builtins:
+            klass = getattr(importlib.import_module(self.builtins[name]), name)
+        else:
+            klass = self.load_entry_point(name)
+            if klass is None:
+                raise PluginNotFound(f"No {self.group} plugin named {name} found")
+
+        self._loaded[name] = klass
+        return klass
+
+    def names(self) -> list[str]:
+        """Get the names of all available plugins"""
+        names = set(self.builtins) | set(self.get_manifest())
+        names |= {
+            entry_point.name
+            for entry_point in entry_points(group=self.entry_point_group)
+        }
+        return sorted(names)
+
+
+llm_registry = PluginRegistry(
+    "llm",
+    builtins={
+        "OpenAI": "pygitai.common.llm.openai",
+        "HuggingFace": "pygitai.common.llm.hugging_face",
+    },
+)
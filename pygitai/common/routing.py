@@ -0,0 +1,181 @@
+"""Select the LLM and model of a job by the size of its input.
+
+Routes are configured per job in sections named
+`[pygitai.jobs.<job>.route.<name>]` or for all jobs in
+`[pygitai.route.<name>]`. The routes of a job are checked in the
+order of the config files and the first matching one is used. Without
+a matching route, the `llm_api` and `llm_model` of the job are used.
+
+Conditions of a route (all optional, all must match):
+
+- `min_tokens` / `max_tokens`: The estimated tokens of the input.
+- `min_files` / `max_files`: The number of changed files.
+- `change_types`: Comma separated types (`docs`, `tests`, `config`,
+  `code`). Every changed file must be of one of these types.
+"""
+import fnmatch
+from dataclasses import dataclass
+from pathlib import PurePosixPath
+
+from .config import config
+from .logger import get_logger
+from .streaming import Chunks
+
+logger = get_logger(__name__, config.logger.level)
+
+# file name patterns by change type, patterns without a slash are
+# matched against the file name only
+CHANGE_TYPE_PATTERNS = {
+    "docs": ("*.md", "*.rst", "*.txt", "*.adoc", "docs/*", "*/docs/*", "LICENSE*"),
+    "tests": (
+        "test_*.py",
+        "*_test.py",
+        "*_test.go",
+        "*.spec.*",
+        "*.test.*",
+        "tests/*",
+        "*/tests/*",
+        "test/*",
+        "*/test/*",
+    ),
+    "config": (
+        "*.ini",
+        "*.cfg",
+        "*.toml",
+        "*.yaml",
+        "*.yml",
+        "*.json",
+        ".*rc",
+        "Dockerfile",
+        "Makefile",
+    ),
+}
+CONDITION_KEYS = ("min_tokens", "max_tokens", "min_files", "max_files")
+
+
+def get_change_type(file_name: str) -> str:
+    name = PurePosixPath(file_name).name
+    for change_type, patterns in CHANGE_TYPE_PATTERNS.items():
+        for pattern in patterns:
+            if fnmatch.fnmatch(file_name if "/" in pattern else name, pattern):
+                return change_type
+    return "code"
+
+
+def estimate_tokens(value) -> int:
+    """Estimate the tokens of a template context without joining any
+    texts (the same estimation as `OpenAI`)"""
+    if isinstance(value, (str, Chunks)):
+        return len(value) // 4
+    if isinstance(value, dict):
+        return sum(estimate_tokens(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_tokens(item) for item in value)
+    return 0
+
+
+@dataclass
+class Route:
+    """A rule which maps inputs to a LLM and model.
+
+    Attributes:
+        name: The name of the route (the last part of its section).
+        llm_api: The LLM to use. None for the LLM of the job.
+        llm_model: The model to use. None for the model of the job.
+    """
+
+    name: str
+    llm_api: str | None = None
+    llm_model: str | None = None
+    min_tokens: int | None = None
+    max_tokens: int | None = None
+    min_files: int | None = None
+    max_files: int | None = None
+    change_types: frozenset[str] | None = None
+
+    def matches(self, tokens: int, file_names: list[str] | None) -> bool:
+        if self.min_tokens is not None and tokens < self.min_tokens:
+            return False
+        if self.max_tokens is not None and tokens > self.max_tokens:
+            return False
+        if self.min_files is None and self.max_files is None and not self.change_types:
+            return True
+        if file_names is None:
+            # the job doesn't work on files
+            return False
+        if self.min_files is not None and len(file_names) < self.min_files:
+            return False
+        if self.max_files is not None and len(file_names) > self.max_files:
+            return False
+        if self.change_types and not all(
+            get_change_type(file_name) in self.change_types for file_name in file_names
+        ):
+            return False
+        return True
+
+
+def get_routes(job_name: str) -> list[Route]:
+    """Get the routes of a job. The routes for all jobs are only used
+    if the job has no routes of its own."""
+    cfg_ = config.general.cfg
+    for prefix in (f"pygitai.jobs.{job_name}.route.", "pygitai.route."):
+        routes = []
+        for section_name in cfg_.sections():
+            if not section_name.startswith(prefix):
+                continue
+            section = cfg_[section_name]
+            change_types = section.get("change_types")
+            routes.append(
+                Route(
+                    name=section_name.removeprefix(prefix),
+                    llm_api=section.get("llm_api"),
+                    llm_model=section.get("llm_model"),
+                    change_types=(
+                        frozenset(
+                            change_type.strip()
+                            for change_type in change_types.split(",")
+                            if change_type.strip()
+                        )
+                        if change_types
+                        else None
+                    ),
+                    **{
+                        key: section.getint(key)
+                        for key in CONDITION_KEYS
+                        if section.get(key)
+                    },
+                )
+            )
+        if routes:
+            return routes
+    return []
+
+
+def get_route(job_name: str, name: str) -> Route | None:
+    """Get a route of the job by its name. None if it doesn't exist
+    (anymore)."""
+    return next((route for route in get_routes(job_name) if route.name == name), None)
+
+
+def select_route(
+    job_name: str, tokens: int, file_names: list[str] | None
+) -> Route | None:
+    """Get the first route of the job which matches the input. Every
+    decision is logged."""
+    routes = get_routes(job_name)
+    if not routes:
+        return None
+    route = next((route for route in routes if route.matches(tokens, file_names)), None)
+    logger.info(
+        "Route %s: ~%d tokens, %s file(s) -> %s",
+        job_name,
+        tokens,
+        "no" if file_names is None else len(file_names),
+        (
+            f"{route.name} ({route.llm_api or 'job LLM'}, "
+            f"{route.llm_model or 'job model'})"
+            if route
+            else "no matching route, use the job's LLM and model"
+        ),
+    )
+    return route
@@ -0,0 +1,126 @@
+"""Helpers to assemble prompts without copying large texts.
+
+A diff can be huge. Instead of joining it into new strings at every
+step (formatting, template rendering, JSON encoding of the request),
+the text is kept as `Chunks`, a sequence of strings which references
+the original strings. The request body is encoded incrementally from
+the chunks by `JSONBody`.
+"""
+import json
+import zlib
+from typing import Iterable, Iterator
+
+# large strings are encoded in slices of this size
+SLICE_SIZE = 64 * 1024
+
+
+class Chunks:
+    """Text which is stored as a sequence of strings. The strings are
+    only joined if `str()` is called.
+
+    Attributes:
+        chunks: The strings of the text in order.
+    """
+
+    __slots__ = ("chunks",)
+
+    def __init__(self, chunks: Iterable[str] = ()):
+        self.chunks = [chunk for chunk in chunks if chunk]
+
+    def __len__(self) -> int:
+        # the number of characters like for a string. Chunks are not
+        # iterable on purpose, i.e. `list()` would use the length as
+        # size hint.
+        return sum(len(chunk) for chunk in self.chunks)
+
+    def __bool__(self) -> bool:
+        return bool(self.chunks)
+
+    def __str__(self) -> str:
+        return "".join(self.chunks)
+
+    def __repr__(self) -> str:
+        return f"<Chunks: {len(self.chunks)} chunk(s), {len(self)} characters>"
+
+
+def iter_slices(text: str | Chunks) -> Iterator[str]:
+    for chunk in text.chunks if isinstance(text, Chunks) else (text,):
+        for start in range(0, len(chunk), SLICE_SIZE):
+            end = start + SLICE_SIZE
+            yield chunk[start:end]
+
+
+def iter_json(obj) -> Iterator[str]:
+    """Encode an object as JSON piece by piece. Strings and `Chunks`
+    are encoded in slices, so no full copy of them is created. The
+    result is ASCII only, like `json.dumps`."""
+    if isinstance(obj, (str, Chunks)):
+        yield '"'
+        for piece in iter_slices(obj):
+            yield json.dumps(piece)[1:-1]
+        yield '"'
+    elif isinstance(obj, dict):
+        yield "{"
+        for index, (key, value) in enumerate(obj.items()):
+            yield f"{', ' if index else ''}{json.dumps(str(key))}: "
+            yield from iter_json(value)
+        yield "}"
+    elif isinstance(obj, (list, tuple)):
+        yield "["
+        for index, value in enumerate(obj):
+            if index:
+                yield ", "
+            yield from iter_json(value)
+        yield "]"
+    else:
+        yield json.dumps(obj)
+
+
+def dumps(obj) -> str:
+    """Like `json.dumps`, but `Chunks` are supported"""
+    return "".join(iter_json(obj))
+
+
+def compress_json(obj) -> bytes:
+    """Encode an object as JSON and compress it with zlib without
+    creating the uncompressed JSON in memory"""
+    compressor = zlib.compressobj()
+    compressed = [compressor.compress(piece.encode()) for piece in iter_json(obj)]
+    compressed.append(compressor.flush())
+    return b"".join(compressed)
+
+
+class JSONBody:
+    """HTTP request body which is encoded incrementally from a JSON
+    object. It can be passed as `data` to `requests`. The length is
+    known in advance, so the body is sent with a `Content-Length`
+    header and without chunked transfer encoding.
+
+    Attributes:
+        obj: The object to encode.
+        buffer_size: The size of the pieces which are sent.
+    """
+
+    def __init__(self, obj, buffer_size: int = SLICE_SIZE):
+        self.obj = obj
+        self.buffer_size = buffer_size
+        self._length: int | None = None
+
+    def __len__(self) -> int:
+        if self._length is None:
+            # the encoded JSON is ASCII only
+            self._length = sum(len(piece) for piece in iter_json(self.obj))
+        return self._length
+
+    def __iter__(self) -> Iterator[bytes]:
+        buffer: list[str] = []
+        buffer_length = 0
+        for piece in iter_json(self.obj):
+            buffer.append(piece)
+            buffer_length += len(piece)
+            if buffer_length >= self.buffer_size:
+                yield "".join(buffer).encode()
+                buffer = []
+                buffer_length = 0
+        if buffer:
+            yield "".join(buffer).encode()
@@ -0,0 +1,220 @@
+"""Index of the definitions and references of the repository.
+
+The index is stored in the pygitai database and covers all files of
+the git index with a supported language (see `code_context`). It's
+updated incrementally: only files whose blob ID changed since the
+last update are parsed again.
+
+The index is used to attach the definitions which are called by a
+diff and the references of the definitions which are changed by a
+diff to the prompts of review jobs.
+"""
+import re
+import threading
+import time
+from collections import Counter
+from textwrap import dedent, indent
+
+from .code_context import HUNK_HEADER_PATTERN, MAX_BLOB_SIZE, get_language
+from .config import config
+from .db_api import Symbol, SymbolIndexDBAPI
+from .git import Git
+from .logger import get_logger
+from .tracing import traced
+
+logger = get_logger(__name__, config.logger.level)
+
+CALL_PATTERN = re.compile(r"\b([A-Za-z_]\w*)\s*\(")
+# names which are defined more often are too ambiguous to be useful
+MAX_DEFINITIONS_PER_NAME = 3
+MAX_REFERENCES_PER_NAME = 10
+
+
+class SymbolIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    @traced("symbol_index.update", "git")
+    def update(self):
+        """Parse all files whose blob changed since the last update
+        and remove the files which don't exist anymore"""
+        with self._lock:
+            start = time.perf_counter()
+            index_blobs = {
+                file_name: blob_id
+                for file_name, blob_id in Git.get_index_blobs().items()
+                if get_language(file_name) is not None
+            }
+            stored_blobs = SymbolIndexDBAPI.get_file_blobs()
+            file_blobs: dict[str, str | None] = {
+                file_name: blob_id
+                for file_name, blob_id in index_blobs.items()
+                if stored_blobs.get(file_name) != blob_id
+            }
+            file_blobs.update(
+                {
+                    file_name: None
+                    for file_name in stored_blobs
+                    if file_name not in index_blobs
+                }
+            )
+            if not file_blobs:
+                return
+
+            contents = Git.read_blobs(
+                list({blob_id for blob_id in file_blobs.values() if blob_id})
+            )
+            symbols = []
+            references = []
+            for file_name, blob_id in file_blobs.items():
+                content = contents.get(blob_id) if blob_id else None
+                if not content or len(content) > MAX_BLOB_SIZE or b"\0" in content:
+                    continue
+                language = get_language(file_name)
+                source = content.decode(errors="replace")
+                symbols.extend(
+                    Symbol(
+                        file_name=file_name,
+                        name=scope.name,
+                        kind=scope.kind,
+                        line=scope.start,
+                        end_line=scope.end,
+                        signature=scope.signature,
+                        docstring=scope.docstring,
+                    )
+                    for scope in language.parse(source)
+                )
+                references.extend(
+                    (file_name, name, line)
+                    for name, line in language.get_references(source).items()
+                )
+            SymbolIndexDBAPI.replace_files(file_blobs, symbols, references)
+            logger.info(
+                "Updated symbol index for %d file(s) in %.1f ms",
+                len(file_blobs),
+                (time.perf_counter() - start) * 1000,
+            )
+
+
+symbol_index = SymbolIndex()
+
+
+def get_changes(file_diff: str) -> tuple[list[str], list[int]]:
+    """Get the added and removed lines of a file diff and the line
+    numbers of the added lines in the post-image"""
+    changed_lines = []
+    added_line_numbers = []
+    line_number = 0
+    in_hunk = False
+    for line in file_diff.splitlines():
+        match = HUNK_HEADER_PATTERN.match(line)
+        if match:
+            line_number = int(match.group(3))
+            in_hunk = True
+        elif not in_hunk:
+            continue
+        elif line.startswith("+"):
+            changed_lines.append(line[1:])
+            added_line_numbers.append(line_number)
+            line_number += 1
+        elif line.startswith("-"):
+            changed_lines.append(line[1:])
+        elif line.startswith(" "):
+            line_number += 1
+    return changed_lines, added_line_numbers
+
+
+def render_definition(symbol: Symbol) -> str:
+    lines = [f"# {symbol.file_name}:{symbol.line}", dedent(symbol.signature)]
+    if symbol.docstring:
+        lines.append(indent(f'"""{symbol.docstring}"""', "    "))
+    return "\n".join(lines)
+
+
+def count_tokens(text: str) -> int:
+    # the same estimation as `pygitai.common.llm.openai.OpenAI`
+    return len(text) // 4
+
+
+def is_indexed(head_ref: str | None) -> bool:
+    """Check if the index covers the post-image of a diff. Only the
+    checkout is indexed, that is the staged changes (None) and HEAD."""
+    if head_ref is None:
+        return True
+    head_commit = Git.resolve_commit(head_ref)
+    return head_commit is not None and head_commit == Git.resolve_commit("HEAD")
+
+
+@traced("symbol_index.get_symbol_context", "git")
+def get_symbol_context(
+    diff: dict[str, str], max_tokens: int, head_ref: str | None = None
+) -> str:
+    """Get the references of the definitions which are changed by the
+    diff and the definitions which are called by the diff, most
+    relevant first, within a token budget.
+
+    Arguments:
+        diff (dict[str, str]): The plain diff per file.
+        max_tokens (int): The maximum (estimated) number of tokens of
+            the result.
+        head_ref (str | None): The ref of the post-image of the diff.
+            None for the staged changes. Empty if the ref isn't
+            checked out, the index doesn't match its files.
+    """
+    if not is_indexed(head_ref):
+        logger.info("Skip symbol context, %s is not checked out", head_ref)
+        return ""
+    symbol_index.update()
+    start = time.perf_counter()
+
+    called_names: Counter[str] = Counter()
+    changed_symbols: list[Symbol] = []
+    for file_name, file_diff in diff.items():
+        changed_lines, added_line_numbers = get_changes(file_diff)
+        for line in changed_lines:
+            called_names.update(CALL_PATTERN.findall(line))
+        changed_symbols.extend(
+            SymbolIndexDBAPI.find_definitions_at(file_name, added_line_numbers)
+        )
+
+    blocks = []
+    for symbol in changed_symbols:
+        references = [
+            f"{file_name}:{line}"
+            for file_name, line in SymbolIndexDBAPI.find_references(
+                symbol.name, limit=MAX_REFERENCES_PER_NAME
+            )
+            if file_name != symbol.file_name
+        ]
+        if references:
+            blocks.append(
+                f"# {symbol.name} ({symbol.file_name}) is referenced by: "
+                + ", ".join(references)
+            )
+
+    changed = {(symbol.file_name, symbol.line) for symbol in changed_symbols}
+    definitions: dict[str, list[Symbol]] = {}
+    for symbol in SymbolIndexDBAPI.find_definitions(list(called_names)):
+        if (symbol.file_name, symbol.line) not in changed:
+            definitions.setdefault(symbol.name, []).append(symbol)
+    for name, _ in called_names.most_common():
+        symbols = definitions.get(name, [])
+        if 0 < len(symbols) <= MAX_DEFINITIONS_PER_NAME:
+            blocks.extend(render_definition(symbol) for symbol in symbols)
+
+    result = []
+    used_tokens = 0
+    for block in blocks:
+        tokens = count_tokens(block)
+        if used_tokens + tokens > max_tokens:
+            continue
+        result.append(block)
+        used_tokens += tokens
+
+    logger.info(
+        "Symbol lookup took %.1f ms (%d block(s), ~%d tokens)",
+        (time.perf_counter() - start) * 1000,
+        len(result),
+        used_tokens,
+    )
+    return "\n\n".join(result)
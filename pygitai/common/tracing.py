@@ -0,0 +1,87 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from pathlib import Path
+
+
+class Tracer:
+    """Collect nested spans and export them as Chrome trace events.
+
+    The trace file can be opened with `chrome://tracing` or
+    https://ui.perfetto.dev. If the tracer is disabled, spans are
+    no-ops.
+
+    Attributes:
+        enabled: True while a trace is recorded.
+        events: The recorded trace events.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.events: list[dict] = []
+        self.output_file: Path | None = None
+        self._disabled_span = nullcontext()
+
+    def start(self, output_file: Path):
+        self.events = []
+        self.output_file = output_file
+        self.enabled = True
+
+    def stop(self):
+        """Stop recording and write the trace file"""
+        if not self.enabled:
+            return
+        self.enabled = False
+        if self.output_file is not None:
+            self.output_file.write_text(
+                json.dumps({"traceEvents": self.events, "displayTimeUnit": "ms"})
+            )
+        self.events = []
+
+    def span(self, name: str, category: str = "pygitai", **args):
+        """Context manager which records the enclosed code as span"""
+        if not self.enabled:
+            return self._disabled_span
+        return self._span(name, category, args)
+
+    @contextmanager
+    def _span(self, name: str, category: str, args: dict):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = time.perf_counter_ns()
+            self.events.append(
+                {
+                    "name": name,
+                    "cat": category,
+                    "ph": "X",
+                    "ts": start / 1000,
+                    "dur": (end - start) / 1000,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": {key: str(value) for key, value in args.items()},
+                }
+            )
+
+
+tracer = Tracer()
+
+
+def traced(name: str, category: str = "pygitai"):
+    """Decorator which records each call of a function as span"""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with tracer.span(name, category):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
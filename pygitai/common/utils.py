@@ -1,8 +1,13 @@
 import re
+import uuid
 from pathlib import Path
 
 import jinja2
 
+from .config import config
+from .streaming import Chunks
+from .tracing import traced
+
 
 def camel_to_snake(name):
     """Convert camel case to snake case."""
@@ -10,14 +15,105 @@ def camel_to_snake(name):
     return re.sub(r"([a-z0-9])([A-Z])", r"\1_\2", name).lower()
 
 
+class TemplateRegistry:
+    """Process wide registry of jinja environments.
+
+    One environment is created per template directory. The
+    environments keep the compiled templates in memory and reload
+    them if the template file was modified. Compiled templates are
+    stored in a bytecode cache on disk as well, so a new process
+    doesn't need to compile them again.
+
+    Attributes:
+        bytecode_cache_dir (Path | None): The directory of the
+            bytecode cache. If it's None, no bytecode cache is used.
+    """
+
+    def __init__(self, bytecode_cache_dir: Path | None = None):
+        self.bytecode_cache_dir = bytecode_cache_dir
+        self.environments: dict[Path, jinja2.Environment] = {}
+        self._bytecode_cache: jinja2.BytecodeCache | None = None
+
+    def get_bytecode_cache(self) -> jinja2.BytecodeCache | None:
+        if self._bytecode_cache is None and self.bytecode_cache_dir is not None:
+            try:
+                self.bytecode_cache_dir.mkdir(exist_ok=True)
+            except OSError:
+                # i.e. pygitai is not set up in this repository yet
+                return None
+            self._bytecode_cache = jinja2.FileSystemBytecodeCache(
+                self.bytecode_cache_dir.as_posix()
+            )
+        return self._bytecode_cache
+
+    def get_environment(self, directory: Path) -> jinja2.Environment:
+        """Get the environment for a template directory"""
+        environment = self.environments.get(directory)
+        if environment is None:
+            environment = self.environments.setdefault(
+                directory,
+                jinja2.Environment(
+                    loader=jinja2.FileSystemLoader(directory),
+                    bytecode_cache=self.get_bytecode_cache(),
+                    auto_reload=True,
+                ),
+            )
+        return environment
+
+    def get_template(self, template_path: Path) -> jinja2.Template:
+        """Get the compiled template of a template file"""
+        environment = self.get_environment(template_path.parent)
+        return environment.get_template(template_path.name)
+
+
+template_registry = TemplateRegistry(
+    bytecode_cache_dir=config.general.template_cache_dir,
+)
+
+
+@traced("template.load_template_file", "template")
 def load_template_file(
     template_path: Path,
     context: dict,
 ) -> str:
     """Get the prompt from the template"""
-    template_env = jinja2.Environment(
-        loader=jinja2.FileSystemLoader(template_path.parent)
-    )
-    file_name = template_path.name
-    template = template_env.get_template(file_name)
+    template = template_registry.get_template(template_path)
     return template.render(**context)
+
+
+@traced("template.render_template_chunks", "template")
+def render_template_chunks(template_path: Path, context: dict) -> Chunks:
+    """Render a template without copying the `Chunks` of the context.
+
+    The template is rendered in streaming mode with a placeholder for
+    each `Chunks` value. The placeholders in the output are replaced
+    by the chunks. If a placeholder doesn't show up in the output
+    (i.e. because the template applies a filter to the value), the
+    template is rendered as usual.
+    """
+    placeholders = {}
+    render_context = dict(context)
+    for key, value in context.items():
+        if isinstance(value, Chunks):
+            placeholder = f"\x00{uuid.uuid4().hex}\x00"
+            placeholders[placeholder] = value
+            render_context[key] = placeholder
+    template = template_registry.get_template(template_path)
+    if not placeholders:
+        return Chunks(template.generate(**render_context))
+
+    pattern = re.compile("|".join(re.escape(p) for p in placeholders))
+    chunks: list[str] = []
+    found = set()
+    for piece in template.generate(**render_context):
+        position = 0
+        for match in pattern.finditer(piece):
+            start = match.start()
+            chunks.append(piece[position:start])
+            chunks.extend(placeholders[match.group()].chunks)
+            found.add(match.group())
+            position = match.end()
+        chunks.append(piece[position:])
+    if found != set(placeholders):
+        return Chunks([template.render(**context)])
+    return Chunks(chunks)
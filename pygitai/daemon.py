@@ -0,0 +1,361 @@
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import traceback
+from pathlib import Path
+
+# This module is imported by the cli before anything else. Don't import
+# any pygitai module on module level, otherwise the client isn't thin
+# anymore.
+
+SOCKET_NAME = "daemon.sock"
+LOG_FILE_NAME = "daemon.log"
+# AF_UNIX paths are limited to 108 bytes on linux (including NUL)
+MAX_SOCKET_PATH_LENGTH = 107
+# env vars with these prefixes configure a command
+COMMAND_ENV_PREFIXES = ("PYGITAI_", "PYGIT_", "OPENAI_", "HUGGING_FACE_")
+
+
+class DaemonError(Exception):
+    """The daemon could not be started or reached"""
+
+
+def get_socket_path(toplevel_directory: Path | None = None) -> Path | None:
+    """Get the socket path of the daemon for the current repository.
+
+    Returns None if the current directory is not part of a git
+    repository or if the path is too long for a unix socket.
+    """
+    if toplevel_directory is None:
+        response = subprocess.run(
+            ["git", "rev-parse", "--show-toplevel"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+        if response.returncode != 0:
+            return None
+        toplevel_directory = Path(response.stdout.strip())
+    socket_path = toplevel_directory / ".pygitai" / SOCKET_NAME
+    if len(os.fsencode(socket_path)) > MAX_SOCKET_PATH_LENGTH:
+        return None
+    return socket_path
+
+
+def get_command_env() -> dict[str, str]:
+    """Get the env vars of this process which configure a command"""
+    return {
+        key: value
+        for key, value in os.environ.items()
+        if key.startswith(COMMAND_ENV_PREFIXES) and key != "PYGITAI_NO_DAEMON"
+    }
+
+
+def send_message(connection: socket.socket, message: dict, fds: tuple[int, ...] = ()):
+    data = json.dumps(message).encode() + b"\n"
+    if fds:
+        socket.send_fds(connection, [data], fds)
+    else:
+        connection.sendall(data)
+
+
+def recv_message(connection: socket.socket, max_fds: int = 0) -> tuple[dict, list]:
+    buffer = b""
+    fds: list[int] = []
+    while not buffer.endswith(b"\n"):
+        data, fds_, _, _ = socket.recv_fds(connection, 65536, max_fds)
+        if not data:
+            raise ConnectionError("Connection closed")
+        buffer += data
+        fds.extend(fds_)
+    return json.loads(buffer), fds
+
+
+def read_message(reader) -> dict:
+    """Read the next message from a file object of a connection"""
+    line = reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed")
+    return json.loads(line)
+
+
+def connect(socket_path: Path) -> socket.socket | None:
+    """Connect to a running daemon. Returns None if no daemon is
+    listening on the socket."""
+    if not socket_path.exists():
+        return None
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(os.fspath(socket_path))
+    except OSError:
+        connection.close()
+        return None
+    return connection
+
+
+def forward(argv: list[str]) -> int | None:
+    """Forward a cli command to the daemon of the current repository.
+
+    The stdin, stdout and stderr file descriptors of this process are
+    passed to the daemon, so interactive commands keep working.
+
+    The daemon answers with its pid as soon as the command starts.
+    The daemon is not part of the terminal's process group, that's
+    why interrupts are forwarded to that pid.
+
+    The daemon reads its env vars only once when it starts. If the
+    env vars which configure a command differ from the ones of the
+    daemon, the daemon refuses the command and it runs in this process.
+
+    Returns the exit code of the command or None if no daemon is
+    running or if the daemon refused the command.
+    """
+    if os.environ.get("PYGITAI_NO_DAEMON"):
+        return None
+    socket_path = get_socket_path()
+    if socket_path is None:
+        return None
+    connection = connect(socket_path)
+    if connection is None:
+        return None
+
+    with connection:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        send_message(
+            connection,
+            {
+                "action": "run",
+                "argv": argv,
+                "cwd": os.getcwd(),
+                "env": get_command_env(),
+            },
+            fds=(0, 1, 2),
+        )
+        reader = connection.makefile("rb")
+        pid = None
+        interrupted = False
+        while True:
+            try:
+                response = read_message(reader)
+                if "returncode" in response:
+                    return response["returncode"]
+                if response.get("env_mismatch"):
+                    return None
+                pid = response["pid"]
+                if interrupted:
+                    os.kill(pid, signal.SIGINT)
+            except KeyboardInterrupt:
+                if pid is None:
+                    # forwarded as soon as the command started
+                    interrupted = True
+                else:
+                    os.kill(pid, signal.SIGINT)
+            except (ConnectionError, ValueError):
+                return 1
+
+
+def request(action: str) -> dict | None:
+    """Send a control request (i.e. status, stop) to the daemon"""
+    socket_path = get_socket_path()
+    connection = connect(socket_path) if socket_path else None
+    if connection is None:
+        return None
+    with connection:
+        send_message(connection, {"action": action})
+        response, _ = recv_message(connection)
+        return response
+
+
+class Daemon:
+    """Serve pygitai commands from a single warm process. The daemon
+    keeps imports, the parsed config, the git state, template caches
+    and pooled HTTP sessions alive between commands.
+
+    Commands are executed one after another in the daemon process.
+    The file descriptors 0, 1 and 2 of the client are attached to the
+    daemon for the duration of a command. SIGINT interrupts the
+    running command only, it's ignored while the daemon is idle.
+
+    Attributes:
+        socket_path: The path of the unix socket to listen on.
+        idle_timeout: Seconds without any request after which the
+            daemon shuts down.
+    """
+
+    def __init__(self, socket_path: Path, idle_timeout: float):
+        self.socket_path = socket_path
+        self.idle_timeout = idle_timeout
+        self.started_at = time.time()
+        self.last_request_at = time.monotonic()
+        self.request_count = 0
+        self.running = False
+        self.config_mtimes: dict[Path, float | None] = {}
+        self.env = get_command_env()
+
+    def warm_up(self):
+        """Import everything a command needs and remember the state of
+        the config files."""
+        from pygitai import cli, cmd  # noqa
+        from pygitai.common.config import get_config_file_paths
+
+        self.config_mtimes = {fp: self.get_mtime(fp) for fp in get_config_file_paths()}
+
+    @staticmethod
+    def get_mtime(file_path: Path) -> float | None:
+        try:
+            return file_path.stat().st_mtime
+        except OSError:
+            return None
+
+    def reload_if_changed(self):
+        """Reload the config files if they were modified and refresh
+        the git state which might have changed since the last
+        command."""
+        from pygitai.common.config import reload_config_file
+        from pygitai.common.git import state
+
+        config_mtimes = {fp: self.get_mtime(fp) for fp in self.config_mtimes}
+        if config_mtimes != self.config_mtimes:
+            reload_config_file()
+            self.config_mtimes = config_mtimes
+        state.refresh()
+
+    def serve_forever(self):
+        self.warm_up()
+        if self.socket_path.exists():
+            if connect(self.socket_path) is not None:
+                raise DaemonError(f"Daemon already running on {self.socket_path}")
+            self.socket_path.unlink()
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(os.fspath(self.socket_path))
+        os.chmod(self.socket_path, 0o600)
+        server.listen()
+        server.settimeout(1)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        self.running = True
+        try:
+            while self.running:
+                try:
+                    connection, _ = server.accept()
+                except socket.timeout:
+                    if time.monotonic() - self.last_request_at > self.idle_timeout:
+                        self.running = False
+                    continue
+                with connection:
+                    connection.settimeout(None)
+                    self.handle(connection)
+                self.last_request_at = time.monotonic()
+        finally:
+            server.close()
+            self.socket_path.unlink(missing_ok=True)
+
+    def handle(self, connection: socket.socket):
+        try:
+            message, fds = recv_message(connection, max_fds=3)
+        except (ConnectionError, ValueError):
+            return
+        action = message.get("action")
+        response: dict[str, object]
+        if action == "run" and message.get("env") != self.env:
+            # the config was read from the env of the daemon, the
+            # client runs the command itself
+            response = {"env_mismatch": True}
+        elif action == "run":
+            try:
+                send_message(connection, {"pid": os.getpid()})
+            except OSError:
+                pass
+            returncode = self.run(message["argv"], message["cwd"], fds)
+            response = {"returncode": returncode}
+        elif action == "status":
+            response = {
+                "pid": os.getpid(),
+                "started_at": self.started_at,
+                "request_count": self.request_count,
+            }
+        elif action == "stop":
+            self.running = False
+            response = {"stopped": True}
+        else:
+            response = {"error": f"Unknown action {action}"}
+        for fd in fds if "returncode" not in response else []:
+            os.close(fd)
+        try:
+            send_message(connection, response)
+        except OSError:
+            pass
+
+    def run(self, argv: list[str], cwd: str, fds: list[int]) -> int:
+        """Run a cli command with the file descriptors of the client"""
+        from pygitai import cli
+
+        self.request_count += 1
+        saved_fds = [os.dup(fd) for fd in (0, 1, 2)]
+        saved_cwd = os.getcwd()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for target_fd, client_fd in zip((0, 1, 2), fds):
+            os.dup2(client_fd, target_fd)
+            os.close(client_fd)
+        try:
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            os.chdir(cwd)
+            self.reload_if_changed()
+            cli.run(argv)
+            returncode = 0
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else int(bool(e.code))
+        except KeyboardInterrupt:
+            returncode = 130
+        except BaseException:
+            traceback.print_exc()
+            returncode = 1
+        finally:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            except OSError:
+                pass
+            for target_fd, saved_fd in zip((0, 1, 2), saved_fds):
+                os.dup2(saved_fd, target_fd)
+                os.close(saved_fd)
+            os.chdir(saved_cwd)
+        return returncode
+
+
+def detach(log_file: Path):
+    """Detach the current process from the terminal (double fork)"""
+    if os.fork() > 0:
+        os._exit(0)
+    os.setsid()
+    if os.fork() > 0:
+        os._exit(0)
+    with open(os.devnull, "rb") as devnull:
+        os.dup2(devnull.fileno(), 0)
+    with open(log_file, "ab") as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+
+
+def serve(toplevel_directory: Path, idle_timeout: float, foreground: bool = False):
+    """Start a daemon for the given repository"""
+    socket_path = get_socket_path(toplevel_directory)
+    if socket_path is None:
+        raise DaemonError(
+            "Socket path is too long. Set PYGITAI_NO_DAEMON to run without daemon."
+        )
+    if connect(socket_path) is not None:
+        raise DaemonError(f"Daemon already running on {socket_path}")
+    if not foreground:
+        detach(socket_path.parent / LOG_FILE_NAME)
+    # the daemon must never forward to itself
+    os.environ["PYGITAI_NO_DAEMON"] = "1"
+    os.chdir(toplevel_directory)
+    Daemon(socket_path, idle_timeout=idle_timeout).serve_forever()